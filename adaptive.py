@@ -0,0 +1,149 @@
+"""Adaptive question selection from Elo-style ability and difficulty estimates.
+
+Abilities (users.ability) and difficulties (quizzes.difficulty) share a
+logit scale: a user answers a question correctly with probability
+1 / (1 + exp(difficulty - ability)), as in the 1PL (Rasch) IRT model. Both
+estimates move online after every answer by K * (outcome - expected), with K
+shrinking as an estimate accumulates answers.
+
+Picking the next question reads a DifficultyIndex: question ids sorted by
+difficulty and grouped into fixed-width buckets, so a pick is a binary search
+over bucket numbers plus a few random probes, independent of the bank size.
+"""
+import argparse
+import math
+import random
+import time
+
+import numpy as np
+from sqlalchemy import select, update
+
+from database import engine, Quiz, User
+
+# Step size of a fresh estimate and how fast it shrinks with answers
+K_BASE = 0.4
+K_DECAY = 0.05
+# Chance of a correct answer the selector aims for
+TARGET_SUCCESS = 0.6
+# Width of a difficulty bucket in logits
+BUCKET_WIDTH = 0.25
+# Random probes of a bucket before falling back to filtering it
+PROBES = 8
+
+_users = User.__table__
+_quizzes = Quiz.__table__
+
+
+def expected_score(ability, difficulty):
+    """Probability of a correct answer."""
+    return 1 / (1 + math.exp(difficulty - ability))
+
+
+def step_size(rated_answers):
+    return K_BASE / (1 + K_DECAY * (rated_answers or 0))
+
+
+def target_difficulty(ability):
+    """Difficulty answered correctly with probability TARGET_SUCCESS."""
+    return ability - math.log(TARGET_SUCCESS / (1 - TARGET_SUCCESS))
+
+
+def get_ability(conn, user_id):
+    return conn.execute(select(_users.c.ability).where(_users.c.id == user_id)).scalar() or 0.0
+
+
+def record_answer(user_id, quiz_id, correct):
+    """Update the user's ability and the question's difficulty; returns the new ability.
+
+    Both updates are increments applied inside the database, so answers
+    submitted concurrently by other users are not lost.
+    """
+    with engine.begin() as conn:
+        ability, user_answers = conn.execute(
+            select(_users.c.ability, _users.c.rated_answers).where(_users.c.id == user_id)
+        ).one()
+        difficulty, quiz_answers = conn.execute(
+            select(_quizzes.c.difficulty, _quizzes.c.rated_answers).where(_quizzes.c.id == quiz_id)
+        ).one()
+        surprise = float(correct) - expected_score(ability or 0.0, difficulty or 0.0)
+        conn.execute(update(_quizzes).where(_quizzes.c.id == quiz_id).values(
+            difficulty=_quizzes.c.difficulty - step_size(quiz_answers) * surprise,
+            rated_answers=_quizzes.c.rated_answers + 1
+        ))
+        return conn.execute(update(_users).where(_users.c.id == user_id).values(
+            ability=_users.c.ability + step_size(user_answers) * surprise,
+            rated_answers=_users.c.rated_answers + 1
+        ).returning(_users.c.ability)).scalar()
+
+
+class DifficultyIndex:
+    """Question ids grouped into difficulty buckets for constant-time picks."""
+
+    def __init__(self, ids, difficulties, bucket_width=BUCKET_WIDTH):
+        ids = np.asarray(ids, dtype=np.int64)
+        buckets = np.floor(np.asarray(difficulties, dtype=np.float64) / bucket_width).astype(np.int64)
+        order = np.argsort(buckets, kind='stable')
+        self.ids = ids[order]
+        self.width = bucket_width
+        # Bucket numbers present and where each one starts in self.ids
+        self.buckets, starts = np.unique(buckets[order], return_index=True)
+        self.starts = np.append(starts, len(self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _pick_from(self, position, exclude, rng):
+        start, stop = int(self.starts[position]), int(self.starts[position + 1])
+        for _ in range(PROBES):
+            quiz_id = int(self.ids[rng.randrange(start, stop)])
+            if quiz_id not in exclude:
+                return quiz_id
+        # Small or mostly excluded bucket
+        remaining = [quiz_id for quiz_id in self.ids[start:stop].tolist() if quiz_id not in exclude]
+        return rng.choice(remaining) if remaining else None
+
+    def pick(self, target, exclude=frozenset(), rng=random):
+        """Random question from the bucket nearest target difficulty, skipping exclude; None if exhausted."""
+        bucket = math.floor(target / self.width)
+        right = int(np.searchsorted(self.buckets, bucket))
+        left = right - 1
+        while left >= 0 or right < len(self.buckets):
+            # Visit buckets in order of distance from the target
+            if right >= len(self.buckets) or (left >= 0 and bucket - self.buckets[left] <= self.buckets[right] - bucket):
+                position, left = left, left - 1
+            else:
+                position, right = right, right + 1
+            quiz_id = self._pick_from(position, exclude, rng)
+            if quiz_id is not None:
+                return quiz_id
+        return None
+
+
+def build_difficulty_index(conn):
+    """DifficultyIndex of every unique question."""
+    rows = conn.execute(
+        select(_quizzes.c.id, _quizzes.c.difficulty).where(_quizzes.c.question_hash.isnot(None))
+    ).all()
+    return DifficultyIndex([quiz_id for quiz_id, _ in rows], [difficulty or 0.0 for _, difficulty in rows])
+
+
+def _benchmark(question_count, repeats):
+    """Time picks from an index over synthetic difficulties."""
+    rng = random.Random(42)
+    start = time.perf_counter()
+    index = DifficultyIndex(range(1, question_count + 1), [rng.gauss(0, 1.5) for _ in range(question_count)])
+    print(f"Built index of {question_count:,} questions in {(time.perf_counter() - start) * 1000:.1f} ms")
+    targets = [rng.gauss(0, 2) for _ in range(repeats)]
+    exclude = set(range(1, 10))
+    start = time.perf_counter()
+    for target in targets:
+        index.pick(target, exclude, rng)
+    print(f"pick: {(time.perf_counter() - start) / repeats * 1e6:.1f} us")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time adaptive question picks")
+    parser.add_argument('--questions', type=int, default=100_000)
+    parser.add_argument('--repeats', type=int, default=10000)
+    args = parser.parse_args()
+    _benchmark(args.questions, args.repeats)
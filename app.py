@@ -1,7 +1,9 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 
+from bulk_ingest import DEFAULT_CHUNK_SIZE, bulk_insert
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///ml_app.db'
@@ -60,6 +62,43 @@ def create_quiz():
         return redirect(url_for('quiz'))
     return render_template('create_quiz.html')
 
+QUIZ_FIELDS = ('question', 'option_a', 'option_b', 'option_c', 'option_d', 'correct_answer')
+
+@app.route('/create_quiz/batch', methods=['POST'])
+def create_quiz_batch():
+    """Insert a JSON list of quiz questions in one bulk transaction."""
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        questions = payload.get('questions')
+        chunk_size = payload.get('chunk_size', DEFAULT_CHUNK_SIZE)
+    else:
+        questions = payload
+        chunk_size = request.args.get('chunk_size', DEFAULT_CHUNK_SIZE, type=int)
+    
+    if not isinstance(questions, list) or not questions:
+        return jsonify(error='Expected a non-empty JSON list of questions'), 400
+    if not isinstance(chunk_size, int) or chunk_size < 1:
+        return jsonify(error='chunk_size must be a positive integer'), 400
+    
+    rows = []
+    for index, item in enumerate(questions):
+        if not isinstance(item, dict):
+            return jsonify(error=f'Question {index} must be a JSON object'), 400
+        missing = [field for field in QUIZ_FIELDS if not item.get(field)]
+        if missing:
+            return jsonify(error=f'Question {index} is missing {", ".join(missing)}'), 400
+        not_text = [field for field in QUIZ_FIELDS if not isinstance(item[field], str)]
+        if not_text:
+            return jsonify(error=f'Question {index} has non-string {", ".join(not_text)}'), 400
+        row = {field: item[field] for field in QUIZ_FIELDS}
+        row['correct_answer'] = row['correct_answer'].strip().upper()
+        if row['correct_answer'] not in ('A', 'B', 'C', 'D'):
+            return jsonify(error=f'Question {index} has correct_answer {item["correct_answer"]!r}, expected A-D'), 400
+        rows.append(row)
+    
+    stats = bulk_insert(db.engine, Quiz.__table__, rows, chunk_size=chunk_size)
+    return jsonify(rows=stats.rows, seconds=stats.seconds, rows_per_sec=stats.rows_per_sec), 201
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
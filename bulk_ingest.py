@@ -0,0 +1,94 @@
+"""Bulk insert path for ingesting many rows (e.g. imported quiz questions) at once."""
+import hashlib
+import time
+import unicodedata
+from collections import namedtuple
+from datetime import datetime
+from itertools import islice
+
+# Rows sent to the database per executemany() call
+DEFAULT_CHUNK_SIZE = 500
+
+
+class IngestStats(namedtuple('IngestStats', ['rows', 'seconds', 'skipped'], defaults=[0])):
+    """Number of rows written, the wall time it took and rows skipped as duplicates."""
+    __slots__ = ()
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.seconds if self.seconds else float(self.rows)
+
+
+# Databases with INSERT ... ON CONFLICT, which every upsert and duplicate skip relies on
+SUPPORTED_DIALECTS = ('sqlite', 'postgresql')
+
+
+def dialect_insert(bind, table):
+    """Dialect-specific INSERT construct supporting ON CONFLICT clauses."""
+    if bind.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif bind.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        raise NotImplementedError(f"ON CONFLICT is not supported on {bind.dialect.name}")
+    return insert(table)
+
+
+def _insert_ignoring_duplicates(engine, table):
+    """INSERT that silently skips rows violating a unique constraint."""
+    return dialect_insert(engine, table).on_conflict_do_nothing()
+
+
+def bulk_insert(engine, table, rows, chunk_size=DEFAULT_CHUNK_SIZE, ignore_duplicates=False):
+    """Insert an iterable of row dicts into table with executemany-style Core inserts.
+
+    All chunks are written inside a single transaction, so either every row is
+    stored or none is. With ignore_duplicates, rows that violate a unique
+    constraint are skipped instead of failing the batch. Returns IngestStats.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+
+    stmt = _insert_ignoring_duplicates(engine, table) if ignore_duplicates else table.insert()
+    rows = iter(rows)
+    inserted = skipped = 0
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            result = conn.execute(stmt, chunk)
+            written = result.rowcount if ignore_duplicates else len(chunk)
+            inserted += written
+            skipped += len(chunk) - written
+    return IngestStats(inserted, time.perf_counter() - start, skipped)
+
+
+def normalize_question(text):
+    """Canonical form of a question used for duplicate detection."""
+    text = unicodedata.normalize('NFKC', text or '')
+    return ' '.join(text.casefold().split())
+
+
+def question_hash(text):
+    """SHA-256 hex digest of the normalized question text."""
+    return hashlib.sha256(normalize_question(text).encode('utf-8')).hexdigest()
+
+
+def quiz_rows_from_questions(questions, source=None):
+    """Convert extracted {'question', 'options', 'answer'} dicts into quizzes table rows."""
+    now = datetime.utcnow()
+    for q in questions:
+        options = {letter.lower(): text for letter, text in q['options'].items()}
+        yield {
+            'question': q['question'],
+            'question_hash': question_hash(q['question']),
+            'option_a': options.get('a', ''),
+            'option_b': options.get('b', ''),
+            'option_c': options.get('c', ''),
+            'option_d': options.get('d', ''),
+            'correct_answer': (q.get('answer') or 'A').upper(),
+            'source': source,
+            'created_at': now
+        }
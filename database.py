@@ -0,0 +1,327 @@
+"""Data-access layer: engine, connection pool, sessions and models.
+
+Imported modules live for the whole process, so the engine and its pool are
+created once and shared by every Streamlit session instead of being rebuilt
+on every script rerun.
+"""
+import os
+from datetime import datetime
+
+from sqlalchemy import create_engine, make_url, event, inspect, select, text, BigInteger, Column, Date, Index, Integer, Float, String, DateTime, Text, LargeBinary, ForeignKey
+from sqlalchemy.orm import declarative_base, scoped_session, sessionmaker
+
+from bulk_ingest import question_hash, SUPPORTED_DIALECTS
+from http_cache import source_key
+
+# Point this at another database (e.g. a local Postgres) with the DATABASE_URL variable
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///quiz_db.db')
+# Connections kept open in the pool, and extra ones allowed under bursts
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+# Milliseconds SQLite waits on a locked database before raising "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+
+def _create_engine(url):
+    dialect = make_url(url).get_backend_name()
+    if dialect not in SUPPORTED_DIALECTS:
+        raise ValueError(f"DATABASE_URL must point at one of {', '.join(SUPPORTED_DIALECTS)}, not {dialect}")
+    if url in ('sqlite://', 'sqlite:///:memory:'):
+        # In-memory databases live in a single connection
+        return create_engine(url)
+    options = {'pool_size': POOL_SIZE, 'max_overflow': MAX_OVERFLOW, 'pool_timeout': 30}
+    if not url.startswith('sqlite'):
+        # Networked servers drop idle connections; check and recycle them
+        options.update(pool_pre_ping=True, pool_recycle=1800)
+    return create_engine(url, **options)
+
+
+engine = _create_engine(DATABASE_URL)
+
+
+@event.listens_for(engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Let readers and a writer work concurrently and wait on locks instead of failing."""
+    if engine.dialect.name != 'sqlite':
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
+# One session per script-runner thread; streamlit_app removes it at the end of every run
+Session = scoped_session(sessionmaker(bind=engine))
+
+Base = declarative_base()
+
+
+# Define database models
+class User(Base):
+    __tablename__ = 'users'
+    id = Column(Integer, primary_key=True)
+    username = Column(String(50), unique=True)
+    score = Column(Integer, default=0)
+    last_quiz_date = Column(DateTime)
+    # Elo-style ability estimate in logits and the answers it is based on (see adaptive.py)
+    ability = Column(Float, default=0, server_default='0')
+    rated_answers = Column(Integer, default=0, server_default='0')
+
+    # Serves "top N" as an index scan
+    __table_args__ = (Index('ix_users_score_last_quiz_date', 'score', 'last_quiz_date'),)
+
+
+def _question_hash_default(context):
+    return question_hash(context.get_current_parameters().get('question'))
+
+
+class Quiz(Base):
+    __tablename__ = 'quizzes'
+    id = Column(Integer, primary_key=True)
+    question = Column(String(500))
+    # Hash of the normalized question; NULL marks a legacy duplicate awaiting cleanup
+    question_hash = Column(String(64), unique=True, index=True, default=_question_hash_default)
+    option_a = Column(String(200))
+    option_b = Column(String(200))
+    option_c = Column(String(200))
+    option_d = Column(String(200))
+    correct_answer = Column(String(1))
+    image_url = Column(String(200))
+    source = Column(String(200))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # Elo-style difficulty estimate in logits and the answers it is based on (see adaptive.py)
+    difficulty = Column(Float, default=0, server_default='0')
+    rated_answers = Column(Integer, default=0, server_default='0')
+
+
+class QuizEmbedding(Base):
+    __tablename__ = 'quiz_embeddings'
+    quiz_id = Column(Integer, ForeignKey('quizzes.id'), primary_key=True)
+    model = Column(String(100), nullable=False)  # Embedder that produced the vector
+    vector = Column(LargeBinary, nullable=False)  # float32 array bytes
+
+
+def _source_key_default(context):
+    return source_key(context.get_current_parameters().get('source_url'))
+
+
+class Newsletter(Base):
+    __tablename__ = 'newsletters'
+    id = Column(Integer, primary_key=True)
+    title = Column(String(200), nullable=False)
+    summary = Column(Text, nullable=False)  # Key points/summary
+    content = Column(Text, nullable=False)  # Full content
+    image_url = Column(String(500))
+    source_url = Column(String(500))  # New field for storing the source URL
+    # Hash of the normalized source URL; NULL without a URL or for a legacy duplicate
+    source_key = Column(String(64), unique=True, index=True, default=_source_key_default)
+    date_published = Column(DateTime, default=datetime.utcnow)
+    is_published = Column(Integer, default=1)  # 1 for published, 0 for draft
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Keyset pages of the feed: published-only for readers, all items for admins
+    __table_args__ = (
+        Index('ix_newsletters_published_date', 'is_published', 'date_published'),
+        Index('ix_newsletters_date_published', 'date_published'),
+    )
+
+
+class QuizAttempt(Base):
+    __tablename__ = 'quiz_attempts'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    question_ids = Column(Text, nullable=False)  # JSON list of quiz ids in the order asked
+    answers = Column(Text, nullable=False)  # One letter per question, '-' when unanswered
+    score = Column(Integer, nullable=False)
+    total = Column(Integer, nullable=False)
+    duration_seconds = Column(Float)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class LeaderboardNode(Base):
+    """Node of a Fenwick tree counting users per score (see leaderboard.py)."""
+    __tablename__ = 'leaderboard_fenwick'
+    node = Column(BigInteger, primary_key=True, autoincrement=False)
+    users = Column(Integer, nullable=False, default=0)
+
+
+class LeaderboardTieNode(Base):
+    """Node of a Fenwick tree counting users per last quiz date, one tree per score (see leaderboard.py)."""
+    __tablename__ = 'leaderboard_tie_fenwick'
+    score = Column(Integer, primary_key=True, autoincrement=False)
+    node = Column(BigInteger, primary_key=True, autoincrement=False)
+    users = Column(Integer, nullable=False, default=0)
+
+    # Rows are only ever read by primary key; SQLite then stores them in the key's B-tree
+    __table_args__ = {'sqlite_with_rowid': False}
+
+
+class ScoreBucket(Base):
+    """Points a user earned in one day, month or year (see leaderboard.py)."""
+    __tablename__ = 'score_buckets'
+    granularity = Column(String(5), primary_key=True)  # 'day', 'month' or 'year'
+    bucket_start = Column(Date, primary_key=True)  # First day of the bucket
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    score = Column(Integer, nullable=False, default=0)
+
+
+class ItemStats(Base):
+    """Running sums over attempts for item analysis of one question (see item_analysis.py)."""
+    __tablename__ = 'item_stats'
+    quiz_id = Column(Integer, ForeignKey('quizzes.id'), primary_key=True)
+    answer_key = Column(String(1))  # correct_answer the sums were computed with
+    attempts = Column(Integer, nullable=False, default=0)
+    correct = Column(Integer, nullable=False, default=0)
+    chose_a = Column(Integer, nullable=False, default=0)
+    chose_b = Column(Integer, nullable=False, default=0)
+    chose_c = Column(Integer, nullable=False, default=0)
+    chose_d = Column(Integer, nullable=False, default=0)
+    unanswered = Column(Integer, nullable=False, default=0)
+    # Sums of the rest score (fraction of the attempt's other questions answered correctly)
+    rest_sum = Column(Float, nullable=False, default=0)
+    rest_sq_sum = Column(Float, nullable=False, default=0)
+    rest_correct_sum = Column(Float, nullable=False, default=0)  # Over correct answers only
+
+
+class ReviewCard(Base):
+    """Spaced-repetition schedule of one question for one user (see spaced_repetition.py)."""
+    __tablename__ = 'review_cards'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    quiz_id = Column(Integer, ForeignKey('quizzes.id'), primary_key=True)
+    ease = Column(Float, nullable=False, default=2.5)  # SM-2 easiness factor
+    interval_days = Column(Float, nullable=False, default=0)
+    repetitions = Column(Integer, nullable=False, default=0)  # Correct reviews in a row
+    lapses = Column(Integer, nullable=False, default=0)
+    due_at = Column(DateTime, nullable=False)
+    last_reviewed_at = Column(DateTime)
+
+    # "What is due for this user" is a range scan of this index
+    __table_args__ = (Index('ix_review_cards_user_due', 'user_id', 'due_at'),)
+
+
+class Watermark(Base):
+    """Last row id processed by an incremental job."""
+    __tablename__ = 'watermarks'
+    name = Column(String(50), primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)
+
+
+class ArticleSummary(Base):
+    """Extractive summary of an article text, keyed by a hash of the text (see summarizer.py)."""
+    __tablename__ = 'article_summaries'
+    content_hash = Column(String(64), primary_key=True)
+    summary = Column(Text)  # NULL when the text had no usable sentences
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class GeneratedQuestions(Base):
+    """Published article that questions were generated from (see question_generator.py)."""
+    __tablename__ = 'question_generation'
+    # newsletters.id; no foreign key, so articles can still be deleted
+    newsletter_id = Column(Integer, primary_key=True, autoincrement=False)
+    questions = Column(Integer, nullable=False, default=0)
+    # Articles in the corpus at the time; articles that gave no questions are retried once it grows
+    corpus_size = Column(Integer)
+    generated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class FeedState(Base):
+    """Incremental crawl position of one newsletter feed (see feed_crawler.py)."""
+    __tablename__ = 'feed_state'
+    feed_url = Column(String(500), primary_key=True)
+    seen_ids = Column(Text, nullable=False, default='[]')  # JSON list of recently imported entry ids
+    last_entry_at = Column(DateTime)  # Newest entry date imported
+    last_crawled_at = Column(DateTime)
+    last_error = Column(Text)
+
+
+class Job(Base):
+    """Background ingestion job run by the worker in job_queue.py."""
+    __tablename__ = 'jobs'
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(20), nullable=False)
+    status = Column(String(10), nullable=False, default='queued')  # queued, running, done or failed
+    payload = Column(Text, nullable=False)  # JSON arguments of the handler
+    result = Column(Text)  # JSON result of the handler once done
+    error = Column(Text)
+    progress = Column(Float, nullable=False, default=0)  # 0-1
+    message = Column(String(200))
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)  # Delays retries
+    created_by = Column(Integer, ForeignKey('users.id'))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    # The worker claims the oldest runnable job of a kind
+    __table_args__ = (Index('ix_jobs_kind_status_run_after', 'kind', 'status', 'run_after'),)
+
+
+def delete_quizzes(conn, condition):
+    """Delete the questions matching condition and the rows that refer to them; returns how many.
+
+    conn may be a Connection or a Session; the caller commits.
+    """
+    quiz_ids = select(Quiz.id).where(condition)
+    for model in (QuizEmbedding, ItemStats, ReviewCard):
+        conn.execute(model.__table__.delete().where(model.quiz_id.in_(quiz_ids)))
+    return conn.execute(Quiz.__table__.delete().where(condition)).rowcount
+
+
+def _add_dedupe_column(table, column, source_column, digest):
+    """Add and backfill a unique digest column on databases created before it existed.
+
+    Only the first occurrence of each digest gets it, so existing duplicates
+    stay NULL until an admin cleans them up.
+    """
+    if column in {c['name'] for c in inspect(engine).get_columns(table)}:
+        return
+
+    with engine.begin() as conn:
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} VARCHAR(64)'))
+
+        seen = set()
+        updates = []
+        for row_id, value in conn.execute(text(f'SELECT id, {source_column} FROM {table} ORDER BY id')):
+            key = digest(value)
+            if key is not None and key not in seen:
+                seen.add(key)
+                updates.append({'id': row_id, 'digest': key})
+        if updates:
+            conn.execute(text(f'UPDATE {table} SET {column} = :digest WHERE id = :id'), updates)
+
+        conn.execute(text(f'CREATE UNIQUE INDEX ix_{table}_{column} ON {table} ({column})'))
+
+
+def _add_missing_columns(table):
+    """Add plain columns introduced after the table was created, with their server defaults."""
+    existing = {column['name'] for column in inspect(engine).get_columns(table.name)}
+    with engine.begin() as conn:
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}'
+            if column.server_default is not None:
+                ddl += f' DEFAULT {column.server_default.arg}'
+            conn.execute(text(ddl))
+
+
+def init_db():
+    """Create missing tables and migrate databases created by older versions."""
+    Base.metadata.create_all(engine)
+    _add_dedupe_column('quizzes', 'question_hash', 'question', question_hash)
+    _add_dedupe_column('newsletters', 'source_key', 'source_url', source_key)
+    for table in Base.metadata.sorted_tables:
+        _add_missing_columns(table)
+
+    # create_all() only indexes new tables; add indexes introduced since
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+init_db()
@@ -0,0 +1,258 @@
+"""RSS/Atom crawler that adds new feed entries to the newsletter as drafts.
+
+Feeds are listed in a YAML config (see feeds.example.yaml). Every crawl
+revalidates each feed with a conditional GET through http_cache, so an
+unchanged feed costs a 304. The feed_state table stores the ids of
+recently imported entries and the newest entry date per feed. Only entries
+that are new by both measures are extracted, with the same download and
+parsing as single-article imports. They are then summarized and
+bulk-inserted as draft Newsletter rows (is_published=0) for an admin to
+review. One token bucket bounds requests per second across all feeds and
+articles.
+
+A feed url may also be a local file path or file:// URL, e.g. a fixture feed
+in tests. Run it from cron, as a background job, or with
+`python feed_crawler.py --interval 3600`.
+"""
+import argparse
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import unquote, urlsplit
+
+import yaml
+from sqlalchemy import select
+
+from bulk_ingest import bulk_insert, dialect_insert
+from database import engine, FeedState, Newsletter
+from http_cache import HttpCache
+from news_ingest import MAX_WORKERS, http_session, ingest_urls, newsletter_rows, RateLimiter
+from summarizer import summarize_rows
+
+CONFIG_PATH = os.environ.get('FEEDS_CONFIG', 'feeds.yaml')
+# Defaults for settings the config leaves out
+DEFAULT_RATE_LIMIT = 2.0  # requests per second across all feeds and articles
+DEFAULT_BURST = 4
+DEFAULT_MAX_ENTRIES = 20  # newest entries taken from one feed per crawl; older new ones are dropped
+# Entry ids remembered per feed
+SEEN_IDS_LIMIT = 1000
+FEED_TIMEOUT = 30
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+RSS1 = '{http://purl.org/rss/1.0/}'
+RDF = '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}'
+DC = '{http://purl.org/dc/elements/1.1/}'
+
+FeedEntry = namedtuple('FeedEntry', ['id', 'link', 'title', 'published'])
+FeedReport = namedtuple('FeedReport', ['feed', 'new_entries', 'imported', 'skipped', 'failed', 'error'])
+
+# Feeds are always revalidated, so a crawl never misses an update
+feed_cache = HttpCache(fresh_seconds=0)
+
+_state = FeedState.__table__
+
+
+def load_config(path=CONFIG_PATH):
+    """Crawler settings from a YAML file, with defaults filled in."""
+    with open(path, encoding='utf-8') as f:
+        config = yaml.safe_load(f) or {}
+    feeds = config.get('feeds') or []
+    for feed in feeds:
+        if not isinstance(feed, dict) or not feed.get('url'):
+            raise ValueError(f"Every feed in {path} needs a url: {feed!r}")
+    return {
+        'rate_limit': float(config.get('rate_limit', DEFAULT_RATE_LIMIT)),
+        'burst': int(config.get('burst', DEFAULT_BURST)),
+        'max_entries': int(config.get('max_entries', DEFAULT_MAX_ENTRIES)),
+        'feeds': feeds
+    }
+
+
+def parse_date(value):
+    """Naive UTC datetime from an RFC 822 (RSS) or ISO 8601 (Atom) date, or None."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _atom_link(entry):
+    for link in entry.findall(ATOM + 'link'):
+        if link.get('rel', 'alternate') == 'alternate' and link.get('href'):
+            return link.get('href')
+    return None
+
+
+def _text(element, *tags):
+    """Stripped text of the first of tags present under element."""
+    for tag in tags:
+        value = element.findtext(tag)
+        if value and value.strip():
+            return value.strip()
+    return None
+
+
+def parse_feed(xml):
+    """FeedEntries with an http(s) link from an RSS 2.0, RSS 1.0 or Atom document, in document order."""
+    root = ET.fromstring(xml)
+    entries = []
+    if root.tag == ATOM + 'feed':
+        for entry in root.iter(ATOM + 'entry'):
+            link = _atom_link(entry)
+            entries.append(FeedEntry(
+                _text(entry, ATOM + 'id') or link, link, _text(entry, ATOM + 'title'),
+                parse_date(_text(entry, ATOM + 'published', ATOM + 'updated'))
+            ))
+    else:
+        for item in list(root.iter('item')) + list(root.iter(RSS1 + 'item')):
+            link = _text(item, 'link', RSS1 + 'link')
+            entries.append(FeedEntry(
+                _text(item, 'guid') or item.get(RDF + 'about') or link, link, _text(item, 'title', RSS1 + 'title'),
+                parse_date(_text(item, 'pubDate', DC + 'date'))
+            ))
+    return [entry for entry in entries if entry.link and entry.link.startswith(('http://', 'https://'))]
+
+
+def _local_path(url):
+    if url.startswith('file://'):
+        return unquote(urlsplit(url).path)
+    if '://' not in url:
+        return url
+    return None
+
+
+def fetch_feed(url, rate_limiter, session=None):
+    """Document of a feed URL or local feed file (text or bytes)."""
+    path = _local_path(url)
+    if path is not None:
+        with open(path, 'rb') as f:
+            return f.read()
+    rate_limiter.acquire()
+    return feed_cache.fetch(session or http_session, url, FEED_TIMEOUT).text
+
+
+def load_state(conn, feed_url):
+    """(imported entry ids, oldest first, and the newest entry date) of a feed; ([], None) before its first crawl."""
+    row = conn.execute(select(_state.c.seen_ids, _state.c.last_entry_at).where(_state.c.feed_url == feed_url)).first()
+    if row is None:
+        return [], None
+    return json.loads(row.seen_ids), row.last_entry_at
+
+
+def new_entries(entries, seen_ids, last_entry_at, max_entries):
+    """Entries not imported yet, newest first, at most max_entries.
+
+    An entry is new when its id was not seen and it is not older than the
+    newest entry already imported (undated entries count as new).
+    """
+    seen_ids = set(seen_ids)
+    fresh = [
+        entry for entry in entries
+        if entry.id not in seen_ids
+        and (entry.published is None or last_entry_at is None or entry.published >= last_entry_at)
+    ]
+    fresh.sort(key=lambda entry: entry.published or datetime.max, reverse=True)
+    return fresh[:max_entries]
+
+
+def save_state(conn, feed_url, seen_ids, last_entry_at, error=None):
+    row = {'feed_url': feed_url, 'seen_ids': json.dumps(seen_ids[-SEEN_IDS_LIMIT:]), 'last_entry_at': last_entry_at,
+           'last_crawled_at': datetime.utcnow(), 'last_error': error}
+    stmt = dialect_insert(conn, _state).values(row)
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[_state.c.feed_url],
+        set_={column: stmt.excluded[column] for column in ('seen_ids', 'last_entry_at', 'last_crawled_at', 'last_error')}
+    ))
+
+
+def crawl_feed(feed, rate_limiter, max_entries=DEFAULT_MAX_ENTRIES, session=None):
+    """Import the new entries of one feed config entry as drafts; returns a FeedReport."""
+    url = feed['url']
+    with engine.connect() as conn:
+        seen_ids, last_entry_at = load_state(conn, url)
+    try:
+        entries = parse_feed(fetch_feed(url, rate_limiter, session))
+    except Exception as e:
+        with engine.begin() as conn:
+            save_state(conn, url, seen_ids, last_entry_at, f"{type(e).__name__}: {e}"[:1000])
+        return FeedReport(feed.get('name', url), 0, 0, 0, [], str(e)[:200])
+
+    todo = new_entries(entries, seen_ids, last_entry_at, feed.get('max_entries', max_entries))
+    results = ingest_urls([entry.link for entry in todo], session=session, rate_limiter=rate_limiter,
+                          max_workers=min(MAX_WORKERS, len(todo) or 1))
+    rows = []
+    failed = []
+    dates = [last_entry_at] if last_entry_at else []
+    retry_from = None
+    for entry, result in zip(todo, results):
+        if result.error:
+            failed.append((entry.link, result.error))
+            if entry.published and (retry_from is None or entry.published < retry_from):
+                retry_from = entry.published
+            continue
+        rows.extend(newsletter_rows([result], entry.published, is_published=0))
+        seen_ids.append(entry.id)
+        if entry.published:
+            dates.append(entry.published)
+    if dates:
+        # Failed entries stay unseen and not older than the kept date, so the next crawl retries them
+        last_entry_at = min(max(dates), retry_from) if retry_from else max(dates)
+
+    # Articles already in the newsletter (added by hand or from another feed) are skipped
+    stats = bulk_insert(engine, Newsletter.__table__, summarize_rows(rows), ignore_duplicates=True)
+    with engine.begin() as conn:
+        save_state(conn, url, seen_ids, last_entry_at)
+    return FeedReport(feed.get('name', url), len(todo), stats.rows, stats.skipped, failed, None)
+
+
+def crawl(config, session=None, on_report=None):
+    """Crawl every configured feed under one rate limit; returns a FeedReport per feed.
+
+    on_report(report) is called after each feed.
+    """
+    rate_limiter = RateLimiter(config['rate_limit'], config['burst'])
+    reports = []
+    for feed in config['feeds']:
+        reports.append(crawl_feed(feed, rate_limiter, config['max_entries'], session))
+        if on_report:
+            on_report(reports[-1])
+    return reports
+
+
+def _print_reports(reports):
+    for report in reports:
+        if report.error:
+            print(f"{report.feed}: ERROR {report.error}")
+            continue
+        print(f"{report.feed}: {report.new_entries} new, {report.imported} imported as drafts, "
+              f"{report.skipped} already in the newsletter, {len(report.failed)} failed")
+        for link, error in report.failed:
+            print(f"  {link}: {error}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import new RSS/Atom entries into the newsletter as drafts")
+    parser.add_argument('--config', default=CONFIG_PATH)
+    parser.add_argument('--interval', type=float, default=None,
+                        help="crawl again every this many seconds instead of once")
+    args = parser.parse_args()
+
+    while True:
+        started = time.monotonic()
+        _print_reports(crawl(load_config(args.config)))
+        if args.interval is None:
+            break
+        time.sleep(max(0.0, args.interval - (time.monotonic() - started)))
@@ -0,0 +1,174 @@
+"""On-disk HTTP response cache with conditional revalidation.
+
+Each fetched URL is stored as one gzip-compressed JSON file holding the
+final URL, the ETag and Last-Modified validators, a SHA-256 of the body and
+the body itself. A file's mtime is when the response was last confirmed
+current: within FRESH_SECONDS it is served without any request, after that
+the next fetch sends If-None-Match / If-Modified-Since and a 304 only
+touches the file. Entries not confirmed for TTL_SECONDS are evicted.
+
+source_key() is the canonical identity of an article URL, used to skip
+URLs that are already stored or repeated with different tracking parameters.
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+CACHE_DIR = os.environ.get('HTTP_CACHE_DIR', os.path.join('.cache', 'http'))
+# Seconds a stored response is used without revalidating it
+FRESH_SECONDS = int(os.environ.get('HTTP_CACHE_FRESH_SECONDS', 60 * 60))
+# Seconds after which an entry that was not revalidated is deleted
+TTL_SECONDS = int(os.environ.get('HTTP_CACHE_TTL_SECONDS', 7 * 24 * 60 * 60))
+# Minimum seconds between eviction scans
+EVICT_INTERVAL = 10 * 60
+
+_ENTRY_SUFFIX = '.json.gz'
+# Query parameters that only track where a click came from
+TRACKING_PARAMS = {'fbclid', 'gclid', 'mc_cid', 'mc_eid', 'ref'}
+TRACKING_PREFIXES = ('utm_',)
+
+# status is 'fresh' (no request), 'revalidated' (304), 'unchanged' (200 with
+# the stored body) or 'fetched' (new or changed body)
+CachedPage = namedtuple('CachedPage', ['url', 'text', 'content_hash', 'status'])
+
+
+def url_cache_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def normalize_source_url(url):
+    """Canonical form of an article URL used for duplicate detection.
+
+    Lowercases scheme and host, drops default ports, fragments, tracking
+    parameters and trailing slashes, and sorts the remaining parameters.
+    """
+    parts = urlsplit((url or '').strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and (scheme, parts.port) not in (('http', 80), ('https', 443)):
+        host = f'{host}:{parts.port}'
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)
+    )
+    return urlunsplit((scheme, host, parts.path.rstrip('/') or '/', urlencode(query), ''))
+
+
+def source_key(url):
+    """SHA-256 hex digest of the normalized URL, or None without a URL."""
+    if not url or not url.strip():
+        return None
+    return hashlib.sha256(normalize_source_url(url).encode('utf-8')).hexdigest()
+
+
+class HttpCache:
+    """Conditional-GET cache of text responses, safe to share between threads and processes."""
+
+    def __init__(self, directory=CACHE_DIR, fresh_seconds=FRESH_SECONDS, ttl_seconds=TTL_SECONDS):
+        self.directory = directory
+        self.fresh_seconds = fresh_seconds
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._last_evicted = 0.0
+
+    def _path(self, url):
+        return os.path.join(self.directory, url_cache_key(url) + _ENTRY_SUFFIX)
+
+    def get(self, url):
+        """(entry dict, seconds since it was confirmed) for url, or (None, None) on a miss."""
+        path = self._path(url)
+        try:
+            age = time.time() - os.stat(path).st_mtime
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError, OSError, EOFError):
+            return None, None
+        return entry, age
+
+    def put(self, url, entry):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as f:
+            json.dump(entry, f, separators=(',', ':'))
+        os.replace(tmp_path, self._path(url))
+
+    def touch(self, url):
+        try:
+            os.utime(self._path(url))
+        except FileNotFoundError:
+            pass
+
+    def fetch(self, session, url, timeout=None):
+        """GET url through the cache; returns a CachedPage.
+
+        Raises requests exceptions like session.get() for network errors and
+        error statuses.
+        """
+        entry, age = self.get(url)
+        if entry is not None and age < self.fresh_seconds:
+            return CachedPage(entry['final_url'], entry['text'], entry['content_hash'], 'fresh')
+
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        response = session.get(url, timeout=timeout, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            self.touch(url)
+            return CachedPage(entry['final_url'], entry['text'], entry['content_hash'], 'revalidated')
+        response.raise_for_status()
+
+        text = response.text
+        digest = content_hash(text)
+        if 'no-store' not in response.headers.get('Cache-Control', '').lower():
+            self.put(url, {
+                'url': url,
+                'final_url': response.url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'content_hash': digest,
+                'text': text
+            })
+            self.evict_if_due()
+        status = 'unchanged' if entry is not None and entry['content_hash'] == digest else 'fetched'
+        return CachedPage(response.url, text, digest, status)
+
+    def evict_if_due(self):
+        if time.time() - self._last_evicted >= EVICT_INTERVAL:
+            self.evict()
+
+    def evict(self):
+        """Delete entries not confirmed within ttl_seconds; returns how many were removed."""
+        with self._lock:
+            self._last_evicted = now = time.time()
+            removed = 0
+            try:
+                entries = list(os.scandir(self.directory))
+            except FileNotFoundError:
+                return 0
+            for entry in entries:
+                if not entry.name.endswith(_ENTRY_SUFFIX):
+                    continue
+                try:
+                    if now - entry.stat().st_mtime > self.ttl_seconds:
+                        os.remove(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+            return removed
+
+
+# Shared by every session in this process
+http_cache = HttpCache()
@@ -0,0 +1,181 @@
+"""Item analysis of quiz questions from the attempt history.
+
+For every question, item_stats keeps running sums over the attempts that
+asked it: answers per option, correct answers and sums of the rest score
+(the fraction of the attempt's other questions answered correctly).
+Difficulty (p-value), point-biserial discrimination and distractor rates
+are derived from those sums, so refresh_item_stats() only folds in attempts
+newer than its watermark. Changing an answer key changes every rest score
+of the affected attempts, so the sums are rebuilt when one is detected.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+
+from bulk_ingest import dialect_insert
+from database import engine, ItemStats, Quiz, QuizAttempt, Watermark
+from scoring import NOT_ANSWERED, encode_key, encode_letters, pad_rows
+
+WATERMARK = 'item_analysis'
+# Attempts folded in per batch
+BATCH_SIZE = 5000
+# Attempts a question needs before it is flagged
+MIN_ATTEMPTS = 5
+
+SUM_COLUMNS = ['attempts', 'correct', 'chose_a', 'chose_b', 'chose_c', 'chose_d', 'unanswered',
+               'rest_sum', 'rest_sq_sum', 'rest_correct_sum']
+
+_stats = ItemStats.__table__
+_quizzes = Quiz.__table__
+_attempts = QuizAttempt.__table__
+_watermarks = Watermark.__table__
+
+
+def _keys_changed(conn):
+    """Whether any question's answer key differs from the one its sums were built with."""
+    return conn.execute(
+        select(_stats.c.quiz_id)
+        .join(_quizzes, _quizzes.c.id == _stats.c.quiz_id)
+        .where(func.coalesce(_quizzes.c.correct_answer, '') != func.coalesce(_stats.c.answer_key, ''))
+        .limit(1)
+    ).first() is not None
+
+
+def reset(conn):
+    """Forget all sums so the next refresh starts from the first attempt."""
+    conn.execute(_stats.delete())
+    conn.execute(_watermarks.delete().where(_watermarks.c.name == WATERMARK))
+
+
+def accumulate(question_ids, responses, keys_by_id):
+    """Per-question sums for a batch of attempts.
+
+    question_ids and responses are (attempts x questions) matrices padded
+    with -1 and NOT_ANSWERED. Returns (sorted question ids, {column: array}).
+    """
+    asked = question_ids >= 0
+    ids, inverse = np.unique(question_ids[asked], return_inverse=True)
+    keys = np.full(question_ids.shape, NOT_ANSWERED, dtype=np.uint8)
+    keys[asked] = encode_key(keys_by_id.get(quiz_id) for quiz_id in ids.tolist())[inverse]
+
+    correct = (responses == keys) & (keys != NOT_ANSWERED)
+    others = np.maximum(asked.sum(axis=1) - 1, 1)[:, None]
+    rest = (correct.sum(axis=1)[:, None] - correct) / others
+
+    # One entry per asked question, in the same order as inverse
+    rest, correct, choices = rest[asked], correct[asked], np.minimum(responses[asked], 4)
+    chosen = np.bincount(inverse * 5 + choices, minlength=len(ids) * 5).reshape(len(ids), 5)
+
+    def total(weights=None):
+        return np.bincount(inverse, weights=weights, minlength=len(ids))
+
+    return ids, {
+        'attempts': total(),
+        'correct': total(correct),
+        'chose_a': chosen[:, 0],
+        'chose_b': chosen[:, 1],
+        'chose_c': chosen[:, 2],
+        'chose_d': chosen[:, 3],
+        'unanswered': chosen[:, 4],
+        'rest_sum': total(rest),
+        'rest_sq_sum': total(rest ** 2),
+        'rest_correct_sum': total(np.where(correct, rest, 0))
+    }
+
+
+def _add_sums(conn, ids, sums, keys_by_id):
+    # Attempts still list questions that were deleted since
+    rows = [
+        dict({column: (float(values[i]) if column.startswith('rest') else int(values[i]))
+              for column, values in sums.items()},
+             quiz_id=quiz_id, answer_key=keys_by_id[quiz_id])
+        for i, quiz_id in enumerate(ids.tolist()) if quiz_id in keys_by_id
+    ]
+    if not rows:
+        return
+    stmt = dialect_insert(conn, _stats)
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[_stats.c.quiz_id],
+        set_=dict({column: _stats.c[column] + stmt.excluded[column] for column in SUM_COLUMNS},
+                  answer_key=stmt.excluded.answer_key)
+    ), rows)
+
+
+def refresh_item_stats(batch_size=BATCH_SIZE):
+    """Fold attempts recorded since the last refresh into item_stats; returns how many."""
+    with engine.begin() as conn:
+        if _keys_changed(conn):
+            reset(conn)
+        last_id = conn.execute(
+            select(_watermarks.c.last_id).where(_watermarks.c.name == WATERMARK)
+        ).scalar() or 0
+        keys_by_id = dict(conn.execute(select(_quizzes.c.id, _quizzes.c.correct_answer)).all())
+
+        folded = 0
+        result = conn.execute(
+            select(_attempts.c.id, _attempts.c.question_ids, _attempts.c.answers)
+            .where(_attempts.c.id > last_id)
+            .order_by(_attempts.c.id)
+        )
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            question_ids = pad_rows([json.loads(row.question_ids) for row in rows], -1, np.int64)
+            responses = pad_rows([encode_letters(row.answers) for row in rows], NOT_ANSWERED, np.uint8)
+            ids, sums = accumulate(question_ids, responses, keys_by_id)
+            _add_sums(conn, ids, sums, keys_by_id)
+            last_id = rows[-1].id
+            folded += len(rows)
+
+        if folded:
+            stmt = dialect_insert(conn, _watermarks)
+            conn.execute(stmt.on_conflict_do_update(
+                index_elements=[_watermarks.c.name], set_={'last_id': stmt.excluded.last_id}
+            ), {'name': WATERMARK, 'last_id': last_id})
+    return folded
+
+
+def item_report(conn, min_attempts=1):
+    """DataFrame of difficulty, discrimination, option rates and a flag per question."""
+    report = pd.DataFrame(conn.execute(
+        select(_quizzes.c.id, _quizzes.c.question, _quizzes.c.correct_answer,
+               *(_stats.c[column] for column in SUM_COLUMNS))
+        .join(_stats, _stats.c.quiz_id == _quizzes.c.id)
+        .where(_stats.c.attempts >= min_attempts)
+        .order_by(_quizzes.c.id)
+    ).all(), columns=['id', 'question', 'correct_answer', *SUM_COLUMNS])
+
+    n = report['attempts'].to_numpy(dtype=float)
+    right = report['correct'].to_numpy(dtype=float)
+    p = right / np.maximum(n, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_right = report['rest_correct_sum'] / right
+        mean_wrong = (report['rest_sum'] - report['rest_correct_sum']) / (n - right)
+        variance = report['rest_sq_sum'] / n - (report['rest_sum'] / n) ** 2
+        discrimination = (mean_right - mean_wrong) * np.sqrt(p * (1 - p)) / np.sqrt(variance)
+    report['p_value'] = p
+    # A report with no rows has object columns, which isfinite() rejects
+    discrimination = discrimination.astype(float)
+    # Undefined when everyone (or no one) got it right or all rest scores are equal
+    report['discrimination'] = discrimination.where(np.isfinite(discrimination))
+    for letter in 'abcd':
+        report[f'rate_{letter}'] = report[f'chose_{letter}'] / np.maximum(n, 1)
+
+    # A distractor chosen more often than the key suggests a wrong key
+    key_rate = np.select(
+        [report['correct_answer'].str.upper() == letter.upper() for letter in 'abcd'],
+        [report[f'rate_{letter}'] for letter in 'abcd'],
+        default=np.nan
+    )
+    top_distractor = report[[f'rate_{letter}' for letter in 'abcd']].max(axis=1)
+    enough = n >= MIN_ATTEMPTS
+    report['flag'] = np.select([
+        enough & ((report['discrimination'] < 0) | (top_distractor > key_rate)),
+        enough & (p < 0.2),
+        enough & (p > 0.9),
+        enough & (report['discrimination'] < 0.2)
+    ], ['Check key', 'Too hard', 'Too easy', 'Low discrimination'], default='')
+    return report
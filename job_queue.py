@@ -0,0 +1,382 @@
+"""Background ingestion jobs backed by the jobs table.
+
+The app enqueues a job (a kind plus JSON payload) and polls its row;
+a separate worker process claims queued jobs and runs them in a process
+pool, so a slow site or a large PDF never blocks a Streamlit session.
+Handlers report progress, and optionally a partial result the app can
+show early, into the row as they go. A failed job is retried
+with exponential backoff until max_attempts, unless its handler raised
+PermanentJobError. Each kind has its own cap on concurrently running jobs.
+
+The worker keeps a heartbeat file fresh while it runs. ensure_worker(),
+called on every enqueue, starts one when the heartbeat is stale, and the
+worker exits again after a few idle minutes. Run it by hand with
+`python job_queue.py work`.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, update
+
+from bulk_ingest import bulk_insert
+from database import engine, Job, Newsletter
+from http_cache import source_key
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+JOB_DIR = os.environ.get('JOB_DIR', os.path.join('.cache', 'jobs'))
+# Processes running jobs, and how many jobs of each kind may run at once
+WORKER_PROCESSES = int(os.environ.get('JOB_WORKER_PROCESSES', 4))
+CONCURRENCY = {'articles': 3, 'pdf_quiz': 1, 'crawl_feeds': 1, 'generate_questions': 1}
+MAX_ATTEMPTS = 3
+# Retry delay doubles after every failed attempt, up to BACKOFF_MAX seconds
+BACKOFF_BASE = 15
+BACKOFF_MAX = 15 * 60
+# Seconds between polls for new jobs, and before a silent worker counts as dead
+POLL_SECONDS = 1.0
+HEARTBEAT_TIMEOUT = 10
+# Seconds an automatically started worker waits for new jobs before exiting
+IDLE_EXIT = 5 * 60
+# Set JOB_WORKER_AUTOSTART=0 when the worker runs as its own service
+AUTOSTART = os.environ.get('JOB_WORKER_AUTOSTART', '1') != '0'
+# Minimum seconds between progress writes of one job
+PROGRESS_INTERVAL = 0.5
+
+HEARTBEAT_PATH = os.path.join(JOB_DIR, 'worker.heartbeat')
+
+JobStatus = namedtuple('JobStatus', ['id', 'kind', 'status', 'progress', 'message', 'result', 'error', 'attempts'])
+
+_jobs = Job.__table__
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler for failures that retrying cannot fix."""
+
+
+# Job handlers: handler(payload, report) -> JSON-serializable result, where
+# report(progress, message, partial) records progress (0-1, or None if unknown)
+# and optionally a partial result, which get_job returns while the job runs
+
+def import_articles(payload, report):
+    """Fetch article URLs and add them to the newsletter, skipping known ones."""
+    from news_ingest import ingest_urls, newsletter_rows
+    from summarizer import summarize_rows
+
+    keys = {}
+    for url in payload['urls']:
+        keys.setdefault(source_key(url), url)
+    with engine.connect() as conn:
+        known = set(conn.execute(
+            select(Newsletter.source_key).where(Newsletter.source_key.in_(list(keys)))
+        ).scalars())
+    urls = [url for key, url in keys.items() if key not in known]
+
+    done = []
+    def on_result(result):
+        done.append(result)
+        report(len(done) / len(urls), f"Fetched {len(done)} of {len(urls)}: {result.url}")
+    results = ingest_urls(urls, on_result=on_result) if urls else []
+    failed = [[result.url, result.error] for result in results if result.error]
+    if urls and len(failed) == len(urls):
+        # Nothing came through, so the sites may be down; try again later
+        raise RuntimeError(f"{failed[0][0]}: {failed[0][1]}")
+
+    date_published = payload.get('date_published')
+    rows = newsletter_rows(
+        results, datetime.fromisoformat(date_published) if date_published else None, payload.get('is_published', 1)
+    )
+    stats = bulk_insert(engine, Newsletter.__table__, summarize_rows(rows), ignore_duplicates=True)
+    return {
+        'imported': stats.rows,
+        # Already stored, repeated in this batch or stored meanwhile by another job
+        'skipped': len(payload['urls']) - len(urls) + stats.skipped,
+        'titles': [result.article['title'] for result in results if result.article],
+        'failed': failed
+    }
+
+
+def extract_pdf_quiz(payload, report):
+    """Parse the questions of an uploaded PDF (through the parsed-quiz cache) and delete the upload."""
+    from pdf_quiz_cache import iter_cached_questions
+
+    questions = []
+    try:
+        for q in iter_cached_questions(payload['path']):
+            questions.append(q)
+            report(None, f"{len(questions)} questions found so far", {'questions': questions})
+    except Exception as e:
+        # A broken or encrypted file fails the same way every time
+        raise PermanentJobError(f"Error processing PDF: {e}") from e
+    finally:
+        os.remove(payload['path'])
+    if not questions:
+        raise PermanentJobError("No questions found in the PDF")
+    return {'questions': questions}
+
+
+def crawl_feeds(payload, report):
+    """Import new entries of the configured feeds as newsletter drafts."""
+    from feed_crawler import CONFIG_PATH, crawl, load_config
+
+    try:
+        config = load_config(payload.get('config') or CONFIG_PATH)
+    except (OSError, ValueError) as e:
+        raise PermanentJobError(f"Could not read the feed config: {e}") from e
+    done = []
+    def on_report(feed_report):
+        done.append(feed_report)
+        report(len(done) / len(config['feeds']), f"Crawled {len(done)} of {len(config['feeds'])}: {feed_report.feed}")
+    return {'feeds': [feed_report._asdict() for feed_report in crawl(config, on_report=on_report)]}
+
+
+def generate_questions(payload, report):
+    """Add fill-in-the-blank questions generated from new published articles to the quiz bank."""
+    from question_generator import generate_questions as generate
+
+    report(0.0, "Generating questions from new articles")
+    return generate(payload.get('limit'))._asdict()
+
+
+HANDLERS = {'articles': import_articles, 'pdf_quiz': extract_pdf_quiz, 'crawl_feeds': crawl_feeds,
+            'generate_questions': generate_questions}
+
+
+def save_upload(data, suffix=''):
+    """Write uploaded bytes where the worker can read them; returns the path."""
+    directory = os.path.join(JOB_DIR, 'uploads')
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=directory, suffix=suffix)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    return os.path.abspath(path)
+
+
+def enqueue(kind, payload, user_id=None, max_attempts=MAX_ATTEMPTS):
+    """Queue a job and make sure a worker is running; returns the job id."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    with engine.begin() as conn:
+        job_id = conn.execute(_jobs.insert().values(
+            kind=kind, status=QUEUED, payload=json.dumps(payload), max_attempts=max_attempts,
+            run_after=datetime.utcnow(), created_by=user_id
+        )).inserted_primary_key[0]
+    ensure_worker()
+    return job_id
+
+
+def get_job(job_id):
+    """JobStatus of a job (result decoded), or None if it does not exist.
+
+    The result of a running job is the last partial result it reported, if any.
+    """
+    with engine.connect() as conn:
+        row = conn.execute(select(
+            _jobs.c.id, _jobs.c.kind, _jobs.c.status, _jobs.c.progress, _jobs.c.message,
+            _jobs.c.result, _jobs.c.error, _jobs.c.attempts
+        ).where(_jobs.c.id == job_id)).first()
+    if row is None:
+        return None
+    return JobStatus(*row[:5], json.loads(row.result) if row.result else None, *row[6:])
+
+
+def backoff_delay(attempts):
+    """Seconds before retrying a job that failed attempts times, with jitter."""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim(conn, kind):
+    """Mark the oldest runnable job of kind as running; returns its id or None."""
+    now = datetime.utcnow()
+    next_job = (
+        select(_jobs.c.id)
+        .where(_jobs.c.kind == kind, _jobs.c.status == QUEUED, _jobs.c.run_after <= now)
+        .order_by(_jobs.c.id).limit(1).scalar_subquery()
+    )
+    return conn.execute(
+        update(_jobs).where(_jobs.c.id == next_job, _jobs.c.status == QUEUED)
+        .values(status=RUNNING, attempts=_jobs.c.attempts + 1, started_at=now, progress=0, message=None)
+        .returning(_jobs.c.id)
+    ).scalar()
+
+
+def record_failure(job_id, error, retry=True):
+    """Requeue a failed job with backoff, or fail it for good once out of attempts."""
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        attempts, max_attempts = conn.execute(
+            select(_jobs.c.attempts, _jobs.c.max_attempts).where(_jobs.c.id == job_id)
+        ).one()
+        if retry and attempts < max_attempts:
+            values = {'status': QUEUED, 'run_after': now + timedelta(seconds=backoff_delay(attempts)),
+                      'message': f"Retrying after attempt {attempts} of {max_attempts} failed"}
+        else:
+            values = {'status': FAILED, 'finished_at': now}
+        # A partial result from the failed attempt is dropped
+        conn.execute(update(_jobs).where(_jobs.c.id == job_id).values(error=str(error)[:1000], result=None, **values))
+
+
+def _progress_reporter(job_id):
+    last_write = [0.0]
+    def report(progress, message=None, partial=None):
+        now = time.monotonic()
+        if now - last_write[0] < PROGRESS_INTERVAL:
+            return
+        last_write[0] = now
+        values = {'message': (message or '')[:200]}
+        if progress is not None:
+            values['progress'] = progress
+        if partial is not None:
+            values['result'] = json.dumps(partial)
+        with engine.begin() as conn:
+            conn.execute(update(_jobs).where(_jobs.c.id == job_id).values(**values))
+    return report
+
+
+def run_job(job_id):
+    """Run a claimed job and store its outcome (runs in a pool process)."""
+    with engine.connect() as conn:
+        kind, payload = conn.execute(select(_jobs.c.kind, _jobs.c.payload).where(_jobs.c.id == job_id)).one()
+    try:
+        result = HANDLERS[kind](json.loads(payload), _progress_reporter(job_id))
+    except PermanentJobError as e:
+        record_failure(job_id, e, retry=False)
+    except Exception as e:
+        record_failure(job_id, f"{type(e).__name__}: {e}")
+    else:
+        with engine.begin() as conn:
+            conn.execute(update(_jobs).where(_jobs.c.id == job_id).values(
+                status=DONE, result=json.dumps(result), error=None, progress=1.0, message=None,
+                finished_at=datetime.utcnow()
+            ))
+
+
+def _init_pool_process():
+    # Connections inherited from the supervisor must not be shared with it
+    engine.dispose(close=False)
+
+
+def _lock_heartbeat():
+    """Open the heartbeat file, holding an exclusive lock on it where supported; None if already held."""
+    os.makedirs(JOB_DIR, exist_ok=True)
+    handle = open(HEARTBEAT_PATH, 'a')
+    try:
+        import fcntl
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except ImportError:
+        pass
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+def run_worker(processes=WORKER_PROCESSES, idle_exit=None):
+    """Claim and run jobs until interrupted, or until idle for idle_exit seconds."""
+    heartbeat = _lock_heartbeat()
+    if heartbeat is None:
+        print("Another worker is already running")
+        return
+
+    # Jobs left running by a worker that died are started over
+    with engine.begin() as conn:
+        conn.execute(update(_jobs).where(_jobs.c.status == RUNNING).values(status=QUEUED))
+
+    pool = ProcessPoolExecutor(processes, initializer=_init_pool_process)
+    running = {}  # future -> (job id, kind)
+    idle_since = time.monotonic()
+    try:
+        while True:
+            os.utime(HEARTBEAT_PATH)
+            for kind, cap in CONCURRENCY.items():
+                while len(running) < processes and sum(k == kind for _, k in running.values()) < cap:
+                    with engine.begin() as conn:
+                        job_id = claim(conn, kind)
+                    if job_id is None:
+                        break
+                    running[pool.submit(run_job, job_id)] = (job_id, kind)
+
+            if running:
+                done, _ = wait(running, timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+                idle_since = time.monotonic()
+            else:
+                done = ()
+                if idle_exit is not None and time.monotonic() - idle_since > idle_exit:
+                    break
+                time.sleep(POLL_SECONDS)
+
+            for future in done:
+                job_id, _ = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    # The pool process died (or the outcome could not be stored)
+                    record_failure(job_id, f"{type(error).__name__}: {error}")
+                    if isinstance(error, BrokenProcessPool):
+                        for other_id, _ in running.values():
+                            record_failure(other_id, "Worker process pool broke")
+                        running.clear()
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        pool = ProcessPoolExecutor(processes, initializer=_init_pool_process)
+                        break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        heartbeat.close()
+
+
+_last_spawned = 0.0
+
+
+def worker_alive():
+    try:
+        return time.time() - os.stat(HEARTBEAT_PATH).st_mtime < HEARTBEAT_TIMEOUT
+    except FileNotFoundError:
+        return False
+
+
+def ensure_worker():
+    """Start a background worker if none has sent a heartbeat recently; returns whether one runs."""
+    global _last_spawned
+    if worker_alive():
+        return True
+    if not AUTOSTART or time.monotonic() - _last_spawned < HEARTBEAT_TIMEOUT:
+        return False
+    _last_spawned = time.monotonic()
+    os.makedirs(JOB_DIR, exist_ok=True)
+    with open(os.path.join(JOB_DIR, 'worker.log'), 'ab') as log:
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), 'work', '--idle-exit', str(IDLE_EXIT)],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, start_new_session=True
+        )
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run background ingestion jobs")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    work = subcommands.add_parser('work', help="claim and run jobs until interrupted")
+    work.add_argument('--processes', type=int, default=WORKER_PROCESSES)
+    work.add_argument('--idle-exit', type=float, default=None,
+                      help="exit after this many seconds without jobs")
+    subcommands.add_parser('status', help="count jobs by kind and status")
+    args = parser.parse_args()
+
+    if args.command == 'work':
+        run_worker(args.processes, args.idle_exit)
+    else:
+        with engine.connect() as conn:
+            for kind, status, count in conn.execute(
+                select(_jobs.c.kind, _jobs.c.status, func.count()).group_by(_jobs.c.kind, _jobs.c.status)
+            ):
+                print(f"{kind:10} {status:8} {count}")
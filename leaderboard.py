@@ -0,0 +1,418 @@
+"""Leaderboard queries backed by an incrementally maintained rank table.
+
+Ranking follows show_leaderboard: score descending, then most recent quiz
+first. "Top N" is a scan of ix_users_score_last_quiz_date. For "rank of user
+X" the leaderboard_fenwick table holds a Fenwick (binary indexed) tree over
+scores: node i stores how many users have a score in a fixed range ending at
+i, so counting users above a score reads at most 31 nodes by primary key and
+a score change touches at most 31 nodes. Ties on score are broken the same
+way: leaderboard_tie_fenwick holds one tree per score over last quiz dates
+in microseconds, so counting the tied users who quizzed more recently reads
+at most 53 nodes. A rank costs O(log n) node reads however many users share
+a score (new users all start at 0), and a score or date change touches at
+most 31 + 2 * 53 nodes.
+
+Windowed leaderboards ("today", "this week", ...) read score_buckets, which
+holds the points each user earned per UTC day and is updated in the same
+transaction as the score. A weekly view sums at most seven buckets per active
+user instead of scanning the attempt history. compact_buckets() rolls old day
+buckets up into months and old months into years so the table stays small.
+"""
+import argparse
+import random
+import tempfile
+import time
+from collections import defaultdict, namedtuple
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import create_engine, func, select
+
+from bulk_ingest import bulk_insert, dialect_insert
+from database import Base, engine, LeaderboardNode, LeaderboardTieNode, QuizAttempt, ScoreBucket, User
+
+# Scores are stored at Fenwick index score + 1; the tree covers scores below this bound
+FENWICK_SIZE = 2 ** 31
+# Quiz dates are stored at Fenwick index microseconds since TIE_EPOCH + 2 (NULL at 1);
+# the trees cover dates until about 2112
+TIE_EPOCH = datetime(1970, 1, 1)
+TIE_FENWICK_SIZE = 2 ** 52
+
+# Windowed views and the number of days (ending today) each one sums
+WINDOWS = {'Today': 1, 'This Week': 7, 'Last 30 Days': 30}
+# Day buckets older than this are rolled up into months; must exceed the longest window
+DAY_BUCKET_RETENTION_DAYS = 62
+# Month buckets in years before the last MONTH_BUCKET_RETENTION_YEARS are rolled up into years
+MONTH_BUCKET_RETENTION_YEARS = 2
+
+UserRank = namedtuple('UserRank', ['rank', 'total', 'score', 'last_quiz_date'])
+
+_users = User.__table__
+_nodes = LeaderboardNode.__table__
+_tie_nodes = LeaderboardTieNode.__table__
+_buckets = ScoreBucket.__table__
+_attempts = QuizAttempt.__table__
+
+
+def _ascend(index, size):
+    while index <= size:
+        yield index
+        index += index & -index
+
+
+def _descend(index):
+    while index > 0:
+        yield index
+        index -= index & -index
+
+
+def _update_path(score):
+    """Nodes whose counts include the given score."""
+    return _ascend(max(score, 0) + 1, FENWICK_SIZE)
+
+
+def _query_path(score):
+    """Nodes whose counts sum to the number of users scoring at most score."""
+    return _descend(min(max(score, -1) + 1, FENWICK_SIZE))
+
+
+def _tie_index(last_quiz_date):
+    """Index of a last quiz date in the tie trees; NULL sorts before every date."""
+    if last_quiz_date is None:
+        return 1
+    return min(max((last_quiz_date - TIE_EPOCH) // timedelta(microseconds=1), 0) + 2, TIE_FENWICK_SIZE)
+
+
+def _tie_update_path(last_quiz_date):
+    """Tie tree nodes whose counts include the given date."""
+    return _ascend(_tie_index(last_quiz_date), TIE_FENWICK_SIZE)
+
+
+def _apply_node_deltas(conn, deltas):
+    deltas = [{'node': node, 'users': delta} for node, delta in deltas.items() if delta]
+    if not deltas:
+        return
+    stmt = dialect_insert(conn, _nodes)
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[_nodes.c.node],
+        set_={'users': _nodes.c.users + stmt.excluded.users}
+    ), deltas)
+
+
+def _apply_tie_deltas(conn, deltas):
+    deltas = [{'score': score, 'node': node, 'users': delta} for (score, node), delta in deltas.items() if delta]
+    if not deltas:
+        return
+    stmt = dialect_insert(conn, _tie_nodes)
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[_tie_nodes.c.score, _tie_nodes.c.node],
+        set_={'users': _tie_nodes.c.users + stmt.excluded.users}
+    ), deltas)
+
+
+def add_users(conn, score, last_quiz_date, count=1):
+    """Record count new users with the given score and last quiz date."""
+    _apply_node_deltas(conn, {node: count for node in _update_path(score)})
+    _apply_tie_deltas(conn, {(score, node): count for node in _tie_update_path(last_quiz_date)})
+
+
+def move_user(conn, old_score, new_score, old_date, new_date):
+    """Record that one user's (score, last quiz date) changed from the old to the new values."""
+    deltas = defaultdict(int)
+    tie_deltas = defaultdict(int)
+    for node in _update_path(old_score):
+        deltas[node] -= 1
+    for node in _update_path(new_score):
+        deltas[node] += 1
+    for node in _tie_update_path(old_date):
+        tie_deltas[(old_score, node)] -= 1
+    for node in _tie_update_path(new_date):
+        tie_deltas[(new_score, node)] += 1
+    # Shared ancestors cancel out and are not written
+    _apply_node_deltas(conn, deltas)
+    _apply_tie_deltas(conn, tie_deltas)
+
+
+def count_at_most(conn, score):
+    """Number of users whose score is at most score."""
+    return conn.execute(
+        select(func.coalesce(func.sum(_nodes.c.users), 0))
+        .where(_nodes.c.node.in_(list(_query_path(score))))
+    ).scalar()
+
+
+def count_users(conn):
+    """Number of ranked users."""
+    return count_at_most(conn, FENWICK_SIZE - 1)
+
+
+def _count_tie_trees(conn):
+    """Number of users the tie trees account for (each tree's root counts its whole score)."""
+    return conn.execute(
+        select(func.coalesce(func.sum(_tie_nodes.c.users), 0)).where(_tie_nodes.c.node == TIE_FENWICK_SIZE)
+    ).scalar()
+
+
+def rebuild(conn):
+    """Recompute the rank tables from the users table."""
+    deltas = defaultdict(int)
+    tie_deltas = defaultdict(int)
+    user_score = func.coalesce(_users.c.score, 0)
+    for score, last_quiz_date, count in conn.execute(
+        select(user_score, _users.c.last_quiz_date, func.count()).group_by(user_score, _users.c.last_quiz_date)
+    ):
+        for node in _update_path(score):
+            deltas[node] += count
+        for node in _tie_update_path(last_quiz_date):
+            tie_deltas[(score, node)] += count
+    conn.execute(_nodes.delete())
+    conn.execute(_tie_nodes.delete())
+    if deltas:
+        conn.execute(_nodes.insert(), [{'node': node, 'users': users} for node, users in deltas.items()])
+        conn.execute(_tie_nodes.insert(), [
+            {'score': score, 'node': node, 'users': users} for (score, node), users in tie_deltas.items()
+        ])
+
+
+def ensure_consistent(conn):
+    """Rebuild the rank tables if they do not account for every user."""
+    users = conn.execute(select(func.count()).select_from(_users)).scalar()
+    if count_users(conn) != users or _count_tie_trees(conn) != users:
+        rebuild(conn)
+
+
+def top_users(conn, limit=10):
+    """Highest ranked users as (id, username, score, last_quiz_date) rows."""
+    return conn.execute(
+        select(_users.c.id, _users.c.username, _users.c.score, _users.c.last_quiz_date)
+        .order_by(_users.c.score.desc(), _users.c.last_quiz_date.desc())
+        .limit(limit)
+    ).all()
+
+
+def _ties_ahead(conn, score, last_quiz_date):
+    """Users with the same score ranked ahead (more recent quiz; NULL dates sort last).
+
+    The users of the score's tie tree minus those with a date up to
+    last_quiz_date, from at most 53 nodes.
+    """
+    at_most = list(_descend(_tie_index(last_quiz_date)))
+    tied, not_ahead = conn.execute(
+        select(func.coalesce(func.sum(_tie_nodes.c.users).filter(_tie_nodes.c.node == TIE_FENWICK_SIZE), 0),
+               func.coalesce(func.sum(_tie_nodes.c.users).filter(_tie_nodes.c.node.in_(at_most)), 0))
+        .where(_tie_nodes.c.score == score, _tie_nodes.c.node.in_([*at_most, TIE_FENWICK_SIZE]))
+    ).one()
+    return tied - not_ahead
+
+
+def user_rank(conn, user_id):
+    """Return a UserRank of a user among all users, or None if unknown.
+
+    Costs O(log n) node reads, however many users share the score.
+    """
+    user = conn.execute(
+        select(_users.c.score, _users.c.last_quiz_date).where(_users.c.id == user_id)
+    ).first()
+    if user is None:
+        return None
+    score = user.score or 0
+    total = count_users(conn)
+    above = total - count_at_most(conn, score)
+    rank = above + _ties_ahead(conn, score, user.last_quiz_date) + 1
+    return UserRank(rank, total, score, user.last_quiz_date)
+
+
+def score_of_next_rank(conn, score, last_quiz_date):
+    """Score of the user ranked directly ahead of (score, last_quiz_date), or None if first."""
+    if _ties_ahead(conn, score, last_quiz_date):
+        return score
+    return conn.execute(select(func.min(_users.c.score)).where(_users.c.score > score)).scalar()
+
+
+def _add_to_buckets(conn, granularity, totals):
+    """Add {(bucket_start, user_id): points} to the buckets of one granularity."""
+    rows = [
+        {'granularity': granularity, 'bucket_start': start, 'user_id': user_id, 'score': points}
+        for (start, user_id), points in totals.items()
+    ]
+    if not rows:
+        return
+    stmt = dialect_insert(conn, _buckets)
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[_buckets.c.granularity, _buckets.c.bucket_start, _buckets.c.user_id],
+        set_={'score': _buckets.c.score + stmt.excluded.score}
+    ), rows)
+
+
+def record_points(conn, user_id, points, day):
+    """Credit points earned on a UTC date to the user's day bucket."""
+    _add_to_buckets(conn, 'day', {(day, user_id): points})
+
+
+def backfill_buckets(conn):
+    """Fill empty score buckets from the quiz attempt history."""
+    if conn.execute(select(_buckets.c.user_id).limit(1)).first() is not None:
+        return
+    totals = defaultdict(int)
+    for user_id, created_at, score in conn.execute(
+        select(_attempts.c.user_id, _attempts.c.created_at, _attempts.c.score)
+    ):
+        if created_at is not None:
+            totals[(created_at.date(), user_id)] += score
+    _add_to_buckets(conn, 'day', totals)
+
+
+def _roll_up(conn, source, target, cutoff, bucket_of):
+    """Merge source buckets starting before cutoff into target buckets; returns rows merged."""
+    old = (_buckets.c.granularity == source) & (_buckets.c.bucket_start < cutoff)
+    rows = conn.execute(select(_buckets.c.bucket_start, _buckets.c.user_id, _buckets.c.score).where(old)).all()
+    totals = defaultdict(int)
+    for start, user_id, points in rows:
+        totals[(bucket_of(start), user_id)] += points
+    _add_to_buckets(conn, target, totals)
+    conn.execute(_buckets.delete().where(old))
+    return len(rows)
+
+
+def compact_buckets(conn, today=None):
+    """Roll old day buckets into month buckets and old month buckets into year buckets.
+
+    Cutoffs fall on month and year boundaries, so each coarse bucket is
+    written once with its final total. Returns (days merged, months merged).
+    """
+    today = today or datetime.utcnow().date()
+    day_cutoff = (today - timedelta(days=DAY_BUCKET_RETENTION_DAYS)).replace(day=1)
+    month_cutoff = date(today.year - MONTH_BUCKET_RETENTION_YEARS, 1, 1)
+    days = _roll_up(conn, 'day', 'month', day_cutoff, lambda start: start.replace(day=1))
+    months = _roll_up(conn, 'month', 'year', month_cutoff, lambda start: start.replace(month=1, day=1))
+    return days, months
+
+
+_compacted_on = None
+
+
+def compact_if_due():
+    """Run compact_buckets() at most once per UTC day in this process."""
+    global _compacted_on
+    today = datetime.utcnow().date()
+    if _compacted_on != today:
+        _compacted_on = today
+        with engine.begin() as conn:
+            compact_buckets(conn, today)
+
+
+def _window_totals(days, today=None):
+    """Subquery of (user_id, score) summed over the last days day buckets."""
+    start = (today or datetime.utcnow().date()) - timedelta(days=days - 1)
+    return (
+        select(_buckets.c.user_id, func.sum(_buckets.c.score).label('score'))
+        .where(_buckets.c.granularity == 'day', _buckets.c.bucket_start >= start)
+        .group_by(_buckets.c.user_id)
+        .subquery()
+    )
+
+
+def top_users_in_window(conn, days, limit=10):
+    """Users who earned the most points in the last days days, as top_users() rows."""
+    totals = _window_totals(days)
+    return conn.execute(
+        select(_users.c.id, _users.c.username, totals.c.score, _users.c.last_quiz_date)
+        .join(totals, totals.c.user_id == _users.c.id)
+        .order_by(totals.c.score.desc(), _users.c.last_quiz_date.desc())
+        .limit(limit)
+    ).all()
+
+
+def user_rank_in_window(conn, user_id, days):
+    """UserRank of a user among users active in the last days days, or None if inactive.
+
+    Users with equal window scores share a rank.
+    """
+    totals = _window_totals(days)
+    score = conn.execute(select(totals.c.score).where(totals.c.user_id == user_id)).scalar()
+    if score is None:
+        return None
+    above, total = conn.execute(
+        select(func.count().filter(totals.c.score > score), func.count()).select_from(totals)
+    ).one()
+    last_quiz_date = conn.execute(select(_users.c.last_quiz_date).where(_users.c.id == user_id)).scalar()
+    return UserRank(above + 1, total, score, last_quiz_date)
+
+
+def score_of_next_rank_in_window(conn, score, days):
+    """Lowest window score above score, or None if score leads the window."""
+    totals = _window_totals(days)
+    return conn.execute(select(func.min(totals.c.score)).where(totals.c.score > score)).scalar()
+
+
+def _benchmark(user_count, repeats):
+    """Build a throwaway database of synthetic users and time leaderboard queries."""
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_engine = create_engine(f'sqlite:///{tmp}/leaderboard_bench.db')
+        Base.metadata.create_all(bench_engine, tables=[_users, _nodes, _tie_nodes])
+        rng = random.Random(42)
+        now = datetime.utcnow()
+
+        def synthetic_users():
+            for i in range(user_count):
+                yield {
+                    'username': f'user{i}',
+                    'score': int(rng.paretovariate(1.2) * 10),
+                    'last_quiz_date': now - timedelta(minutes=rng.randrange(525600))
+                }
+
+        stats = bulk_insert(bench_engine, _users, synthetic_users(), chunk_size=10000)
+        print(f"Inserted {stats.rows:,} users in {stats.seconds:.1f}s")
+
+        with bench_engine.begin() as conn:
+            start = time.perf_counter()
+            rebuild(conn)
+            print(f"Rebuilt rank table in {time.perf_counter() - start:.2f}s")
+
+        def timed(label, fn):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                fn()
+            print(f"{label}: {(time.perf_counter() - start) / repeats * 1000:.3f} ms")
+
+        user_ids = [rng.randrange(1, user_count + 1) for _ in range(repeats)]
+        with bench_engine.begin() as conn:
+            timed("top 10", lambda: top_users(conn, 10))
+            ids = iter(user_ids)
+            timed("rank of user", lambda: user_rank(conn, next(ids)))
+            ids = iter(user_ids)
+
+            def naive_rank():
+                score = conn.execute(select(_users.c.score).where(_users.c.id == next(ids))).scalar()
+                conn.execute(select(func.count()).select_from(_users).where(_users.c.score > score)).scalar()
+            timed("rank of user (COUNT(*) baseline)", naive_rank)
+
+            moves = iter([(score, score + rng.randrange(1, 11), None, now) for score in user_ids])
+            timed("score change", lambda: move_user(conn, *next(moves)))
+        bench_engine.dispose()
+
+
+with engine.begin() as _conn:
+    ensure_consistent(_conn)
+    backfill_buckets(_conn)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    subcommands.add_parser('rebuild', help='recompute the rank table from the users table')
+    subcommands.add_parser('compact', help='roll old day and month score buckets into coarser ones')
+    bench = subcommands.add_parser('bench', help='time leaderboard queries on synthetic users')
+    bench.add_argument('--users', type=int, default=1_000_000)
+    bench.add_argument('--repeats', type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.command == 'rebuild':
+        with engine.begin() as conn:
+            rebuild(conn)
+        print("Leaderboard rank table rebuilt")
+    elif args.command == 'compact':
+        with engine.begin() as conn:
+            days, months = compact_buckets(conn)
+        print(f"Rolled up {days} day buckets and {months} month buckets")
+    else:
+        _benchmark(args.users, args.repeats)
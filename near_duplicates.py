@@ -0,0 +1,131 @@
+"""Near-duplicate question detection over embeddings cached in the database."""
+import os
+
+import numpy as np
+from sqlalchemy import select
+
+from bulk_ingest import normalize_question
+
+# Sentence-transformers model used when its weights are available locally
+SENTENCE_MODEL = os.environ.get('NEAR_DUPLICATE_MODEL', 'all-MiniLM-L6-v2')
+# Width of the hashed TF-IDF space used when no model weights are present
+HASHED_FEATURES = 1024
+# Rows compared against the whole bank per matrix multiplication
+BLOCK_SIZE = 1024
+
+
+class SentenceEmbedder:
+    """Dense, unit-length sentence-transformers embeddings."""
+
+    default_threshold = 0.9
+
+    def __init__(self, model_name=SENTENCE_MODEL):
+        from sentence_transformers import SentenceTransformer
+        # Never download weights from here; fall back to hashing instead
+        self.model = SentenceTransformer(model_name, local_files_only=True)
+        self.name = f"st:{model_name}"
+
+    def embed(self, texts):
+        return self.model.encode(list(texts), batch_size=64, normalize_embeddings=True,
+                                 convert_to_numpy=True).astype(np.float32)
+
+    def prepare(self, matrix):
+        return matrix
+
+
+class HashedTfidfEmbedder:
+    """Offline fallback: sublinear term counts hashed into a fixed-width space.
+
+    Stored vectors hold only term frequencies, so new rows can be embedded
+    independently; IDF weights are derived from the whole bank in prepare().
+    """
+
+    default_threshold = 0.75
+
+    def __init__(self, n_features=HASHED_FEATURES):
+        from sklearn.feature_extraction.text import HashingVectorizer
+        self.vectorizer = HashingVectorizer(n_features=n_features, ngram_range=(1, 2),
+                                            alternate_sign=False, norm=None,
+                                            preprocessor=normalize_question)
+        self.name = f"hashed-tfidf:{n_features}"
+
+    def embed(self, texts):
+        counts = self.vectorizer.transform(list(texts))
+        counts.data = 1 + np.log(counts.data)
+        return counts.toarray().astype(np.float32)
+
+    def prepare(self, matrix):
+        doc_freq = np.count_nonzero(matrix, axis=0)
+        idf = np.log((1 + len(matrix)) / (1 + doc_freq)) + 1
+        weighted = matrix * idf.astype(np.float32)
+        norms = np.linalg.norm(weighted, axis=1, keepdims=True)
+        return weighted / np.maximum(norms, 1e-12)
+
+
+def load_embedder():
+    """Sentence-transformers embedder if the model is available offline, else hashed TF-IDF."""
+    try:
+        return SentenceEmbedder()
+    except Exception:
+        return HashedTfidfEmbedder()
+
+
+def sync_embeddings(engine, quizzes, embeddings, embedder, batch_size=256):
+    """Embed every question that has no stored vector for this embedder.
+
+    Vectors of deleted questions and of other embedders are dropped first, so
+    later runs only embed rows added since the previous one. Returns the
+    number of questions embedded.
+    """
+    with engine.begin() as conn:
+        conn.execute(embeddings.delete().where(embeddings.c.model != embedder.name))
+        conn.execute(embeddings.delete().where(embeddings.c.quiz_id.not_in(select(quizzes.c.id))))
+
+        missing = conn.execute(
+            select(quizzes.c.id, quizzes.c.question)
+            .outerjoin(embeddings, embeddings.c.quiz_id == quizzes.c.id)
+            .where(embeddings.c.quiz_id.is_(None))
+            .order_by(quizzes.c.id)
+        ).all()
+
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            vectors = embedder.embed(question or '' for _, question in batch)
+            conn.execute(embeddings.insert(), [
+                {'quiz_id': quiz_id, 'model': embedder.name, 'vector': vector.tobytes()}
+                for (quiz_id, _), vector in zip(batch, vectors)
+            ])
+    return len(missing)
+
+
+def load_embedding_matrix(engine, embeddings, embedder):
+    """Return (ids, matrix) of all stored vectors, prepared for cosine similarity."""
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(embeddings.c.quiz_id, embeddings.c.vector)
+            .where(embeddings.c.model == embedder.name)
+            .order_by(embeddings.c.quiz_id)
+        ).all()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+
+    ids = np.fromiter((quiz_id for quiz_id, _ in rows), dtype=np.int64, count=len(rows))
+    matrix = np.frombuffer(b''.join(vector for _, vector in rows), dtype=np.float32).reshape(len(rows), -1)
+    return ids, embedder.prepare(matrix)
+
+
+def find_near_duplicates(ids, matrix, threshold, block_size=BLOCK_SIZE):
+    """Return (id_a, id_b, similarity) for every pair at or above threshold, most similar first.
+
+    Rows of matrix must be unit length. Similarities are computed block by
+    block with matrix products, so memory stays at block_size x len(ids).
+    """
+    pairs = []
+    for start in range(0, len(ids), block_size):
+        block = matrix[start:start + block_size]
+        sims = block @ matrix.T
+        # Keep each unordered pair once and skip self-similarity
+        rows, cols = np.nonzero(np.triu(sims >= threshold, k=start + 1))
+        pairs.extend(zip(ids[rows + start].tolist(), ids[cols].tolist(), sims[rows, cols].tolist()))
+    pairs.sort(key=lambda pair: pair[2], reverse=True)
+    return pairs
@@ -0,0 +1,261 @@
+"""Concurrent article ingestion for the newsletter.
+
+Pages are fetched by a bounded thread pool over one pooled requests.Session,
+so connections (and TLS sessions) to a host are reused across articles.
+A per-host semaphore stops one site from receiving more than a few requests
+at a time. Each page is downloaded once and the same HTML is handed to
+newspaper3k and, if that yields too little, to the BeautifulSoup fallback.
+Downloads go through http_cache, so fetching a known URL again is a cache
+hit or a conditional request answered with 304. Summaries are filled in by
+summarizer.summarize_rows() when the rows are stored.
+"""
+import argparse
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from http_cache import http_cache, source_key
+
+# Pages fetched at once, and at once from a single host
+MAX_WORKERS = 8
+PER_HOST_LIMIT = 2
+REQUEST_TIMEOUT = 10
+USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36')
+# Articles with less text than this from newspaper3k are parsed again with BeautifulSoup
+MIN_ARTICLE_CHARS = 50
+
+IngestResult = namedtuple('IngestResult', ['url', 'article', 'error'])
+
+
+def make_session(pool_size=MAX_WORKERS):
+    """requests.Session keeping up to pool_size connections per host, with retries on transient errors."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size,
+        max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=('GET', 'HEAD'))
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+
+# Shared by every ingestion in this process
+http_session = make_session()
+
+
+class HostLimiter:
+    """Bounded semaphore per host name."""
+
+    def __init__(self, limit=PER_HOST_LIMIT):
+        self.limit = limit
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.limit)
+            return self._semaphores[host]
+
+
+class RateLimiter:
+    """Token bucket shared by threads: rate acquisitions per second on average, bursts of up to burst."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available; returns the seconds waited."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Going negative reserves a future token, so waiters are served in order
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens / self.rate)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def parse_url_list(text):
+    """URLs from an OPML document or from text with one URL per line, deduplicated in order."""
+    if text.lstrip().startswith('<'):
+        root = ET.fromstring(text)
+        candidates = [outline.get('url') or outline.get('htmlUrl') for outline in root.iter('outline')]
+    else:
+        candidates = [line.strip() for line in text.splitlines() if not line.strip().startswith('#')]
+    urls = [url for url in candidates if url and url.startswith(('http://', 'https://'))]
+    return list(dict.fromkeys(urls))
+
+
+def fetch_html(url, session=None, timeout=REQUEST_TIMEOUT, cache=http_cache):
+    """Download a page once; returns (final URL after redirects, HTML).
+
+    Pass cache=None to always download.
+    """
+    if cache is not None:
+        page = cache.fetch(session or http_session, url, timeout)
+        return page.url, page.text
+    response = (session or http_session).get(url, timeout=timeout)
+    response.raise_for_status()
+    return response.url, response.text
+
+
+def _parse_with_newspaper(url, html):
+    from newspaper import Article
+    article = Article(url)
+    article.download(input_html=html)
+    article.parse()
+    if article.title and (not article.text or len(article.text) < MIN_ARTICLE_CHARS):
+        raise ValueError("Insufficient content from newspaper3k")
+    return {
+        'title': article.title,
+        'content': article.text,  # Store full content
+        'summary': article.title,  # Use title as summary for display
+        'image_url': article.top_image or None,
+        'source_url': url  # Store the original URL
+    }
+
+
+def _parse_with_bs4(url, html):
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Try to get title from common meta tags
+    title = ''
+    for tag in ['og:title', 'twitter:title', 'title']:
+        title_tag = soup.find('meta', property=tag) or soup.find('meta', {'name': tag})
+        if title_tag and title_tag.get('content'):
+            title = title_tag['content']
+            break
+
+    # If no title found in meta, try to get it from h1
+    if not title:
+        h1 = soup.find('h1')
+        if h1:
+            title = h1.get_text(strip=True)
+
+    # If still no title, use the URL
+    if not title:
+        title = url
+
+    # Article text: the paragraphs outside page chrome
+    for tag in soup(['script', 'style', 'nav', 'header', 'footer', 'aside', 'form']):
+        tag.decompose()
+    paragraphs = [text for text in (p.get_text(' ', strip=True) for p in soup.find_all('p')) if text]
+
+    # Get the first paragraph as summary
+    summary = ''
+    for text in paragraphs:
+        if len(text) > 50:  # Only consider paragraphs with some content
+            summary = text
+            break
+
+    return {
+        'title': title,
+        'content': '\n\n'.join(paragraphs) or title,
+        'summary': summary[:200] + '...' if summary else title,
+        'image_url': None,  # Page images are not extracted without newspaper3k
+        'source_url': url  # Store the original URL
+    }
+
+
+def parse_article(url, html):
+    """Article dict from already downloaded HTML: newspaper3k first, BeautifulSoup as fallback."""
+    try:
+        return _parse_with_newspaper(url, html)
+    except Exception:
+        # Also covers newspaper3k not being installed
+        return _parse_with_bs4(url, html)
+
+
+def fetch_article(url, session=None, limiter=None, timeout=REQUEST_TIMEOUT, rate_limiter=None):
+    """Download and parse one article.
+
+    Waits for a per-host slot when a limiter is given, and then for a token
+    when a rate_limiter is given.
+    """
+    if limiter is None:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        final_url, html = fetch_html(url, session, timeout)
+    else:
+        with limiter(url):
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            final_url, html = fetch_html(url, session, timeout)
+    article = parse_article(final_url, html)
+    article['source_url'] = url
+    return article
+
+
+def ingest_urls(urls, session=None, max_workers=MAX_WORKERS, per_host=PER_HOST_LIMIT,
+                timeout=REQUEST_TIMEOUT, on_result=None, rate_limiter=None):
+    """Fetch and parse articles concurrently.
+
+    Returns an IngestResult per URL in input order; on_result(result) is
+    called as each one finishes, e.g. to drive a progress bar. A shared
+    RateLimiter bounds requests per second across all hosts.
+    """
+    limiter = HostLimiter(per_host)
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(fetch_article, url, session, limiter, timeout, rate_limiter): url for url in urls}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                result = IngestResult(url, future.result(), None)
+            except Exception as e:
+                result = IngestResult(url, None, str(e)[:200])
+            results[url] = result
+            if on_result:
+                on_result(result)
+    return [results[url] for url in urls]
+
+
+def newsletter_rows(results, date_published=None, is_published=1):
+    """Newsletter rows for bulk_insert() from successful IngestResults."""
+    for result in results:
+        article = result.article
+        if not article:
+            continue
+        yield {
+            'title': article['title'],
+            'summary': article.get('summary', article['title']),
+            'content': article['content'],
+            'image_url': article.get('image_url'),
+            'source_url': article.get('source_url', result.url),
+            'source_key': source_key(article.get('source_url', result.url)),
+            'date_published': date_published or datetime.utcnow(),
+            'is_published': is_published
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fetch and parse articles from a URL list or OPML file")
+    parser.add_argument('path')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS)
+    parser.add_argument('--per-host', type=int, default=PER_HOST_LIMIT)
+    args = parser.parse_args()
+
+    with open(args.path, encoding='utf-8') as f:
+        url_list = parse_url_list(f.read())
+    for result in ingest_urls(url_list, max_workers=args.workers, per_host=args.per_host):
+        print(f"{result.url}: {result.article['title'] if result.article else 'ERROR ' + result.error}")
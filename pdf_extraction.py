@@ -0,0 +1,152 @@
+"""Parallel text extraction and question parsing for PDF quizzes."""
+import os
+import re
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import pdfplumber
+
+# Worker processes used for page extraction (override with PDF_EXTRACT_WORKERS)
+DEFAULT_WORKERS = int(os.environ.get('PDF_EXTRACT_WORKERS', 0)) or max(1, (os.cpu_count() or 2) - 1)
+# Number of consecutive pages handed to a worker in one task
+PAGES_PER_SHARD = 4
+
+# Bump whenever the patterns or the state machine change so cached results are invalidated
+PARSER_VERSION = '2'
+
+# Patterns to match questions, options and answers
+QUESTION_PATTERN = re.compile(r'^(\d+)\.\s+(.+)$')
+OPTION_PATTERN = re.compile(r'^([a-d])\)\s+(.+)$', re.IGNORECASE)
+ANSWER_PATTERN = re.compile(r'^Answer:\s*([a-d])$', re.IGNORECASE)
+
+
+def _extract_page_range(path, start, stop):
+    """Extract the text of pages [start, stop) of the PDF at path (runs in a worker)."""
+    texts = []
+    with pdfplumber.open(path) as pdf:
+        for page in pdf.pages[start:stop]:
+            texts.append(page.extract_text() or '')
+            # Drop the parsed page objects so worker memory stays flat
+            page.close()
+    return texts
+
+
+def _spool_to_disk(pdf_file):
+    """Return a filesystem path for pdf_file, copying file-like objects to a temp file."""
+    if isinstance(pdf_file, (str, os.PathLike)):
+        return os.fspath(pdf_file), False
+
+    if hasattr(pdf_file, 'seek'):
+        pdf_file.seek(0)
+    tmp = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
+    with tmp:
+        shutil.copyfileobj(pdf_file, tmp)
+    return tmp.name, True
+
+
+def iter_page_texts(pdf_file, workers=None):
+    """Yield the text of every page, in page order, as soon as it is extracted.
+
+    pdf_file may be a path or a file-like object (e.g. a Streamlit upload).
+    Pages are sharded across a process pool with a bounded number of shards in
+    flight, so only a few pages of text are held in memory at once. Each page's
+    text is extracted exactly once; pages without text yield ''.
+    """
+    workers = workers or DEFAULT_WORKERS
+    path, is_temp = _spool_to_disk(pdf_file)
+    try:
+        with pdfplumber.open(path) as pdf:
+            page_count = len(pdf.pages)
+
+        shards = [(start, min(start + PAGES_PER_SHARD, page_count))
+                  for start in range(0, page_count, PAGES_PER_SHARD)]
+
+        # Small documents are not worth the cost of starting a pool
+        if workers <= 1 or len(shards) <= 1:
+            for start, stop in shards:
+                yield from _extract_page_range(path, start, stop)
+            return
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as pool:
+            pending = deque()
+            shard_iter = iter(shards)
+            # Keep at most two shards per worker in flight and consume them in
+            # submission order, which is page order
+            for start, stop in islice(shard_iter, workers * 2):
+                pending.append(pool.submit(_extract_page_range, path, start, stop))
+            while pending:
+                texts = pending.popleft().result()
+                for start, stop in islice(shard_iter, 1):
+                    pending.append(pool.submit(_extract_page_range, path, start, stop))
+                yield from texts
+    finally:
+        if is_temp:
+            os.unlink(path)
+
+
+def iter_questions(page_texts):
+    """Run the question/option/answer state machine over a stream of page texts.
+
+    Yields {'question', 'options', 'answer'} dicts as soon as a question is
+    complete: when its Answer line arrives, when the next question header
+    starts, or at the end of the document. options maps lowercase letters to
+    option text and answer is a lowercase letter or None.
+    """
+    current_question = None
+    current_options = {}
+
+    for text in page_texts:
+        for line in text.split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+
+            # Check if line is a question
+            q_match = QUESTION_PATTERN.match(line)
+            if q_match:
+                # Emit previous question (without an answer) if exists
+                if current_question and current_options:
+                    yield {'question': current_question, 'options': current_options, 'answer': None}
+                current_question = q_match.group(2)
+                current_options = {}
+
+            # Check if line is an option
+            opt_match = OPTION_PATTERN.match(line)
+            if opt_match and current_question:
+                letter = opt_match.group(1).lower()
+                current_options[letter] = opt_match.group(2)
+
+            # Check if line is an answer; it completes the current question
+            ans_match = ANSWER_PATTERN.match(line)
+            if ans_match and current_question and current_options:
+                yield {'question': current_question, 'options': current_options,
+                       'answer': ans_match.group(1).lower()}
+                current_question = None
+                current_options = {}
+
+    # Emit the last question if it exists
+    if current_question and current_options:
+        yield {'question': current_question, 'options': current_options, 'answer': None}
+
+
+def iter_questions_from_pdf(pdf_file, workers=None):
+    """Stream quiz questions out of a PDF while its pages are still being extracted."""
+    return iter_questions(iter_page_texts(pdf_file, workers=workers))
+
+
+def extract_page_texts(pdf_file, workers=None):
+    """Extract the text of every page, in page order."""
+    return list(iter_page_texts(pdf_file, workers=workers))
+
+
+def parse_questions(page_texts):
+    """Parse all questions out of page texts into a list."""
+    return list(iter_questions(page_texts))
+
+
+def extract_questions(pdf_file, workers=None):
+    """Extract and parse all quiz questions from a PDF."""
+    return list(iter_questions_from_pdf(pdf_file, workers=workers))
@@ -0,0 +1,110 @@
+"""Content-addressed on-disk cache of parsed PDF quizzes."""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zlib
+
+from pdf_extraction import PARSER_VERSION, iter_questions_from_pdf
+
+CACHE_DIR = os.environ.get('PDF_QUIZ_CACHE_DIR', os.path.join('.cache', 'pdf_quizzes'))
+# Total size of cache entries on disk before least recently used ones are evicted
+MAX_CACHE_BYTES = int(os.environ.get('PDF_QUIZ_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+_CHUNK_SIZE = 1024 * 1024
+_ENTRY_SUFFIX = '.json.z'
+
+
+def pdf_cache_key(pdf_file):
+    """SHA-256 of the parser version plus the PDF bytes (path or file-like object)."""
+    digest = hashlib.sha256(f"parser-v{PARSER_VERSION}\0".encode())
+    if isinstance(pdf_file, (str, os.PathLike)):
+        with open(pdf_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    else:
+        pdf_file.seek(0)
+        for chunk in iter(lambda: pdf_file.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+        pdf_file.seek(0)
+    return digest.hexdigest()
+
+
+class ParsedQuizCache:
+    """Size-bounded LRU cache of parsed question lists, stored as compressed JSON files.
+
+    Entry mtimes are bumped on every hit, so eviction removes the least
+    recently used entries first. Writes are atomic, which makes the cache safe
+    to share between sessions and processes.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + _ENTRY_SUFFIX)
+
+    def get(self, key):
+        """Return the cached question list for key, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                questions = json.loads(zlib.decompress(f.read()))
+            os.utime(path)
+        except (FileNotFoundError, ValueError, zlib.error):
+            return None
+        return questions
+
+    def put(self, key, questions):
+        """Store a question list under key and evict old entries if over budget."""
+        os.makedirs(self.directory, exist_ok=True)
+        payload = zlib.compress(json.dumps(questions, separators=(',', ':')).encode('utf-8'))
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(_ENTRY_SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+# Shared by every session in this process
+pdf_quiz_cache = ParsedQuizCache()
+
+
+def iter_cached_questions(pdf_file, cache=pdf_quiz_cache, workers=None):
+    """Stream questions from the cache, or from the parser and cache them once it finishes."""
+    key = pdf_cache_key(pdf_file)
+    cached = cache.get(key)
+    if cached is not None:
+        yield from cached
+        return
+
+    questions = []
+    for q in iter_questions_from_pdf(pdf_file, workers=workers):
+        questions.append(q)
+        yield q
+    cache.put(key, questions)
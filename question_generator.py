@@ -0,0 +1,299 @@
+"""Fill-in-the-blank quiz questions generated from newsletter articles.
+
+A TermIndex over the content of every stored article gives each article
+its key terms (highest TF-IDF unigrams and bigrams) and gives every term a
+vector of its TF-IDF weight per article. Only noun-like terms count: words
+that follow a determiner or preposition somewhere in the corpus ("the
+agent", "of tokens"), without an adjective, adverb or participle ending,
+and adjacent word pairs ending in such a word. For each new published
+article, the best TextRank sentences (see summarizer.py) that contain a key
+term exactly once become questions with that term blanked out. The three
+distractors are key terms of other or the same articles, with the same
+length in words and the same number (singular or plural) as the answer.
+They are chosen by cosine similarity of those vectors (terms used in
+similar articles) and then by closeness in IDF, and never share a word
+root with the answer or the sentence.
+
+question_generation records which articles were processed, so every run
+only handles articles published since the last one. An article that gave
+no questions (a small corpus may lack distractors) is tried again once
+more articles have been stored. Everything runs offline on scikit-learn
+and NumPy.
+"""
+import argparse
+import random
+import re
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func, select
+
+from bulk_ingest import bulk_insert, dialect_insert, quiz_rows_from_questions
+from database import engine, GeneratedQuestions, Newsletter, Quiz
+from summarizer import rank_sentences
+
+# Questions generated from one article at most, and key terms considered for it
+QUESTIONS_PER_ARTICLE = 3
+KEY_TERMS_PER_ARTICLE = 15
+# Shortest single-word answer; shorter words are rarely what an article is about
+MIN_TERM_CHARS = 4
+# Candidate distractors ranked before the overlap checks
+DISTRACTOR_CANDIDATES = 50
+# Articles read and questions written per transaction
+BATCH_SIZE = 100
+BLANK = '_____'
+QUESTION_PREFIX = 'Fill in the blank: '
+
+GenerationResult = namedtuple('GenerationResult', ['articles', 'questions', 'skipped'])
+
+_newsletters = Newsletter.__table__
+_generated = GeneratedQuestions.__table__
+
+# Words of two or more characters starting with a letter, keeping inner hyphens ("fine-tuning")
+_TOKEN_PATTERN = r'(?u)\b[A-Za-z][A-Za-z0-9]*(?:-[A-Za-z0-9]+)*\b'
+# Punctuation that ends a run of words; word pairs never span it
+_PHRASE_BREAK = re.compile(r'[.,;:!?()\[\]"“”]')
+# Words usually followed by a noun (phrase)
+_NOUN_MARKERS = frozenset(
+    'a an the this these those each every its their our your many several some any no such '
+    'of in on for with by from into between through about over under without'.split()
+)
+# Endings of adjectives, adverbs and participles rather than nouns
+_NON_NOUN_SUFFIXES = ('ly', 'ed', 'ive', 'ous', 'ful', 'able', 'ible', 'less')
+
+
+def _stem(word):
+    """Crude singular form used to tell distractors apart from the answer."""
+    return word[:-1] if len(word) > 3 and word.endswith('s') and not word.endswith('ss') else word
+
+
+def _roots(text):
+    """Crude roots of the words of text, hyphenated parts included.
+
+    Options sharing one ("cluster", "clustering", "cluster-based") never
+    appear in the same question.
+    """
+    return {_stem(part)[:5] for part in re.split(r'[\s-]+', text) if part}
+
+
+def _is_plural(term):
+    last = term.rsplit(' ', 1)[-1]
+    return _stem(last) != last
+
+
+def _noun_evidence(texts):
+    """(noun-like words, adjacent word pairs) of lowercased texts.
+
+    A word is noun-like when it follows a noun marker somewhere and ends a
+    phrase somewhere (before punctuation or a stop word), which rules out
+    adjectives seen only in front of their noun ("on small datasets").
+    """
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+    marked = set()
+    heads = set()
+    pairs = set()
+    for text in texts:
+        for run in _PHRASE_BREAK.split(text.lower()):
+            words = re.findall(_TOKEN_PATTERN, run)
+            for previous, word in zip(words, words[1:]):
+                if previous in _NOUN_MARKERS:
+                    marked.add(word)
+                if word in ENGLISH_STOP_WORDS:
+                    heads.add(previous)
+                pairs.add(f'{previous} {word}')
+            if words:
+                heads.add(words[-1])
+    return (marked & heads) - _NOUN_MARKERS, pairs
+
+
+def _noun_like(term, nouns, pairs):
+    """Whether term is a noun seen in noun position, or an adjacent pair ending in one."""
+    words = term.split()
+    if any(word.endswith(_NON_NOUN_SUFFIXES) or word.isdigit() for word in words):
+        return False
+    if len(words) == 1:
+        return len(term) >= MIN_TERM_CHARS and term in nouns
+    return term in pairs and words[-1] in nouns
+
+
+def _match_case(term, surface):
+    """term written with the capitalization of surface, so options look alike."""
+    if surface.isupper() and len(surface) > 1:
+        return term.upper()
+    if surface[:1].isupper():
+        return ' '.join(word[:1].upper() + word[1:] for word in term.split())
+    return term
+
+
+class TermIndex:
+    """TF-IDF terms of a corpus of articles, for key terms and distractors."""
+
+    def __init__(self, ids, texts):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        self.vectorizer = TfidfVectorizer(
+            stop_words='english', ngram_range=(1, 2), sublinear_tf=True, token_pattern=_TOKEN_PATTERN,
+            # Terms found in most articles of a large corpus say nothing about any of them
+            max_df=0.8 if len(texts) >= 10 else 1.0
+        )
+        self.matrix = self.vectorizer.fit_transform(texts).tocsr()  # articles x terms
+        self.terms = self.vectorizer.get_feature_names_out()
+        self.idf = self.vectorizer.idf_
+        self.rows = {article_id: row for row, article_id in enumerate(ids)}
+        self.words = np.array([term.count(' ') + 1 for term in self.terms])
+        nouns, pairs = _noun_evidence(texts)
+        self.eligible = np.array([_noun_like(term, nouns, pairs) for term in self.terms], dtype=bool)
+        self.plural = np.array([_is_plural(term) for term in self.terms], dtype=bool)
+        # Distractors come from terms that are key terms of some article
+        self.candidates = np.zeros(len(self.terms), dtype=bool)
+        for row in range(self.matrix.shape[0]):
+            self.candidates[self._ranked_terms(row)[:KEY_TERMS_PER_ARTICLE]] = True
+        # Unit-length term vectors over articles, so products are cosine similarities
+        by_term = self.matrix.T.tocsr()
+        norms = np.sqrt(np.asarray(by_term.multiply(by_term).sum(axis=1)).ravel())
+        self.vectors = by_term.multiply(1 / np.maximum(norms, 1e-12)[:, None]).tocsr()
+        self.index = {term: i for i, term in enumerate(self.terms)}
+
+    def _ranked_terms(self, row):
+        """Indices of the eligible terms of a matrix row, highest weight first."""
+        start, end = self.matrix.indptr[row], self.matrix.indptr[row + 1]
+        indices = self.matrix.indices[start:end][np.argsort(-self.matrix.data[start:end], kind='stable')]
+        return indices[self.eligible[indices]]
+
+    def key_terms(self, article_id, count=KEY_TERMS_PER_ARTICLE):
+        """The article's highest-weighted eligible terms, best first."""
+        return [self.terms[i] for i in self._ranked_terms(self.rows[article_id])[:count]]
+
+    def distractors(self, term, avoid_words, count=3):
+        """count candidate terms resembling term that share no word root with it, each other or avoid_words."""
+        i = self.index[term]
+        similarity = np.asarray((self.vectors @ self.vectors[i].T).todense()).ravel()
+        # Similar usage first; closeness in IDF breaks ties among unrelated terms
+        score = similarity - 0.01 * np.abs(self.idf - self.idf[i])
+        score[~self.candidates | (self.words != self.words[i]) | (self.plural != self.plural[i])] = -np.inf
+        score[i] = -np.inf
+        top = np.argpartition(-score, min(DISTRACTOR_CANDIDATES, len(score) - 1))[:DISTRACTOR_CANDIDATES]
+        used = _roots(term).union(*map(_roots, avoid_words))
+        picked = []
+        for j in top[np.argsort(-score[top], kind='stable')]:
+            if score[j] == -np.inf:
+                break
+            words = _roots(self.terms[j])
+            if words & used:
+                continue
+            picked.append(self.terms[j])
+            used |= words
+            if len(picked) == count:
+                break
+        return picked
+
+
+def build_term_index(conn):
+    """TermIndex over the content of every stored article, or None if they hold no terms at all."""
+    rows = conn.execute(select(_newsletters.c.id, _newsletters.c.content)).all()
+    try:
+        return TermIndex([row.id for row in rows], [row.content or '' for row in rows])
+    except ValueError:
+        # Empty vocabulary: every article is empty or only stop words
+        return None
+
+
+def questions_from_article(index, article_id, sentences, scores, rng, limit=QUESTIONS_PER_ARTICLE):
+    """Up to limit {'question', 'options', 'answer'} dicts from an article's ranked sentences."""
+    key_terms = index.key_terms(article_id)
+    questions = []
+    used_terms = set()
+    for s in np.argsort(-scores, kind='stable'):
+        sentence = sentences[s]
+        for term in key_terms:
+            if term in used_terms:
+                continue
+            pattern = r'\b' + r'\s+'.join(re.escape(word) for word in term.split()) + r'\b'
+            matches = list(re.finditer(pattern, sentence, re.IGNORECASE))
+            # A second occurrence would give the answer away
+            if len(matches) != 1:
+                continue
+            question = QUESTION_PREFIX + sentence[:matches[0].start()] + BLANK + sentence[matches[0].end():]
+            if len(question) > 500:
+                continue
+            avoid = [word.lower() for word in re.findall(_TOKEN_PATTERN, sentence)]
+            distractors = index.distractors(term, avoid)
+            if len(distractors) < 3:
+                continue
+            surface = matches[0].group(0)
+            options = [surface] + [_match_case(distractor, surface) for distractor in distractors]
+            rng.shuffle(options)
+            questions.append({
+                'question': question,
+                'options': dict(zip('abcd', options)),
+                'answer': 'abcd'[options.index(surface)]
+            })
+            used_terms.add(term)
+            break
+        if len(questions) == limit:
+            break
+    return questions
+
+
+def pending_articles(conn, corpus_size, limit=None):
+    """Published articles to generate questions from, oldest first.
+
+    These are the articles never processed, and those that gave no questions
+    from a corpus smaller than corpus_size.
+    """
+    query = (
+        select(_newsletters.c.id, _newsletters.c.content, _newsletters.c.source_url)
+        .outerjoin(_generated, _generated.c.newsletter_id == _newsletters.c.id)
+        .where(_newsletters.c.is_published == 1,
+               _generated.c.newsletter_id.is_(None)
+               | ((_generated.c.questions == 0) & (func.coalesce(_generated.c.corpus_size, 0) < corpus_size)))
+        .order_by(_newsletters.c.id)
+    )
+    return conn.execute(query.limit(limit) if limit else query).all()
+
+
+def generate_questions(limit=None, batch_size=BATCH_SIZE):
+    """Generate and store questions for new published articles; returns a GenerationResult.
+
+    Questions already in the bank (same normalized text) are skipped.
+    """
+    with engine.connect() as conn:
+        corpus_size = conn.execute(select(func.count()).select_from(_newsletters)).scalar()
+        articles = pending_articles(conn, corpus_size, limit)
+        if not articles:
+            return GenerationResult(0, 0, 0)
+        index = build_term_index(conn)
+
+    written = skipped = 0
+    for start in range(0, len(articles), batch_size):
+        batch = articles[start:start + batch_size]
+        rows = []
+        counts = []
+        for article, (sentences, scores, _) in zip(batch, rank_sentences([a.content for a in batch])):
+            questions = (questions_from_article(index, article.id, sentences, scores, random.Random(article.id))
+                         if index is not None else [])
+            # The quizzes.source column holds 200 characters
+            rows.extend(quiz_rows_from_questions(questions, source=(article.source_url or '')[:200] or None))
+            counts.append({'newsletter_id': article.id, 'questions': len(questions), 'corpus_size': corpus_size,
+                           'generated_at': datetime.utcnow()})
+        stats = bulk_insert(engine, Quiz.__table__, rows, ignore_duplicates=True)
+        with engine.begin() as conn:
+            stmt = dialect_insert(conn, _generated)
+            conn.execute(stmt.on_conflict_do_update(
+                index_elements=[_generated.c.newsletter_id],
+                set_={column: stmt.excluded[column] for column in ('questions', 'corpus_size', 'generated_at')}
+            ), counts)
+        written += stats.rows
+        skipped += stats.skipped
+    return GenerationResult(len(articles), written, skipped)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate quiz questions from new newsletter articles")
+    parser.add_argument('--limit', type=int, default=None, help="articles to process at most")
+    args = parser.parse_args()
+    result = generate_questions(args.limit)
+    print(f"Generated {result.questions} questions from {result.articles} articles "
+          f"({result.skipped} already in the bank)")
@@ -0,0 +1,79 @@
+"""Process-wide read-through cache shared by all Streamlit sessions.
+
+Streamlit re-executes streamlit_app.py on every rerun, but imported modules
+live for the whole process, so the cache instance below is shared by every
+session and survives reruns.
+"""
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+# Entries kept before the least recently used ones are evicted
+DEFAULT_MAX_ENTRIES = 1024
+# Seconds before an entry is reloaded even without an explicit invalidation
+DEFAULT_TTL = 300
+
+
+class ReadThroughCache:
+    """Thread-safe TTL + LRU cache of immutable values grouped into namespaces.
+
+    Values must be immutable snapshots (tuples, SQLAlchemy Row objects, ...)
+    because the same object is handed to every session. Writers call
+    invalidate() with the namespaces they touched.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (namespace, key) -> (expires_at, value)
+        self._counters = defaultdict(lambda: {'hits': 0, 'misses': 0})
+        self._generations = defaultdict(int)  # Bumped by invalidate()
+        self._lock = threading.Lock()
+
+    def get_or_load(self, namespace, key, loader):
+        """Return the cached value for (namespace, key), calling loader() on a miss."""
+        cache_key = (namespace, key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(cache_key)
+                self._counters[namespace]['hits'] += 1
+                return entry[1]
+            self._counters[namespace]['misses'] += 1
+            generation = self._generations[namespace]
+
+        # Load outside the lock so a slow query does not block other sessions
+        value = loader()
+        with self._lock:
+            # Do not store a value loaded before a concurrent invalidation
+            if self._generations[namespace] != generation:
+                return value
+            self._entries[cache_key] = (now + self.ttl, value)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, *namespaces):
+        """Drop every entry of the given namespaces."""
+        with self._lock:
+            for namespace in namespaces:
+                self._generations[namespace] += 1
+            for cache_key in [k for k in self._entries if k[0] in namespaces]:
+                del self._entries[cache_key]
+
+    def stats(self):
+        """Hit/miss counters and current entry count per namespace."""
+        with self._lock:
+            entries = defaultdict(int)
+            for namespace, _ in self._entries:
+                entries[namespace] += 1
+            return {
+                namespace: dict(counters, entries=entries[namespace])
+                for namespace, counters in sorted(self._counters.items())
+            }
+
+
+# Shared by every session in this process
+shared_cache = ReadThroughCache()
@@ -0,0 +1,83 @@
+"""Score accrual and quiz attempt history."""
+import json
+from datetime import datetime
+
+from sqlalchemy import func, update
+
+from database import engine, QuizAttempt, User
+from read_cache import shared_cache
+import leaderboard
+import spaced_repetition
+
+# Stored in QuizAttempt.answers for questions the user skipped
+UNANSWERED = '-'
+
+
+def encode_answers(answers, count):
+    """Pack {question index: letter} into one letter per question."""
+    return ''.join((answers.get(i) or UNANSWERED).upper()[:1] for i in range(count))
+
+
+def create_user(username):
+    """Insert a user with a zero score and rank them; returns the new user id."""
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        user_id = conn.execute(User.__table__.insert().values(
+            username=username, score=0, last_quiz_date=now
+        )).inserted_primary_key[0]
+        leaderboard.add_users(conn, 0, now)
+    shared_cache.invalidate('leaderboard')
+    return user_id
+
+
+def apply_score_delta(conn, user_id, delta, when=None):
+    """Add delta to a user's score in one atomic UPDATE and return the new score.
+
+    The increment happens inside the database, so concurrent submits from
+    several tabs can never overwrite each other. A quiz taken at when also
+    updates last_quiz_date and today's leaderboard bucket; corrections
+    (when=None) leave both to the caller.
+    """
+    users = User.__table__
+    # The score UPDATE locks the row, so the date it returns is still the old one
+    row = conn.execute(
+        update(users)
+        .where(users.c.id == user_id)
+        .values(score=func.coalesce(users.c.score, 0) + delta)
+        .returning(users.c.score, users.c.last_quiz_date)
+    ).first()
+    if row is None:
+        raise ValueError(f"Unknown user id {user_id}")
+    new_score, old_date = row
+    if when is not None:
+        conn.execute(update(users).where(users.c.id == user_id).values(last_quiz_date=when))
+    leaderboard.move_user(conn, new_score - delta, new_score, old_date, old_date if when is None else when)
+    if when is not None:
+        leaderboard.record_points(conn, user_id, delta, when.date())
+    return new_score
+
+
+def record_quiz_attempt(user_id, question_ids, answers, score, duration_seconds=None, correct=None):
+    """Credit a submitted quiz to the user and append it to the attempt history.
+
+    With correct (one truth value per question), missed questions become
+    review cards and existing cards are rescheduled. All writes happen in one
+    transaction, so a failed submit can be retried without crediting the
+    score twice. Returns the user's new total score.
+    """
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        new_score = apply_score_delta(conn, user_id, score, now)
+        conn.execute(QuizAttempt.__table__.insert().values(
+            user_id=user_id,
+            question_ids=json.dumps(list(question_ids)),
+            answers=encode_answers(answers, len(question_ids)),
+            score=score,
+            total=len(question_ids),
+            duration_seconds=duration_seconds,
+            created_at=now
+        ))
+        if correct is not None:
+            spaced_repetition.record_reviews(conn, user_id, zip(question_ids, (bool(c) for c in correct)), now)
+    shared_cache.invalidate('leaderboard')
+    return new_score
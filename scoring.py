@@ -0,0 +1,180 @@
+"""Vectorized quiz scoring over answer keys and responses encoded as uint8.
+
+Letters A-D are stored as 0-3 and anything else (unanswered, blank or
+malformed) as NOT_ANSWERED, so an attempt is a small byte array and a batch
+of attempts is a padded matrix scored with a single comparison.
+"""
+import json
+from collections import defaultdict, namedtuple
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import bindparam, or_, select, update
+
+from database import engine, Quiz, QuizAttempt
+from read_cache import shared_cache
+import leaderboard
+import scores
+
+LETTERS = 'ABCD'
+# Code of an unanswered question, a missing answer key or padding
+NOT_ANSWERED = 255
+# Attempts loaded and re-scored per batch when regrading
+REGRADE_BATCH_SIZE = 5000
+
+# Byte value -> answer code
+_CODES = np.full(256, NOT_ANSWERED, dtype=np.uint8)
+for _code, _letter in enumerate(LETTERS):
+    _CODES[ord(_letter)] = _CODES[ord(_letter.lower())] = _code
+
+AttemptScore = namedtuple('AttemptScore', ['score', 'correct', 'topics'])
+BatchScore = namedtuple('BatchScore', ['scores', 'correct'])
+RegradeResult = namedtuple('RegradeResult', ['attempts', 'users', 'points'])
+
+
+def encode_letters(letters):
+    """Encode a string with one answer letter per question, e.g. 'AC-B'."""
+    return _CODES[np.frombuffer(letters.encode('ascii', 'replace'), dtype=np.uint8)]
+
+
+def encode_key(correct_answers):
+    """Encode the correct_answer of each question; None or blank keys never match."""
+    return encode_letters(''.join((answer or '').strip()[:1] or '-' for answer in correct_answers))
+
+
+def topic_subtotals(correct, topics):
+    """{topic: (correct, asked)} for per-question topic labels."""
+    labels, inverse = np.unique(np.array(topics, dtype=object), return_inverse=True)
+    right = np.bincount(inverse, weights=correct, minlength=len(labels))
+    asked = np.bincount(inverse, minlength=len(labels))
+    return {label: (int(r), int(a)) for label, r, a in zip(labels, right, asked)}
+
+
+def score_attempt(key, responses, topics=None):
+    """Score one attempt.
+
+    key and responses are equal-length uint8 arrays. Returns an AttemptScore
+    with the point total, the per-question correctness mask and, when topic
+    labels are given, per-topic (correct, asked) subtotals.
+    """
+    correct = (responses == key) & (key != NOT_ANSWERED)
+    subtotals = topic_subtotals(correct, topics) if topics is not None else None
+    return AttemptScore(int(correct.sum()), correct, subtotals)
+
+
+def score_batch(keys, responses):
+    """Score many attempts at once from (attempts x questions) uint8 matrices.
+
+    Shorter attempts are padded with NOT_ANSWERED, which never scores.
+    Returns a BatchScore of per-attempt totals and the correctness matrix.
+    """
+    correct = (responses == keys) & (keys != NOT_ANSWERED)
+    return BatchScore(correct.sum(axis=1), correct)
+
+
+def pad_rows(rows, fill, dtype):
+    """Stack variable-length sequences into a matrix, padding short rows with fill."""
+    matrix = np.full((len(rows), max((len(row) for row in rows), default=0)), fill, dtype=dtype)
+    for i, row in enumerate(rows):
+        matrix[i, :len(row)] = row
+    return matrix
+
+
+def _lookup(question_ids, known_ids, codes):
+    """Map a matrix of question ids to answer codes; ids not in known_ids get NOT_ANSWERED."""
+    if not len(known_ids):
+        return np.full(question_ids.shape, NOT_ANSWERED, dtype=np.uint8)
+    positions = np.minimum(np.searchsorted(known_ids, question_ids), len(known_ids) - 1)
+    return np.where(known_ids[positions] == question_ids, codes[positions], NOT_ANSWERED).astype(np.uint8)
+
+
+def _mentions_any(question_ids_column, quiz_ids):
+    """SQL prefilter for attempts whose JSON id list may contain one of quiz_ids."""
+    patterns = []
+    for quiz_id in quiz_ids:
+        patterns += [f'[{quiz_id}]', f'[{quiz_id},%', f'%, {quiz_id},%', f'%, {quiz_id}]']
+    return or_(*(question_ids_column.like(pattern) for pattern in patterns))
+
+
+def regrade_attempts(conn, old_answers, new_answers, batch_size=REGRADE_BATCH_SIZE):
+    """Re-score past attempts after answer keys changed from old_answers to new_answers.
+
+    Both arguments map quiz id -> letter. Only questions listed there are
+    compared, so each attempt changes by (now correct - was correct) on those
+    questions and questions deleted since are left alone. Attempt scores,
+    user totals and the attempt day's leaderboard bucket are adjusted in the
+    caller's transaction. Returns a RegradeResult.
+    """
+    candidates = sorted(new_answers)
+    old_codes = encode_key(old_answers.get(quiz_id) for quiz_id in candidates)
+    new_codes = encode_key(new_answers[quiz_id] for quiz_id in candidates)
+    changed = old_codes != new_codes
+    if not changed.any():
+        return RegradeResult(0, 0, 0)
+    known_ids = np.array(candidates, dtype=np.int64)[changed]
+    old_codes, new_codes = old_codes[changed], new_codes[changed]
+
+    attempts = QuizAttempt.__table__
+    user_deltas = defaultdict(int)  # (user_id, day) -> points
+    regraded = 0
+    result = conn.execute(
+        select(attempts.c.id, attempts.c.user_id, attempts.c.question_ids, attempts.c.answers, attempts.c.created_at)
+        .where(_mentions_any(attempts.c.question_ids, known_ids.tolist()))
+        .order_by(attempts.c.id)
+    )
+    while True:
+        rows = result.fetchmany(batch_size)
+        if not rows:
+            break
+        question_ids = pad_rows([json.loads(row.question_ids) for row in rows], -1, np.int64)
+        responses = pad_rows([encode_letters(row.answers) for row in rows], NOT_ANSWERED, np.uint8)
+        deltas = (score_batch(_lookup(question_ids, known_ids, new_codes), responses).scores
+                  - score_batch(_lookup(question_ids, known_ids, old_codes), responses).scores)
+
+        updates = [
+            {'attempt_id': row.id, 'delta': int(delta)}
+            for row, delta in zip(rows, deltas) if delta
+        ]
+        if updates:
+            conn.execute(
+                update(attempts).where(attempts.c.id == bindparam('attempt_id'))
+                .values(score=attempts.c.score + bindparam('delta')),
+                updates
+            )
+        for row, delta in zip(rows, deltas):
+            if delta:
+                user_deltas[(row.user_id, (row.created_at or datetime.utcnow()).date())] += int(delta)
+        regraded += len(updates)
+
+    users = defaultdict(int)
+    for (user_id, day), delta in user_deltas.items():
+        users[user_id] += delta
+        leaderboard.record_points(conn, user_id, delta, day)
+    for user_id, delta in users.items():
+        if delta:
+            scores.apply_score_delta(conn, user_id, delta)
+    return RegradeResult(regraded, len(users), sum(users.values()))
+
+
+def fix_answer_keys(new_answers):
+    """Change correct_answer of the given {quiz id: letter} and regrade past attempts.
+
+    The key change and all score adjustments commit together. Returns a
+    RegradeResult.
+    """
+    quizzes = Quiz.__table__
+    new_answers = {quiz_id: answer.strip().upper()[:1] for quiz_id, answer in new_answers.items()}
+    with engine.begin() as conn:
+        old_answers = dict(conn.execute(
+            select(quizzes.c.id, quizzes.c.correct_answer).where(quizzes.c.id.in_(list(new_answers)))
+        ).all())
+        new_answers = {quiz_id: answer for quiz_id, answer in new_answers.items() if quiz_id in old_answers}
+        if new_answers:
+            conn.execute(
+                update(quizzes).where(quizzes.c.id == bindparam('quiz_id'))
+                .values(correct_answer=bindparam('answer')),
+                [{'quiz_id': quiz_id, 'answer': answer} for quiz_id, answer in new_answers.items()]
+            )
+        result = regrade_attempts(conn, old_answers, new_answers)
+    shared_cache.invalidate('quizzes', 'leaderboard')
+    return result
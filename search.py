@@ -0,0 +1,173 @@
+"""Full-text search over quiz questions and newsletters.
+
+On SQLite, quizzes_fts and newsletters_fts are FTS5 external-content
+indexes over the searchable columns. Triggers keep them in sync with
+every insert, delete and text update, whether it comes from the ORM,
+Core or bulk_insert(). Results are ranked by BM25 with column weights.
+Other databases, or SQLite builds without FTS5, fall back to LIKE
+matching.
+"""
+import argparse
+import random
+import re
+import tempfile
+import time
+from collections import namedtuple
+
+from sqlalchemy import and_, create_engine, or_, select, text
+from sqlalchemy.exc import OperationalError
+
+from database import engine, Newsletter, Quiz
+
+SearchHit = namedtuple('SearchHit', ['id', 'title', 'snippet', 'score'])
+
+# Searchable columns and their BM25 weights
+QUIZ_COLUMNS = {'question': 10.0, 'option_a': 1.0, 'option_b': 1.0, 'option_c': 1.0, 'option_d': 1.0}
+NEWSLETTER_COLUMNS = {'title': 10.0, 'summary': 4.0, 'content': 1.0}
+
+# Shortest last word matched as a prefix while typing; shorter prefixes match too much of the bank
+MIN_PREFIX = 3
+
+_TOKEN = re.compile(r'\w+\*?')
+
+
+def _fts_ddl(table, columns):
+    """Statements creating an external-content FTS5 index of table and its sync triggers."""
+    fts = f'{table}_fts'
+    names = ', '.join(columns)
+    new_values = ', '.join(f'new.{column}' for column in columns)
+    old_values = ', '.join(f'old.{column}' for column in columns)
+    delete_old = f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old_values});"
+    insert_new = f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new_values});"
+    return [
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({names}, content='{table}', content_rowid='id', "
+        f"tokenize='porter unicode61 remove_diacritics 2', prefix='2 3')",
+        f"CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN {insert_new} END",
+        f"CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN {delete_old} END",
+        # Only text changes touch the index, not score or difficulty updates
+        f"CREATE TRIGGER {fts}_update AFTER UPDATE OF {names} ON {table} BEGIN {delete_old} {insert_new} END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"
+    ]
+
+
+def ensure_search_index(bind):
+    """Create missing FTS5 indexes and triggers; returns False where FTS5 is unavailable."""
+    if bind.dialect.name != 'sqlite':
+        return False
+    try:
+        with bind.begin() as conn:
+            existing = set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars())
+            for table, columns in (('quizzes', QUIZ_COLUMNS), ('newsletters', NEWSLETTER_COLUMNS)):
+                if f'{table}_fts' not in existing:
+                    for statement in _fts_ddl(table, columns):
+                        conn.execute(text(statement))
+    except OperationalError:
+        # SQLite compiled without FTS5
+        return False
+    return True
+
+
+def match_expression(query):
+    """FTS5 MATCH expression requiring every word.
+
+    'word*' and a last word of at least MIN_PREFIX characters match as prefixes.
+    """
+    tokens = _TOKEN.findall(query)
+    terms = []
+    for i, token in enumerate(tokens):
+        word = token.rstrip('*')
+        prefix = token.endswith('*') or (i == len(tokens) - 1 and len(word) >= MIN_PREFIX)
+        terms.append(f'"{word}"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+def _fts_search(conn, table, columns, title_column, query, limit, where=''):
+    fts = f'{table}_fts'
+    weights = ', '.join(str(weight) for weight in columns.values())
+    # Rank on the index alone, then build snippets and read rows for the top hits only
+    rows = conn.execute(text(
+        f"WITH top AS ("
+        f"SELECT {fts}.rowid AS id, bm25({fts}, {weights}) AS score FROM {fts} "
+        f"{'JOIN ' + table + ' t ON t.id = ' + fts + '.rowid ' if where else ''}"
+        f"WHERE {fts} MATCH :match {where} ORDER BY score LIMIT :limit) "
+        f"SELECT t.id, t.{title_column}, snippet({fts}, -1, '**', '**', '…', 16), top.score "
+        f"FROM top JOIN {fts} ON {fts}.rowid = top.id JOIN {table} t ON t.id = top.id "
+        f"WHERE {fts} MATCH :match ORDER BY top.score"
+    ), {'match': match_expression(query), 'limit': limit}).all()
+    # bm25() is lower for better matches; report higher-is-better scores
+    return [SearchHit(row[0], row[1], row[2], -row[3]) for row in rows]
+
+
+def _like_search(conn, table, columns, title_column, query, limit, extra=None):
+    """LIKE fallback: every word must appear in one of the columns."""
+    words = [token.rstrip('*') for token in _TOKEN.findall(query)]
+    conditions = [or_(*(table.c[column].ilike(f'%{word}%') for column in columns)) for word in words]
+    if extra is not None:
+        conditions.append(extra)
+    rows = conn.execute(
+        select(table.c.id, table.c[title_column]).where(and_(*conditions)).order_by(table.c.id.desc()).limit(limit)
+    ).all()
+    return [SearchHit(row[0], row[1], None, None) for row in rows]
+
+
+def search_quizzes(conn, query, limit=20):
+    """Questions matching query, best first."""
+    if not _TOKEN.search(query):
+        return []
+    if FTS_ENABLED:
+        return _fts_search(conn, 'quizzes', QUIZ_COLUMNS, 'question', query, limit)
+    return _like_search(conn, Quiz.__table__, QUIZ_COLUMNS, 'question', query, limit)
+
+
+def search_newsletters(conn, query, limit=20, published_only=True):
+    """Newsletters matching query, best first."""
+    if not _TOKEN.search(query):
+        return []
+    if FTS_ENABLED:
+        where = 'AND t.is_published = 1' if published_only else ''
+        return _fts_search(conn, 'newsletters', NEWSLETTER_COLUMNS, 'title', query, limit, where)
+    newsletters = Newsletter.__table__
+    extra = newsletters.c.is_published == 1 if published_only else None
+    return _like_search(conn, newsletters, NEWSLETTER_COLUMNS, 'title', query, limit, extra)
+
+
+def _benchmark(row_count, repeats):
+    """Time searches over synthetic questions in a throwaway database."""
+    vocabulary = [f'{stem}{suffix}' for stem in (
+        'neural', 'network', 'gradient', 'descent', 'regression', 'cluster', 'kernel', 'tensor',
+        'vector', 'bayes', 'forest', 'boost', 'layer', 'token', 'embed', 'attention', 'loss', 'model'
+    ) for suffix in ('', 's', 'ing', 'ed', 'ion', 'al', 'ity', 'er')] + [f'term{i}' for i in range(20000)]
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_engine = create_engine(f'sqlite:///{tmp}/search_bench.db')
+        Quiz.__table__.create(bench_engine)
+        Newsletter.__table__.create(bench_engine)
+        ensure_search_index(bench_engine)
+        start = time.perf_counter()
+        with bench_engine.begin() as conn:
+            for chunk in range(0, row_count, 10000):
+                conn.execute(Quiz.__table__.insert(), [{
+                    'question': ' '.join(rng.choices(vocabulary, k=12)),
+                    'option_a': ' '.join(rng.choices(vocabulary, k=3)),
+                    'question_hash': f'{i}'
+                } for i in range(chunk, min(chunk + 10000, row_count))])
+        print(f"Inserted and indexed {row_count:,} questions in {time.perf_counter() - start:.1f}s")
+
+        with bench_engine.connect() as conn:
+            for query in ('gradient descent', 'neur', 'attention layer', 'term123', 'boost*'):
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    hits = _fts_search(conn, 'quizzes', QUIZ_COLUMNS, 'question', query, 20)
+                print(f"{query!r}: {(time.perf_counter() - start) / repeats * 1000:.1f} ms ({len(hits)} hits)")
+        bench_engine.dispose()
+
+
+FTS_ENABLED = ensure_search_index(engine)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time full-text search over synthetic questions")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+    _benchmark(args.rows, args.repeats)
@@ -0,0 +1,117 @@
+"""SM-2 spaced-repetition scheduling of missed questions.
+
+A question answered wrong in a quiz becomes a review card for that user.
+Every later answer to it moves the card's due date with the SM-2
+algorithm. All reads go through the primary key (user_id, quiz_id) or
+the (user_id, due_at) index, so the cost of a query depends on one user's
+cards and not on the size of the table.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from bulk_ingest import dialect_insert
+from database import engine, ReviewCard
+
+# Answer quality (0-5) assigned to wrong and right multiple-choice answers
+QUALITY_WRONG = 1
+QUALITY_RIGHT = 4
+# Easiness factor of a new card and its lower bound
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+
+Schedule = namedtuple('Schedule', ['ease', 'interval_days', 'repetitions', 'lapses'])
+NEW_CARD = Schedule(INITIAL_EASE, 0.0, 0, 0)
+
+_cards = ReviewCard.__table__
+_SCHEDULE_COLUMNS = [_cards.c.ease, _cards.c.interval_days, _cards.c.repetitions, _cards.c.lapses]
+
+
+def sm2(card, quality):
+    """Next Schedule of a card after an answer of the given quality (0-5)."""
+    ease = max(MIN_EASE, card.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    if quality < 3:
+        # Lapse: start the card over from a one-day interval
+        return Schedule(ease, 1.0, 0, card.lapses + 1)
+    if card.repetitions == 0:
+        interval = 1.0
+    elif card.repetitions == 1:
+        interval = 6.0
+    else:
+        interval = card.interval_days * ease
+    return Schedule(ease, interval, card.repetitions + 1, card.lapses)
+
+
+def record_reviews(conn, user_id, results, now=None, new_cards=True):
+    """Reschedule cards from (quiz_id, correct) answers.
+
+    Questions without a card get one when answered wrong (and new_cards is
+    set); right answers to them are ignored. Returns the number of cards
+    written.
+    """
+    now = now or datetime.utcnow()
+    results = dict(results)
+    if not results:
+        return 0
+    existing = {
+        row.quiz_id: Schedule(row.ease, row.interval_days, row.repetitions, row.lapses)
+        for row in conn.execute(
+            select(_cards.c.quiz_id, *_SCHEDULE_COLUMNS)
+            .where(_cards.c.user_id == user_id, _cards.c.quiz_id.in_(list(results)))
+        )
+    }
+    rows = []
+    for quiz_id, correct in results.items():
+        card = existing.get(quiz_id)
+        if card is None and (correct or not new_cards):
+            continue
+        schedule = sm2(card or NEW_CARD, QUALITY_RIGHT if correct else QUALITY_WRONG)
+        rows.append(dict(
+            schedule._asdict(), user_id=user_id, quiz_id=quiz_id,
+            due_at=now + timedelta(days=schedule.interval_days), last_reviewed_at=now
+        ))
+    if rows:
+        stmt = dialect_insert(conn, _cards)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=[_cards.c.user_id, _cards.c.quiz_id],
+            set_={column: stmt.excluded[column] for column in
+                  ('ease', 'interval_days', 'repetitions', 'lapses', 'due_at', 'last_reviewed_at')}
+        ), rows)
+    return len(rows)
+
+
+def review_answer(user_id, quiz_id, correct):
+    """Reschedule one card after it was reviewed; returns its next due date."""
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        record_reviews(conn, user_id, [(quiz_id, correct)], now, new_cards=False)
+        return conn.execute(
+            select(_cards.c.due_at).where(_cards.c.user_id == user_id, _cards.c.quiz_id == quiz_id)
+        ).scalar()
+
+
+def due_cards(conn, user_id, limit=20, now=None):
+    """Quiz ids of the user's cards due by now, most overdue first."""
+    return conn.execute(
+        select(_cards.c.quiz_id)
+        .where(_cards.c.user_id == user_id, _cards.c.due_at <= (now or datetime.utcnow()))
+        .order_by(_cards.c.due_at)
+        .limit(limit)
+    ).scalars().all()
+
+
+def due_count(conn, user_id, now=None):
+    return conn.execute(
+        select(func.count()).select_from(_cards)
+        .where(_cards.c.user_id == user_id, _cards.c.due_at <= (now or datetime.utcnow()))
+    ).scalar()
+
+
+def next_due_at(conn, user_id):
+    """When the user's next card falls due, or None without cards."""
+    return conn.execute(select(func.min(_cards.c.due_at)).where(_cards.c.user_id == user_id)).scalar()
+
+
+def remove_card(conn, user_id, quiz_id):
+    conn.execute(_cards.delete().where(_cards.c.user_id == user_id, _cards.c.quiz_id == quiz_id))
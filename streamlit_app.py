@@ -1,5 +1,6 @@
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
 import numpy as np
 import random
 from PIL import Image
@@ -7,60 +8,34 @@ import PyPDF2
 import pdfplumber
 import re
 import os
+import time
 import plotly.express as px
 from datetime import datetime
 import json
 
-# Initialize database
-import sqlite3
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from bulk_ingest import bulk_insert, quiz_rows_from_questions
+from http_cache import source_key
+from news_ingest import parse_url_list
+from near_duplicates import find_near_duplicates, load_embedder, load_embedding_matrix, sync_embeddings
+from pdf_quiz_cache import pdf_cache_key, pdf_quiz_cache
+from read_cache import shared_cache
+from scores import create_user, encode_answers, record_quiz_attempt
+import leaderboard
+import scoring
+from item_analysis import item_report, refresh_item_stats
+import adaptive
+import spaced_repetition
+import search
+import job_queue
 
-# Create database engine
-engine = create_engine('sqlite:///quiz_db.db')
-Base = declarative_base()
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.exc import IntegrityError
 
-# Define database models
-class User(Base):
-    __tablename__ = 'users'
-    id = Column(Integer, primary_key=True)
-    username = Column(String(50), unique=True)
-    score = Column(Integer, default=0)
-    last_quiz_date = Column(DateTime)
+# Database engine, models and thread-scoped sessions
+from database import Session, delete_quizzes, engine, User, Quiz, QuizEmbedding, Newsletter
 
-class Quiz(Base):
-    __tablename__ = 'quizzes'
-    id = Column(Integer, primary_key=True)
-    question = Column(String(500))
-    option_a = Column(String(200))
-    option_b = Column(String(200))
-    option_c = Column(String(200))
-    option_d = Column(String(200))
-    correct_answer = Column(String(1))
-    image_url = Column(String(200))
-    source = Column(String(200))
-    created_at = Column(DateTime, default=datetime.utcnow)
-
-class Newsletter(Base):
-    __tablename__ = 'newsletters'
-    id = Column(Integer, primary_key=True)
-    title = Column(String(200), nullable=False)
-    summary = Column(Text, nullable=False)  # Key points/summary
-    content = Column(Text, nullable=False)  # Full content
-    image_url = Column(String(500))
-    source_url = Column(String(500))  # New field for storing the source URL
-    date_published = Column(DateTime, default=datetime.utcnow)
-    is_published = Column(Integer, default=1)  # 1 for published, 0 for draft
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-
-# Create tables
-Base.metadata.create_all(engine)
-
-# Initialize session
-Session = sessionmaker(bind=engine)
-session = Session()
+# Session proxy used throughout the app; each script run gets its own session
+session = Session
 
 # Initialize session state
 if 'quiz_score' not in st.session_state:
@@ -73,305 +48,48 @@ if 'user_id' not in st.session_state:
 if 'quiz_source' not in st.session_state:
     st.session_state.quiz_source = None
 
-def extract_questions_from_pdf(pdf_file):
-    """Extract questions and answers from a PDF quiz."""
-    st.subheader("🔍 Extracting Quiz Questions")
-    
-    questions = []
-    try:
-        with pdfplumber.open(pdf_file) as pdf:
-            # Extract all text from all pages
-            full_text = "\n".join(page.extract_text() for page in pdf.pages if page.extract_text())
-            
-            # Split text into lines and clean up
-            lines = [line.strip() for line in full_text.split('\n') if line.strip()]
-            
-            current_question = None
-            current_options = {}
-            current_answers = []
-            
-            # Patterns to match questions and options
-            question_pattern = re.compile(r'^(\d+)\.\s+(.+)$')
-            option_pattern = re.compile(r'^([a-d])\)\s+(.+)$', re.IGNORECASE)
-            answer_pattern = re.compile(r'^Answer:\s*([a-d])$', re.IGNORECASE)
-            
-            for line in lines:
-                # Check if line is a question
-                q_match = question_pattern.match(line)
-                if q_match:
-                    # Save previous question if exists
-                    if current_question and current_options:
-                        questions.append({
-                            'question': current_question,
-                            'options': current_options,
-                            'answer': current_answers[0] if current_answers else None
-                        })
-                    current_question = q_match.group(2)
-                    current_options = {}
-                    current_answers = []
-                
-                # Check if line is an option
-                opt_match = option_pattern.match(line)
-                if opt_match and current_question:
-                    letter = opt_match.group(1).lower()
-                    current_options[letter] = opt_match.group(2)
-                
-                # Check if line is an answer
-                ans_match = answer_pattern.match(line)
-                if ans_match and current_question and current_options:
-                    current_answers.append(ans_match.group(1).lower())
-            
-            # Add the last question if it exists
-            if current_question and current_options:
-                questions.append({
-                    'question': current_question,
-                    'options': current_options,
-                    'answer': current_answers[0] if current_answers else None
-                })
-            
-            # Convert to the format expected by the rest of the application
-            formatted_questions = []
-            for q in questions:
-                formatted_question = {
-                    'question': q['question'],
-                    'options': q['options'],
-                    'answer': q['answer']
-                }
-                formatted_questions.append(formatted_question)
-            
-            # Display extracted questions
-            if formatted_questions:
-                st.success(f"✅ Successfully extracted {len(formatted_questions)} questions!")
-                for i, q in enumerate(formatted_questions, 1):
-                    with st.expander(f"Question {i}", expanded=i==1):
-                        st.write(f"**{q['question']}**")
-                        for letter, text in q['options'].items():
-                            st.write(f"{letter}) {text}")
-                        if q['answer']:
-                            st.success(f"Answer: {q['answer']}")
-                        else:
-                            st.warning("No answer found for this question")
-                return formatted_questions
-            else:
-                st.warning("No questions found in the PDF.")
-                return []
-                
-    except Exception as e:
-        st.error(f"Error processing PDF: {str(e)}")
-        st.error("Please ensure the PDF contains properly formatted quiz questions.")
-        return []
-    
-    except Exception as e:
-        st.error(f"Error analyzing PDF: {str(e)}")
-        st.error("""
-        Possible issues:
-        1. PDF is password protected
-        2. PDF is corrupted
-        3. PDF contains only images (no text layer)
-        4. File is not a valid PDF
-        """)
-    
-    # Show instructions for the user
-    st.subheader("❓ How to Proceed")
-    st.markdown("""
-    Based on the analysis above:
-    
-    1. If you see your text content:
-       - The PDF is being read but we need to adjust the parsing
-       - Please share a sample of how your questions are formatted
-    
-    2. If you see "No text found" or mostly empty results:
-       - Your PDF might be image-based (scanned document)
-       - We'll need to use OCR to extract the text
-    
-    3. If you see error messages:
-       - The PDF might be corrupted or have an unusual format
-       - Try opening it in a PDF viewer to verify it's not damaged
-    
-    **Please share a sample of how your questions are formatted in the PDF**
-    """)
-    
-    return []  # Return empty list since we're just analyzing
-    
-    # Add the last question if it exists
-    if current_question and len(current_options) == 4:
-        questions.append({
-            'question': f"{current_question_number}. {current_question}",
-            'options': current_options
-        })
-        st.write(f"- Added final question: {current_question_number}. {current_question}")
-    
-    # If no questions found, try alternative method using character positions
-    if not questions:
-        st.write("\nNo questions found with text extraction. Trying alternative method...")
-        
-        # Try to extract using character positions
-        st.write("\nProcessing pages with character positions:")
-        for page_num, page in enumerate(pdf.pages, 1):
-            st.write(f"\nPage {page_num}:")
-            
-            # Get all characters with their positions
-            chars = page.chars
-            if not chars:
-                st.write(f"- No characters found on page {page_num}")
-                continue
-                
-            st.write(f"- Found {len(chars)} characters with positions")
-            
-            # Process characters by their positions
-            current_question_text = ""
-            current_question_number = None
-            current_options_text = {}
-            current_question_type = None
-            
-            # Group characters by their vertical position
-            lines = {}
-            for char in chars:
-                y_pos = round(char['top'], 1)
-                if y_pos not in lines:
-                    lines[y_pos] = []
-                lines[y_pos].append(char)
-            
-            # Process each line
-            for y_pos in sorted(lines.keys()):
-                line_chars = sorted(lines[y_pos], key=lambda x: x['x0'])
-                line_text = ''.join(char['text'] for char in line_chars)
-                
-                # Check if this line is a question
-                is_question = False
-                for pattern in question_patterns:
-                    if re.match(pattern, line_text):
-                        is_question = True
-                        break
-                
-                # Check if this line is an option
-                is_option = False
-                for pattern in option_patterns:
-                    if re.match(pattern, line_text):
-                        is_option = True
-                        break
-                
-                if is_question:
-                    st.write(f"- Found question: {line_text}")
-                    
-                    # If we have a complete question, add it
-                    if current_question_text and len(current_options_text) == 4:
-                        questions.append({
-                            'question': f"{current_question_number}. {current_question_text}",
-                            'options': current_options_text
-                        })
-                        st.write(f"  Added question: {current_question_number}. {current_question_text}")
-                    
-                    # Start new question
-                    current_question_number = line_text.split('.')[0].strip()
-                    current_question_text = line_text.split('.')[-1].strip()
-                    current_options_text = {}
-                    current_question_type = 'MCQ'
-                    st.write(f"  New question started: {current_question_number}. {current_question_text}")
-                
-                # If we're in a question and haven't found options yet
-                elif current_question_text and not current_options_text:
-                    # If this line is an option
-                    if is_option:
-                        st.write(f"- Found option: {line_text}")
-                        
-                        # Extract option letter and text
-                        option_letter = line_text[0]  # Get the first character
-                        option_text = line_text[1:].strip()  # Get the rest of the line
-                        
-                        if option_letter and option_text:
-                            # Convert single letter to string key
-                            option_key = str(option_letter)
-                            current_options_text[option_key] = option_text
-                            st.write(f"  Added option {option_key}: {option_text}")
-                        
-                        # If we have all 4 options, add the question
-                        if len(current_options_text) == 4:
-                            questions.append({
-                                'question': f"{current_question_number}. {current_question_text}",
-                                'options': current_options_text
-                            })
-                            st.write(f"  Complete question added: {current_question_number}. {current_question_text}")
-                            current_question_text = None
-                            current_options_text = {}
-                            current_question_number = None
-                            current_question_type = None
-                    
-                    # If this line is not an option, add it to question text
-                    else:
-                        current_question_text += f" {line_text}"
-                        st.write(f"  Added to question: {line_text}")
-                
-                # If we're not in a question but found an option
-                elif is_option:
-                    st.write(f"- Found option without question: {line_text}")
-                    st.write("  Skipping orphaned option")
-    
-    # Show final results
-    st.write("\nFinal Results:")
-    st.write(f"Total questions found: {len(questions)}")
-    for idx, q in enumerate(questions, 1):
-        st.write(f"\nQuestion {idx}:")
-        st.write(f"- {q['question']}")
-        for opt in q['options'].values():
-            st.write(f"- {opt}")
-    
-    return questions
+def render_extracted_question(number, q):
+    """Show one extracted question in an expander."""
+    with st.expander(f"Question {number}", expanded=number <= 2):
+        st.write(f"**{q['question']}**")
+        for letter, text in q['options'].items():
+            st.write(f"{letter.upper()}) {text}")
+        if q['answer']:
+            st.success(f"Correct Answer: {q['answer'].upper()}")
+        else:
+            st.warning("No answer found for this question")
 
-def create_quiz_from_pdf(uploaded_file):
-    try:
-        questions = extract_questions_from_pdf(uploaded_file)
-        
-        if not questions:
-            raise ValueError("No questions found in the PDF. Please ensure the PDF contains quiz questions in the correct format.")
-            
-        # Create a temporary dictionary to store questions and their correct answers
-        temp_questions = []
-        for q in questions:
-            temp_questions.append({
-                'question': q['question'],
-                'options': q['options'],
-                'correct_answer': 'A'  # Default to A
-            })
-        
-        # Show extracted questions for review
-        st.subheader("Extracted Questions")
-        for idx, q in enumerate(temp_questions):
-            with st.expander(f"Question {idx + 1}"):
-                st.write(q['question'])
-                for opt in q['options'].values():
-                    st.write(f"- {opt}")
-                
-                # Allow user to select correct answer
-                q['correct_answer'] = st.selectbox(
-                    "Select correct answer",
-                    ['A', 'B', 'C', 'D'],
-                    index=0,  # Default to A
-                    key=f"correct_{idx}"
-                )
-        
-        # Add to database
-        if st.button("Save Questions"):
-            for q in temp_questions:
-                new_quiz = Quiz(
-                    question=q['question'],
-                    option_a=q['options']['A'],
-                    option_b=q['options']['B'],
-                    option_c=q['options']['C'],
-                    option_d=q['options']['D'],
-                    correct_answer=q['correct_answer'],
-                    source=uploaded_file.name,
-                    created_at=datetime.utcnow()
-                )
-                session.add(new_quiz)
-            session.commit()
-            st.success(f"Successfully added {len(temp_questions)} questions to the quiz!")
-        
-        return temp_questions
-        
-    except Exception as e:
-        st.error(f"Error processing PDF: {str(e)}")
-        return []
+def render_partial_questions(result):
+    """Show the questions a running pdf_quiz job has parsed so far."""
+    for number, q in enumerate(result['questions'], 1):
+        render_extracted_question(number, q)
+
+# Seconds between polls of a running background job
+JOB_POLL_SECONDS = 1.0
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_job_progress(state_key, render_partial=None):
+    """Poll the background job whose id is in st.session_state[state_key] without blocking the page.
+
+    While it runs, render_partial(result) shows the partial result it has
+    reported so far. Once the job has finished, its JobStatus moves to
+    state_key + '_finished' and the whole page reruns to show the outcome.
+    """
+    job = job_queue.get_job(st.session_state[state_key])
+    if job is not None and job.status in (job_queue.QUEUED, job_queue.RUNNING):
+        if job.status == job_queue.QUEUED:
+            # Restart the worker if it died while the job was waiting
+            job_queue.ensure_worker()
+            label = job.message or "Waiting for a worker..."
+        else:
+            label = job.message or "Working..."
+        st.progress(job.progress, text=label)
+        if render_partial is not None and job.result:
+            render_partial(job.result)
+        return
+    st.session_state[state_key + '_finished'] = job
+    del st.session_state[state_key]
+    st.rerun()
 
 # Sample quiz questions (you can expand this list)
 quiz_questions = [
@@ -433,8 +151,28 @@ newsletter_content = [
     }
 ]
 
+def show_question_generation():
+    """Admin button to generate fill-in-the-blank questions from newly published articles."""
+    if st.button("🧠 Generate Questions from Articles",
+                 help="Add fill-in-the-blank questions from published newsletter articles not used yet"):
+        st.session_state.question_job = job_queue.enqueue('generate_questions', {}, st.session_state.user_id,
+                                                          max_attempts=1)
+    if 'question_job' in st.session_state:
+        show_job_progress('question_job')
+    job = st.session_state.pop('question_job_finished', None)
+    if job is None:
+        return
+    if job.status != job_queue.DONE:
+        st.error(job.error)
+        return
+    shared_cache.invalidate('quizzes')
+    result = job.result
+    st.success(f"Generated {result['questions']} questions from {result['articles']} new articles"
+               + (f", skipped {result['skipped']} already in the bank" if result['skipped'] else ""))
+
 def show_create_quiz():
     st.header("Create Quiz")
+    show_question_generation()
     
     # Store questions in session state if not already present
     if 'extracted_questions' not in st.session_state:
@@ -443,50 +181,52 @@ def show_create_quiz():
     # File uploader for PDF
     uploaded_file = st.file_uploader("Upload a PDF containing quiz questions", type=['pdf'])
     
-    if uploaded_file is not None:
-        try:
-            # Create quiz from PDF
-            with st.spinner('Creating quiz from PDF...'):
-                questions = extract_questions_from_pdf(uploaded_file)
-                if questions:
-                    st.session_state.extracted_questions = questions
-                    st.success(f"Successfully created {len(questions)} quiz questions!")
-                    
-                    # Show sample questions
-                    st.subheader("Review Questions")
-                    for i, q in enumerate(questions):
-                        with st.expander(f"Question {i+1}", expanded=i<2):
-                            st.write(f"**{q['question']}**")
-                            for letter, text in q['options'].items():
-                                st.write(f"{letter.upper()}) {text}")
-                            if q.get('answer'):
-                                st.success(f"Correct Answer: {q['answer'].upper()}")
-        except Exception as e:
-            st.error(f"Error processing PDF: {str(e)}")
+    # Each upload is parsed once, by the background worker unless it is already cached
+    if uploaded_file is not None and st.session_state.get('pdf_upload_id') != uploaded_file.file_id:
+        st.session_state.pdf_upload_id = uploaded_file.file_id
+        st.session_state.extracted_questions = pdf_quiz_cache.get(pdf_cache_key(uploaded_file)) or []
+        if not st.session_state.extracted_questions:
+            st.session_state.pdf_job = job_queue.enqueue(
+                'pdf_quiz', {'path': job_queue.save_upload(uploaded_file.getvalue(), '.pdf')},
+                st.session_state.user_id
+            )
+    
+    if 'pdf_job' in st.session_state:
+        st.subheader("🔍 Extracting Quiz Questions")
+        # Questions appear as the worker parses them, as with in-process extraction
+        show_job_progress('pdf_job', render_partial_questions)
+    job = st.session_state.pop('pdf_job_finished', None)
+    if job is not None and job.status == job_queue.DONE:
+        st.session_state.extracted_questions = job.result['questions']
+    elif job is not None:
+        st.error(job.error)
+        st.error("""
+        Possible issues:
+        1. PDF is password protected
+        2. PDF is corrupted
+        3. PDF contains only images (no text layer)
+        4. File is not a valid PDF
+        """)
     
     # Show save section if we have extracted questions
     if st.session_state.extracted_questions:
+        st.success(f"✅ Successfully extracted {len(st.session_state.extracted_questions)} questions!")
+        for number, q in enumerate(st.session_state.extracted_questions, 1):
+            render_extracted_question(number, q)
         st.subheader("Save Quiz")
         quiz_title = st.text_input("Quiz Title", "AI/ML Quiz")
         quiz_description = st.text_area("Description", "A quiz about AI and Machine Learning")
         
         if st.button("Save Quiz"):
             try:
-                # Add quiz to database
-                for q in st.session_state.extracted_questions:
-                    new_quiz = Quiz(
-                        question=q['question'],
-                        option_a=q['options'].get('a', ''),
-                        option_b=q['options'].get('b', ''),
-                        option_c=q['options'].get('c', ''),
-                        option_d=q['options'].get('d', ''),
-                        correct_answer=q.get('answer', 'A').upper(),
-                        source=f"PDF: {uploaded_file.name if uploaded_file else 'Unknown'}"
-                    )
-                    session.add(new_quiz)
-                
-                session.commit()
-                st.success(f"Successfully saved {len(st.session_state.extracted_questions)} questions to the database!")
+                # Add all questions to the database in one bulk transaction
+                rows = quiz_rows_from_questions(
+                    st.session_state.extracted_questions,
+                    source=f"PDF: {uploaded_file.name if uploaded_file else 'Unknown'}"
+                )
+                st.session_state.last_import_stats = bulk_insert(engine, Quiz.__table__, rows,
+                                                                 ignore_duplicates=True)
+                shared_cache.invalidate('quizzes')
                 
                 # Clear the extracted questions
                 st.session_state.extracted_questions = []
@@ -494,7 +234,14 @@ def show_create_quiz():
                 
             except Exception as e:
                 st.error(f"Error saving quiz: {str(e)}")
-                session.rollback()
+    
+    # Report the last bulk save (shown after the rerun that follows it)
+    if st.session_state.get('last_import_stats'):
+        stats = st.session_state.pop('last_import_stats')
+        st.success(f"Successfully saved {stats.rows} questions to the database! "
+                   f"({stats.rows_per_sec:,.0f} rows/sec)")
+        if stats.skipped:
+            st.info(f"Skipped {stats.skipped} questions that already exist in the database")
     
     # Manual quiz creation
     st.subheader("Create Question Manually")
@@ -521,12 +268,228 @@ def show_create_quiz():
                     image_url=image_url if image_url else None,
                     source=source if source else None
                 )
-                session.add(new_quiz)
-                session.commit()
-                st.success("Question added successfully!")
-                st.rerun()
+                try:
+                    session.add(new_quiz)
+                    session.commit()
+                except IntegrityError:
+                    session.rollback()
+                    st.error("This question already exists in the database")
+                else:
+                    shared_cache.invalidate('quizzes')
+                    st.success("Question added successfully!")
+                    st.rerun()
             else:
                 st.error("Please fill in all required fields")
+    
+    show_answer_key_fix()
+    show_near_duplicates()
+
+def show_answer_key_fix():
+    """Admin tool to correct a question's answer key and regrade past attempts."""
+    st.subheader("Fix Answer Key")
+    with st.form("fix_answer_key"):
+        quiz_id = int(st.number_input("Question ID", min_value=1, step=1))
+        new_answer = st.selectbox("Correct Answer", ["A", "B", "C", "D"], key="fix_answer_key_answer")
+        if st.form_submit_button("Update and Regrade"):
+            quiz = get_quiz_row(quiz_id)
+            if quiz is None:
+                st.error(f"No question with ID {quiz_id}")
+            else:
+                result = scoring.fix_answer_keys({quiz_id: new_answer})
+                st.success(
+                    f"#{quiz_id} \"{quiz.question}\" now expects {new_answer}. "
+                    f"Regraded {result.attempts} attempts of {result.users} users ({result.points:+d} points)."
+                )
+
+@st.cache_resource
+def get_question_embedder():
+    """Load the question embedder once per process."""
+    return load_embedder()
+
+def show_near_duplicates():
+    """Admin tool to find and remove reworded copies of the same question."""
+    st.subheader("Near-Duplicate Questions")
+    embedder = get_question_embedder()
+    st.caption(f"Embedding model: {embedder.name}")
+    threshold = st.slider("Similarity threshold", 0.5, 1.0, embedder.default_threshold, 0.01)
+    
+    if st.button("Find Near-Duplicates"):
+        with st.spinner("Embedding new questions and searching for near-duplicates..."):
+            embedded = sync_embeddings(engine, Quiz.__table__, QuizEmbedding.__table__, embedder)
+            ids, matrix = load_embedding_matrix(engine, QuizEmbedding.__table__, embedder)
+            st.session_state.near_duplicates = find_near_duplicates(ids, matrix, threshold)
+        st.caption(f"Embedded {embedded} new questions")
+    
+    pairs = st.session_state.get('near_duplicates')
+    if pairs is None:
+        return
+    if not pairs:
+        st.info("No near-duplicate questions found.")
+        return
+    
+    st.write(f"Found {len(pairs)} near-duplicate pairs")
+    questions = dict(session.query(Quiz.id, Quiz.question).filter(
+        Quiz.id.in_({quiz_id for pair in pairs for quiz_id in pair[:2]})
+    ))
+    for first_id, second_id, similarity in pairs:
+        if first_id not in questions or second_id not in questions:
+            continue  # One of the pair was already removed
+        with st.expander(f"{similarity:.0%} similar: #{first_id} and #{second_id}"):
+            for quiz_id in (first_id, second_id):
+                col1, col2 = st.columns([4, 1])
+                col1.write(f"#{quiz_id}: {questions[quiz_id]}")
+                if col2.button("Delete", key=f"del_near_dup_{first_id}_{second_id}_{quiz_id}"):
+                    delete_quizzes(session, Quiz.id == quiz_id)
+                    session.commit()
+                    shared_cache.invalidate('quizzes')
+                    st.rerun()
+
+def show_review():
+    """Serve the user's due spaced-repetition cards one at a time."""
+    st.header("Review")
+    user_id = st.session_state.user_id
+    
+    with engine.connect() as conn:
+        due = spaced_repetition.due_count(conn, user_id)
+        card_ids = spaced_repetition.due_cards(conn, user_id, limit=1)
+        next_due = spaced_repetition.next_due_at(conn, user_id) if not card_ids else None
+    
+    # Keep showing the card just answered until the user moves on
+    reviewed = st.session_state.get('review_result')
+    quiz_id = reviewed['quiz_id'] if reviewed else (card_ids[0] if card_ids else None)
+    if quiz_id is None:
+        if next_due:
+            st.success(f"Nothing due right now. Next review: {next_due.strftime('%Y-%m-%d %H:%M')} UTC")
+        else:
+            st.info("No review cards yet. Questions you miss in quizzes will show up here.")
+        return
+    
+    quiz = get_quiz_row(quiz_id)
+    if quiz is None:
+        # The question was deleted; drop its card
+        with engine.begin() as conn:
+            spaced_repetition.remove_card(conn, user_id, quiz_id)
+        st.session_state.review_result = None
+        st.rerun()
+    
+    st.caption(f"{due} card{'s' if due != 1 else ''} due")
+    st.subheader(quiz.question)
+    if quiz.image_url:
+        st.image(quiz.image_url, caption="Question Image", use_container_width=True)
+    options = quiz_options(quiz)
+    correct_answer = (quiz.correct_answer or '').strip().upper()
+    
+    if reviewed is None:
+        with st.form(key=f'review_{quiz_id}'):
+            selected = st.radio(
+                "Select your answer",
+                options=list(options.keys()),
+                format_func=lambda x: f"{x}) {options[x]}"
+            )
+            if st.form_submit_button("Check Answer"):
+                is_correct = selected == correct_answer
+                due_at = spaced_repetition.review_answer(user_id, quiz_id, is_correct)
+                st.session_state.review_result = {
+                    'quiz_id': quiz_id, 'selected': selected, 'correct': is_correct, 'due_at': due_at
+                }
+                st.rerun()
+        return
+    
+    if reviewed['correct']:
+        st.success(f"Correct! {reviewed['selected']}) {options.get(reviewed['selected'], '')}")
+    else:
+        st.error(f"Your answer: {reviewed['selected']}) {options.get(reviewed['selected'], '')}")
+        st.write(f"Correct answer: {correct_answer}) {options.get(correct_answer, '')}")
+    st.caption(f"Next review of this question: {reviewed['due_at'].strftime('%Y-%m-%d')}")
+    if st.button("Next Card"):
+        st.session_state.review_result = None
+        st.rerun()
+
+def show_search_results(query):
+    """Ranked newsletter matches for everyone, question matches for admins."""
+    st.header(f"Search results for \"{query}\"")
+    st.caption("Clear the search box to return to the menu.")
+    is_admin = st.session_state.get('is_admin')
+    
+    try:
+        started = time.perf_counter()
+        with engine.connect() as conn:
+            newsletters = search.search_newsletters(conn, query, published_only=not is_admin)
+            # Learners search newsletters only so quiz questions are not spoiled
+            questions = search.search_quizzes(conn, query) if is_admin else []
+        elapsed = time.perf_counter() - started
+    except Exception as e:
+        st.error(f"Search failed: {str(e)}")
+        return
+    
+    st.caption(f"{len(newsletters) + len(questions)} results in {elapsed * 1000:.0f} ms")
+    if not newsletters and not questions:
+        st.info("No matches found.")
+        return
+    
+    if newsletters:
+        st.subheader("Newsletter")
+        for hit in newsletters:
+            with st.expander(hit.title):
+                if hit.snippet:
+                    st.markdown(hit.snippet)
+                st.caption(f"Newsletter item #{hit.id}")
+    
+    if questions:
+        st.subheader("Questions")
+        for hit in questions:
+            st.markdown(f"**#{hit.id}** {hit.snippet or hit.title}")
+
+def show_item_analysis():
+    """Admin view of question difficulty, discrimination and distractor use."""
+    st.header("Item Analysis")
+    st.caption(
+        "P-value is the share of attempts answering correctly. Discrimination is the point-biserial "
+        "correlation between answering correctly and the score on the rest of the quiz."
+    )
+    
+    try:
+        folded = refresh_item_stats()
+        min_attempts = st.slider("Minimum attempts", 1, 50, 5)
+        with engine.connect() as conn:
+            report = item_report(conn, min_attempts)
+    except Exception as e:
+        st.error(f"Error loading item analysis: {str(e)}")
+        return
+    if folded:
+        st.caption(f"Added {folded} new attempts")
+    
+    if report.empty:
+        st.info("No questions have enough attempts yet.")
+        return
+    
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Questions Analyzed", len(report))
+    col2.metric("Flagged", int((report['flag'] != '').sum()))
+    col3.metric("Mean P-Value", f"{report['p_value'].mean():.2f}")
+    
+    if st.checkbox("Only flagged questions"):
+        report = report[report['flag'] != '']
+    
+    st.dataframe(
+        report[['id', 'question', 'correct_answer', 'attempts', 'p_value', 'discrimination',
+                'rate_a', 'rate_b', 'rate_c', 'rate_d', 'flag']],
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            'id': st.column_config.NumberColumn('ID', width='small'),
+            'question': st.column_config.TextColumn('Question', width='large'),
+            'correct_answer': st.column_config.TextColumn('Key', width='small'),
+            'attempts': st.column_config.NumberColumn('Attempts'),
+            'p_value': st.column_config.ProgressColumn('P-Value', format='%.2f', min_value=0, max_value=1),
+            'discrimination': st.column_config.NumberColumn('Discrimination', format='%.2f'),
+            'rate_a': st.column_config.NumberColumn('A', format='%.2f'),
+            'rate_b': st.column_config.NumberColumn('B', format='%.2f'),
+            'rate_c': st.column_config.NumberColumn('C', format='%.2f'),
+            'rate_d': st.column_config.NumberColumn('D', format='%.2f'),
+            'flag': st.column_config.TextColumn('Flag')
+        }
+    )
 
 def show_home():
     st.header("Welcome to AI/ML World")
@@ -541,75 +504,119 @@ def show_home():
     with st.form("start_quiz_form"):
         if st.form_submit_button("Start Quiz"):
             # Reset quiz state
-            st.session_state.current_question = 0
-            st.session_state.quiz_score = 0
-            st.session_state.user_answers = {}
-            st.session_state.quiz_completed = False
+            reset_quiz_state()
             
             # Set flag to show quiz section
             st.session_state.show_quiz = True
             st.rerun()
 
+def build_leaderboard_view(period, days):
+    """Top 10 of a period as (pyarrow table, Plotly figure JSON), or None if nobody qualifies."""
+    with engine.connect() as conn:
+        if days is None:
+            # Top users ordered by score (descending) and last quiz date (most recent first)
+            rows = leaderboard.top_users(conn, 10)
+        else:
+            # Points earned in the window, summed from per-day score buckets
+            rows = leaderboard.top_users_in_window(conn, days, 10)
+    if not rows:
+        return None
+    
+    # Transpose the result rows into columns
+    _, usernames, scores, last_quiz_dates = zip(*rows)
+    table = pa.table({
+        'Rank': pa.array(range(1, len(rows) + 1), pa.int32()),
+        'Username': pa.array([str(name) if name is not None else 'Unknown' for name in usernames], pa.string()),
+        'Score': pa.array([score or 0 for score in scores], pa.int64()),
+        'Last Active': pa.array(last_quiz_dates, pa.timestamp('us'))
+    })
+    
+    # Create interactive bar chart
+    chart_data = table.select(['Username', 'Score']).to_pandas()
+    fig = px.bar(
+        chart_data,
+        x='Username',
+        y='Score',
+        color='Score',
+        color_continuous_scale='Viridis',
+        title=f'Top 10 Users by Score ({period})',
+        labels={'Score': 'Total Score', 'Username': 'User'}
+    )
+    
+    # Customize the chart
+    fig.update_layout(
+        xaxis_tickangle=-45,
+        yaxis_title='Total Score',
+        coloraxis_showscale=False,
+        hovermode='x unified'
+    )
+    
+    # Add horizontal line at average score if there are enough users
+    if len(chart_data) > 2:
+        avg_score = chart_data['Score'].mean()
+        fig.add_hline(
+            y=avg_score,
+            line_dash='dash',
+            line_color='red',
+            annotation_text=f'Average: {avg_score:.1f}'
+        )
+    
+    return table, fig.to_json()
+
+def get_leaderboard_view(period, days):
+    """build_leaderboard_view() shared by all sessions until the next score change."""
+    # Windows move at midnight UTC even when no score changes
+    key = period if days is None else (period, datetime.utcnow().date())
+    return shared_cache.get_or_load('leaderboard', key, lambda: build_leaderboard_view(period, days))
+
 def show_leaderboard():
     st.header("🏆 Leaderboard")
+    period = st.radio("Period", ['All Time', *leaderboard.WINDOWS], horizontal=True)
+    days = leaderboard.WINDOWS.get(period)
     
-    # Always fetch fresh data from the database
+    # The board is shared; only the current user's rank is queried per session
     try:
-        # Start a new session
-        db_session = sessionmaker(bind=engine)()
-        
-        # Get all users ordered by score (descending) and last quiz date (most recent first)
-        users = db_session.query(User).order_by(
-            User.score.desc(),
-            User.last_quiz_date.desc()
-        ).limit(10).all()
-        
-        # Close the session when done
-        db_session.close()
+        leaderboard.compact_if_due()
+        view = get_leaderboard_view(period, days)
+        user_id = st.session_state.get('user_id')
+        with engine.connect() as conn:
+            if days is None:
+                # The current user's true rank among all users, not just the top 10
+                my_rank = leaderboard.user_rank(conn, user_id) if user_id else None
+                if my_rank:
+                    next_rank_score = leaderboard.score_of_next_rank(conn, my_rank.score, my_rank.last_quiz_date)
+            else:
+                my_rank = leaderboard.user_rank_in_window(conn, user_id, days) if user_id else None
+                if my_rank:
+                    next_rank_score = leaderboard.score_of_next_rank_in_window(conn, my_rank.score, days)
         
     except Exception as e:
         st.error(f"Error loading leaderboard: {str(e)}")
         return
     
-    # Create leaderboard data with rank
-    leaderboard_data = []
-    for rank, user in enumerate(users, 1):
-        # Ensure username is not None and is a string
-        username = str(user.username) if user.username is not None else 'Unknown'
-        
-        # Handle last_quiz_date safely
-        if user.last_quiz_date:
-            last_active = user.last_quiz_date.strftime('%Y-%m-%d')
-            days_since = (datetime.utcnow() - user.last_quiz_date).days
+    if view is None:
+        if days is None:
+            st.info("No quiz results yet. Be the first to take the quiz!")
         else:
-            last_active = 'Never'
-            days_since = float('inf')
-            
-        leaderboard_data.append({
-            'Rank': rank,
-            'Username': username,
-            'Score': user.score if user.score is not None else 0,
-            'Last Active': last_active,
-            'Days Since Last Quiz': days_since
-        })
-    
-    if not leaderboard_data:
-        st.info("No quiz results yet. Be the first to take the quiz!")
+            st.info(f"No quizzes taken in this period ({period.lower()}). Take one to top the board!")
         return
+    table, figure_json = view
     
-    # Create DataFrame
-    df = pd.DataFrame(leaderboard_data)
+    # Find the current user's row, if they made the top 10
+    usernames = table.column('Username').to_pylist()
+    my_row = usernames.index(st.session_state.username) if st.session_state.get('username') in usernames else None
     
-    # Highlight current user's row if logged in
-    def highlight_user(row):
-        if 'username' in st.session_state and row['Username'] == st.session_state.username:
-            return ['background-color: #e6f3ff'] * len(row)
-        return [''] * len(row)
+    # Highlight current user's row by styling that single row
+    data = table
+    if my_row is not None:
+        data = table.to_pandas().style.set_properties(
+            subset=pd.IndexSlice[[my_row], :], **{'background-color': '#e6f3ff'}
+        )
     
     # Display styled table
     st.subheader("Top Performers")
     st.dataframe(
-        df[['Rank', 'Username', 'Score', 'Last Active']].style.apply(highlight_user, axis=1),
+        data,
         use_container_width=True,
         hide_index=True,
         column_config={
@@ -620,7 +627,7 @@ def show_leaderboard():
                 help='Total quiz score',
                 format='%d',
                 min_value=0,
-                max_value=df['Score'].max() * 1.1  # 10% buffer for visual appeal
+                max_value=table.column('Score')[0].as_py() * 1.1  # Rows are sorted by score; 10% buffer
             ),
             'Last Active': st.column_config.DateColumn(
                 'Last Active',
@@ -631,58 +638,103 @@ def show_leaderboard():
     )
     
     # Show additional stats if user is logged in
-    if 'user_id' in st.session_state:
-        user_rank = df[df['Username'] == st.session_state.username].index
-        if not user_rank.empty:
-            rank = user_rank[0] + 1
-            user_score = df.loc[user_rank[0], 'Score']
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                st.metric("Your Rank", f"#{rank} of {len(users)}")
-            with col2:
-                st.metric("Your Score", user_score)
-            
-            # Show progress to next rank if not first
-            if rank > 1:
-                if rank > 2:
-                    score_to_next = df.loc[rank-2, 'Score'] - user_score + 1
-                    st.progress(
-                        min(1.0, user_score / (score_to_next + user_score)),
-                        f"You need {score_to_next} more points to reach rank {rank-1}"
-                    )
+    if my_rank:
+        rank, total_users, user_score = my_rank.rank, my_rank.total, my_rank.score
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Your Rank", f"#{rank} of {total_users}")
+        with col2:
+            st.metric("Your Score", user_score)
+        
+        # Show progress to next rank if not first
+        if rank > 1 and next_rank_score is not None:
+            score_to_next = next_rank_score - user_score + 1
+            st.progress(
+                min(1.0, user_score / (score_to_next + user_score)),
+                f"You need {score_to_next} more points to reach rank {rank-1}"
+            )
     
-    # Create interactive bar chart
+    # Point out the current user's bar on a private copy of the shared figure
     st.subheader("Score Distribution")
-    fig = px.bar(
-        df.head(10),  # Show top 10
-        x='Username',
-        y='Score',
-        color='Score',
-        color_continuous_scale='Viridis',
-        title='Top 10 Users by Score',
-        labels={'Score': 'Total Score', 'Username': 'User'}
-    )
-    
-    # Customize the chart
-    fig.update_layout(
-        xaxis_tickangle=-45,
-        yaxis_title='Total Score',
-        coloraxis_showscale=False,
-        hovermode='x unified'
+    figure = json.loads(figure_json)
+    if my_row is not None:
+        figure['layout'].setdefault('annotations', []).append({
+            'x': usernames[my_row],
+            'y': table.column('Score')[my_row].as_py(),
+            'text': 'You',
+            'showarrow': True,
+            'arrowhead': 2
+        })
+    st.plotly_chart(figure, use_container_width=True)
+
+# Number of questions drawn for one quiz session
+QUIZ_LENGTH = 10
+
+def draw_quiz_ids(limit=QUIZ_LENGTH):
+    """Pick a random set of unique question ids for a new quiz session."""
+    return [quiz_id for quiz_id, in session.query(Quiz.id).filter(
+        Quiz.question_hash.isnot(None)
+    ).order_by(func.random()).limit(limit)]
+
+def quiz_options(quiz):
+    """Answer options of a quiz row keyed by letter."""
+    return {
+        'A': quiz.option_a,
+        'B': quiz.option_b,
+        'C': quiz.option_c,
+        'D': quiz.option_d
+    }
+
+def get_quiz_counts():
+    """Total and unique question counts, shared by all sessions."""
+    return shared_cache.get_or_load('quizzes', 'counts', lambda: tuple(
+        session.query(func.count(Quiz.id), func.count(Quiz.question_hash)).one()
+    ))
+
+def get_quiz_row(quiz_id):
+    """Immutable snapshot of one quiz row shared by all sessions, or None if it is gone."""
+    return shared_cache.get_or_load('quizzes', ('row', quiz_id), lambda: session.execute(
+        select(Quiz.__table__).where(Quiz.id == quiz_id)
+    ).first())
+
+def score_quiz(quiz_ids, user_answers):
+    """Score a quiz in one vectorized pass; returns (quiz rows, scoring.AttemptScore).
+
+    Questions are grouped into topics by their source.
+    """
+    rows = [get_quiz_row(quiz_id) for quiz_id in quiz_ids]
+    key = scoring.encode_key(q.correct_answer if q else None for q in rows)
+    responses = scoring.encode_letters(encode_answers(user_answers, len(quiz_ids)))
+    topics = [(q.source if q else None) or 'General' for q in rows]
+    return rows, scoring.score_attempt(key, responses, topics)
+
+def get_difficulty_index():
+    """Adaptive selection index, rebuilt when the question bank changes or expires."""
+    with engine.connect() as conn:
+        return shared_cache.get_or_load('quizzes', 'difficulty_index', lambda: adaptive.build_difficulty_index(conn))
+
+def pick_adaptive_question(ability, exclude):
+    """Id of an unseen question close to the difficulty that suits ability, or None."""
+    return get_difficulty_index().pick(adaptive.target_difficulty(ability), set(exclude))
+
+def rate_adaptive_answer(quiz, selected_option):
+    """Update the Elo estimates with an answer, at most once per question of the quiz."""
+    if quiz.id in st.session_state.rated_ids:
+        return
+    st.session_state.ability = adaptive.record_answer(
+        st.session_state.user_id, quiz.id, selected_option == (quiz.correct_answer or '').strip().upper()
     )
-    
-    # Add horizontal line at average score if there are enough users
-    if len(df) > 2:
-        avg_score = df['Score'].mean()
-        fig.add_hline(
-            y=avg_score,
-            line_dash='dash',
-            line_color='red',
-            annotation_text=f'Average: {avg_score:.1f}'
-        )
-    
-    st.plotly_chart(fig, use_container_width=True)
+    st.session_state.rated_ids.append(quiz.id)
+
+def reset_quiz_state():
+    """Start over with a freshly drawn question set."""
+    st.session_state.current_question = 0
+    st.session_state.quiz_score = 0
+    st.session_state.user_answers = {}
+    st.session_state.quiz_completed = False
+    st.session_state.quiz_ids = None
+    st.session_state.rated_ids = []
 
 def show_quiz():
     st.header("AI/ML Quiz")
@@ -702,68 +754,78 @@ def show_quiz():
     # Get all quizzes from database with debug info
     st.sidebar.subheader("Database Info")
     
-    # Get all quiz questions - cache this to avoid repeated database queries
-    if 'all_quizzes' not in st.session_state:
-        st.session_state.all_quizzes = session.query(Quiz).all()
-    
-    all_quizzes = st.session_state.all_quizzes
+    # Total and unique question counts in one aggregate over the question_hash index
+    total_count, unique_count = get_quiz_counts()
+    duplicate_count = total_count - unique_count
     
     # Show database stats
-    st.sidebar.write(f"Total questions in database: {len(all_quizzes)}")
-    
-    # Check for duplicates
-    seen_questions = {}
-    duplicates = []
-    
-    for quiz in all_quizzes:
-        if quiz.question in seen_questions:
-            duplicates.append((seen_questions[quiz.question], quiz.id))
-        else:
-            seen_questions[quiz.question] = quiz.id
+    st.sidebar.write(f"Total questions in database: {total_count}")
     
     # Show duplicate info
-    if duplicates:
-        st.sidebar.warning(f"Found {len(duplicates)} duplicate questions in database")
+    if duplicate_count:
+        st.sidebar.warning(f"Found {duplicate_count} duplicate questions in database")
         
         # Add button to clean duplicates
         if st.sidebar.button("Clean Duplicate Questions"):
             try:
-                # Keep the first occurrence of each question
-                for original_id, duplicate_id in duplicates:
-                    session.query(Quiz).filter(Quiz.id == duplicate_id).delete()
+                # Legacy duplicates are exactly the rows without a hash; the first
+                # occurrence of each question keeps its hash and survives
+                removed = delete_quizzes(session, Quiz.question_hash.is_(None))
                 session.commit()
-                st.session_state.all_quizzes = session.query(Quiz).all()  # Refresh cached quizzes
-                st.sidebar.success(f"Removed {len(duplicates)} duplicate questions")
+                shared_cache.invalidate('quizzes')
+                st.sidebar.success(f"Removed {removed} duplicate questions")
                 st.rerun()
             except Exception as e:
                 st.sidebar.error(f"Error removing duplicates: {e}")
                 session.rollback()
     
-    # Get unique questions for the quiz - cache this as well
-    if 'quizzes' not in st.session_state:
-        quizzes = []
-        seen = set()
-        for quiz in all_quizzes:
-            if quiz.question not in seen:
-                seen.add(quiz.question)
-                quizzes.append(quiz)
-        st.session_state.quizzes = quizzes
+    st.sidebar.write(f"Unique questions available: {unique_count}")
+    
+    if not unique_count:
+        st.warning("No quizzes available. Please create a quiz first.")
+        return
     
-    quizzes = st.session_state.quizzes
-    st.sidebar.write(f"Unique questions available: {len(quizzes)}")
+    # Random quizzes are drawn up front; adaptive ones pick each question after the
+    # previous answer, so changing the mode starts a new quiz
+    adaptive_mode = st.radio(
+        "Question selection", ["Random", "Adaptive"], horizontal=True, key='quiz_mode',
+        on_change=reset_quiz_state,
+        help="Adaptive picks each question to match your ability estimate"
+    ) == "Adaptive"
+    
+    # Only ids and answers live in session state; question rows are fetched one page at a time
+    if not st.session_state.get('quiz_ids'):
+        if adaptive_mode:
+            with engine.connect() as conn:
+                st.session_state.ability = adaptive.get_ability(conn, st.session_state.user_id)
+            first_id = pick_adaptive_question(st.session_state.ability, ())
+            st.session_state.quiz_ids = [first_id] if first_id is not None else []
+            st.session_state.quiz_length = min(QUIZ_LENGTH, unique_count)
+        else:
+            st.session_state.quiz_ids = draw_quiz_ids()
+            st.session_state.quiz_length = len(st.session_state.quiz_ids)
+        st.session_state.quiz_started_at = time.time()
+        st.session_state.rated_ids = []
     
-    if not quizzes:
+    quiz_ids = st.session_state.quiz_ids
+    if not quiz_ids:
         st.warning("No quizzes available. Please create a quiz first.")
         return
+    if adaptive_mode:
+        st.sidebar.write(f"Ability estimate: {st.session_state.ability:+.2f}")
     
     # Display quiz progress
-    total_questions = len(quizzes)
-    current_q = st.session_state.current_question
+    total_questions = st.session_state.quiz_length
+    current_q = min(st.session_state.current_question, total_questions - 1)
     st.write(f"Question {current_q + 1} of {total_questions}")
     progress = st.progress((current_q + 1) / total_questions)
     
     # Get current question
-    quiz = quizzes[current_q]
+    quiz = get_quiz_row(quiz_ids[current_q])
+    if quiz is None:
+        # The question was deleted since the set was drawn; start a new set
+        reset_quiz_state()
+        st.rerun()
     
     st.subheader(quiz.question)
     
@@ -772,12 +834,7 @@ def show_quiz():
         st.image(quiz.image_url, caption="Question Image", use_container_width=True)
     
     # Display options
-    options = {
-        'A': quiz.option_a,
-        'B': quiz.option_b,
-        'C': quiz.option_c,
-        'D': quiz.option_d
-    }
+    options = quiz_options(quiz)
     
     # Get or initialize user answer for current question
     user_answer = st.session_state.user_answers.get(current_q, '')
@@ -795,7 +852,8 @@ def show_quiz():
         col1, col2 = st.columns(2)
         
         with col1:
-            prev_button = st.form_submit_button("Previous Question", disabled=current_q == 0)
+            # Adaptive answers are final once the next question has been picked
+            prev_button = st.form_submit_button("Previous Question", disabled=current_q == 0 or adaptive_mode)
         
         with col2:
             if current_q < total_questions - 1:
@@ -811,147 +869,176 @@ def show_quiz():
     
     if 'next_button' in locals() and next_button:
         st.session_state.user_answers[current_q] = selected_option
+        if adaptive_mode and current_q == len(quiz_ids) - 1:
+            rate_adaptive_answer(quiz, selected_option)
+            next_id = pick_adaptive_question(st.session_state.ability, quiz_ids)
+            if next_id is None:
+                # The bank ran out; end the quiz with this question, which is already rated
+                st.session_state.quiz_length = len(quiz_ids)
+                st.rerun()
+            quiz_ids.append(next_id)
         st.session_state.current_question = min(total_questions - 1, current_q + 1)
         st.rerun()
     
     if 'submit_button' in locals() and submit_button:
         st.session_state.user_answers[current_q] = selected_option
+        if adaptive_mode:
+            rate_adaptive_answer(quiz, selected_option)
         
-        # Calculate score
-        score = 0
-        for i, q in enumerate(quizzes):
-            if str(st.session_state.user_answers.get(i, '')).upper() == q.correct_answer.upper():
-                score += 1
+        # Calculate score from the answer keys of the drawn questions only
+        result = score_quiz(quiz_ids, st.session_state.user_answers)[1]
+        score = result.score
         
-        # Update user score - use the global session for simplicity
+        # Credit the score with one atomic UPDATE and log the attempt
         try:
-            # Get the user from the database
-            user = session.query(User).filter_by(id=st.session_state.user_id).first()
-            
-            if user:
-                # Calculate new score (add to existing score)
-                new_score = user.score + score
-                
-                # Update user's score and last quiz date
-                user.score = new_score
-                user.last_quiz_date = datetime.utcnow()
-                
-                # Commit the changes
-                session.commit()
-                
-                # Update session state
-                st.session_state.quiz_score = score
-                st.session_state.quiz_completed = True
-                
-                # Clear any cached leaderboard data
-                if 'leaderboard_data' in st.session_state:
-                    del st.session_state.leaderboard_data
-                
-                # Show success message
-                st.success(f"Quiz submitted! You earned {score} points! Total score: {new_score}")
-                
-                # Force a rerun to refresh the UI
-                st.rerun()
-                
+            started_at = st.session_state.get('quiz_started_at')
+            new_score = record_quiz_attempt(
+                st.session_state.user_id,
+                quiz_ids,
+                st.session_state.user_answers,
+                score,
+                duration_seconds=time.time() - started_at if started_at else None,
+                # Missed questions come back in the Review queue
+                correct=result.correct
+            )
         except Exception as e:
-            session.rollback()
             st.error(f"Error updating score: {str(e)}")
             st.stop()
+        
+        # Update session state
+        st.session_state.quiz_score = score
+        st.session_state.quiz_completed = True
+        
+        # Clear any cached leaderboard data
+        if 'leaderboard_data' in st.session_state:
+            del st.session_state.leaderboard_data
+        
+        # Show success message
+        st.success(f"Quiz submitted! You earned {score} points! Total score: {new_score}")
+        
+        # Force a rerun to refresh the UI
+        st.rerun()
     
     # Display score if quiz is completed
     if st.session_state.get('quiz_completed', False):
         st.success(f"Quiz completed! Your score: {st.session_state.quiz_score}/{total_questions}")
         
-        # Show correct answers
+        # Show correct answers; the review needs only this attempt's rows
+        rows, result = score_quiz(quiz_ids, st.session_state.user_answers)
+        st.subheader("Score by Topic")
+        st.dataframe(
+            pd.DataFrame(
+                [(topic, right, asked) for topic, (right, asked) in result.topics.items()],
+                columns=['Topic', 'Correct', 'Questions']
+            ),
+            hide_index=True
+        )
+        
         st.subheader("Quiz Review:")
-        for i, q in enumerate(quizzes):
+        for i, q in enumerate(rows):
+            if q is None:
+                continue
+            q_options = quiz_options(q)
             user_ans = st.session_state.user_answers.get(i, 'Not answered')
-            is_correct = str(user_ans).upper() == q.correct_answer.upper()
+            is_correct = result.correct[i]
             
             with st.expander(f"Question {i+1}: {q.question}", expanded=False):
-                st.write(f"Your answer: {user_ans}) {options.get(user_ans, 'Not answered')}")
-                st.write(f"Correct answer: {q.correct_answer}) {options.get(q.correct_answer.upper(), '')}")
+                st.write(f"Your answer: {user_ans}) {q_options.get(user_ans, 'Not answered')}")
+                st.write(f"Correct answer: {q.correct_answer}) {q_options.get(q.correct_answer.upper(), '')}")
                 st.write("Correct!" if is_correct else "Incorrect")
         
         if st.button("Restart Quiz"):
-            st.session_state.current_question = 0
-            st.session_state.quiz_score = 0
-            st.session_state.user_answers = {}
-            st.session_state.quiz_completed = False
+            reset_quiz_state()
             st.rerun()
-        st.rerun()
 
-def extract_article_from_url(url):
-    """Extract article content from URL and return title, content, and metadata."""
-    try:
-        from newspaper import Article
-        import requests
-        from bs4 import BeautifulSoup
-        
-        # First try with newspaper3k
-        try:
-            article = Article(url)
-            article.download()
-            article.parse()
-            
-            # If we get a title but no content, try a different approach
-            if article.title and (not article.text or len(article.text) < 50):
-                raise Exception("Insufficient content from newspaper3k, trying alternative method")
-                
-            return {
-                'title': article.title,
-                'content': article.text,  # Store full content
-                'summary': article.title,  # Use title as summary for display
-                'image_url': article.top_image or url,  # Store source URL if no image
-                'source_url': url  # Store the original URL
-            }
-            
-        except Exception as e:
-            st.warning(f"Newspaper3k extraction issue: {str(e)[:200]}...")
-            
-            # Fallback to requests + BeautifulSoup
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            response = requests.get(url, headers=headers, timeout=10)
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Try to get title from common meta tags
-            title = ''
-            for tag in ['og:title', 'twitter:title', 'title']:
-                title_tag = soup.find('meta', property=tag) or soup.find('meta', {'name': tag})
-                if title_tag and title_tag.get('content'):
-                    title = title_tag['content']
-                    break
-            
-            # If no title found in meta, try to get it from h1
-            if not title:
-                h1 = soup.find('h1')
-                if h1:
-                    title = h1.get_text(strip=True)
-            
-            # If still no title, use the URL
-            if not title:
-                title = url
-            
-            # Get the first paragraph as summary
-            summary = ''
-            for p in soup.find_all('p'):
-                if len(p.get_text(strip=True)) > 50:  # Only consider paragraphs with some content
-                    summary = p.get_text(strip=True)
-                    break
-            
-            return {
-                'title': title,
-                'content': title,  # Just use title as content for display
-                'summary': summary[:200] + '...' if summary else title,
-                'image_url': url,  # Store source URL as image_url
-                'source_url': url  # Store the original URL
-            }
-            
-    except Exception as e:
-        st.error(f"Error extracting content from URL: {str(e)[:200]}...")
-        return None
+def enqueue_article_import(state_key, urls, date_published, is_published):
+    """Hand article URLs to the background worker and poll the job under state_key."""
+    st.session_state[state_key] = job_queue.enqueue('articles', {
+        'urls': urls,
+        'date_published': datetime.combine(date_published, datetime.min.time()).isoformat(),
+        'is_published': 1 if is_published else 0
+    }, st.session_state.user_id)
+
+def show_article_import(state_key):
+    """Progress of an article import job, then its outcome."""
+    if state_key in st.session_state:
+        show_job_progress(state_key)
+    job = st.session_state.pop(state_key + '_finished', None)
+    if job is None:
+        return
+    if job.status != job_queue.DONE:
+        st.error(f"Import failed after {job.attempts} attempts: {job.error}")
+        return
+    # The worker runs in another process, so this process's cache is refreshed here
+    shared_cache.invalidate('newsletters')
+    result = job.result
+    st.success(
+        f"Imported {result['imported']} articles"
+        + (f": {', '.join(result['titles'])}" if len(result['titles']) <= 3 else "")
+        + (f", skipped {result['skipped']} duplicates" if result['skipped'] else "")
+    )
+    for url, error in result['failed']:
+        st.warning(f"{url}: {error}")
+
+def show_feed_crawl():
+    """Admin button to import new entries of the configured feeds as drafts."""
+    if st.button("🔄 Crawl Feeds Now", help="Add new entries of the feeds in feeds.yaml as drafts"):
+        st.session_state.feed_crawl_job = job_queue.enqueue('crawl_feeds', {}, st.session_state.user_id, max_attempts=1)
+    if 'feed_crawl_job' in st.session_state:
+        show_job_progress('feed_crawl_job')
+    job = st.session_state.pop('feed_crawl_job_finished', None)
+    if job is None:
+        return
+    if job.status != job_queue.DONE:
+        st.error(job.error)
+        return
+    shared_cache.invalidate('newsletters')
+    feeds = job.result['feeds']
+    st.success(f"Crawled {len(feeds)} feeds: {sum(feed['imported'] for feed in feeds)} new drafts")
+    for feed in feeds:
+        if feed['error']:
+            st.warning(f"{feed['feed']}: {feed['error']}")
+        elif feed['failed']:
+            st.warning(f"{feed['feed']}: {len(feed['failed'])} articles could not be extracted")
+
+def newsletter_has_source(url):
+    """Whether an article with this source URL (up to tracking parameters etc.) is already stored."""
+    key = source_key(url)
+    return key is not None and session.execute(
+        select(Newsletter.id).where(Newsletter.source_key == key)
+    ).first() is not None
+
+# Newsletter items rendered per feed page
+NEWSLETTER_PAGE_SIZE = 10
+
+def get_newsletter_page(published_only, cursor=None):
+    """One feed page, newest first, as (rows, cursor of the next page or None).
+
+    Pages are keyset-paginated on (date_published, id) and hold only the list
+    columns; the full content is loaded per item by get_newsletter_content().
+    Shared by all sessions.
+    """
+    def load():
+        newsletters = Newsletter.__table__
+        query = select(
+            newsletters.c.id, newsletters.c.title, newsletters.c.summary, newsletters.c.image_url,
+            newsletters.c.source_url, newsletters.c.date_published, newsletters.c.is_published
+        ).order_by(newsletters.c.date_published.desc(), newsletters.c.id.desc()).limit(NEWSLETTER_PAGE_SIZE + 1)
+        if published_only:
+            query = query.where(newsletters.c.is_published == 1)
+        if cursor is not None:
+            query = query.where(tuple_(newsletters.c.date_published, newsletters.c.id) < tuple_(*cursor))
+        rows = session.execute(query).all()
+        # The extra row only tells whether an older page exists
+        next_cursor = (rows[-2].date_published, rows[-2].id) if len(rows) > NEWSLETTER_PAGE_SIZE else None
+        return tuple(rows[:NEWSLETTER_PAGE_SIZE]), next_cursor
+    return shared_cache.get_or_load('newsletters', ('page', published_only, cursor), load)
+
+def get_newsletter_content(item_id):
+    """Full content of one newsletter item, fetched when a reader expands it."""
+    return shared_cache.get_or_load('newsletters', ('content', item_id), lambda: session.execute(
+        select(Newsletter.content).where(Newsletter.id == item_id)
+    ).scalar())
 
 def show_newsletter():
     st.header("📰 AI/ML Newsletter")
@@ -959,11 +1046,12 @@ def show_newsletter():
     # Show admin notice
     if st.session_state.get('is_admin'):
         st.success("🔧 Admin Mode: You can add and edit newsletter items")
+        show_feed_crawl()
     
     # Admin can add new newsletter items
     if st.session_state.get('is_admin'):
         with st.expander("📝 Add New Newsletter Item", expanded=False):
-            tab1, tab2 = st.tabs(["Manual Entry", "Extract from URL"])
+            tab1, tab2, tab3 = st.tabs(["Manual Entry", "Extract from URL", "Batch Import"])
             
             with tab1:
                 with st.form(key='add_news_form'):
@@ -989,8 +1077,12 @@ def show_newsletter():
                                 )
                                 session.add(new_item)
                                 session.commit()
+                                shared_cache.invalidate('newsletters')
                                 st.success("Newsletter item saved successfully!")
                                 st.rerun()
+                            except IntegrityError:
+                                session.rollback()
+                                st.error("An article with this source URL is already in the newsletter")
                             except Exception as e:
                                 st.error(f"Error saving newsletter item: {e}")
                                 session.rollback()
@@ -1004,49 +1096,53 @@ def show_newsletter():
                     is_published = st.checkbox("Publish immediately", value=True, key='url_publish')
                     
                     if st.form_submit_button("Extract and Save"):
-                        if url:
-                            with st.spinner("Extracting content from URL..."):
-                                article = extract_article_from_url(url)
-                                if article:
-                                    try:
-                                        # Store the source URL in the image_url field if no image is available
-                                        source_url = article.get('source_url', url)
-                                        image_url = article.get('image_url')
-                                        if image_url == url:  # If image_url is the source URL, don't use it as an image
-                                            image_url = None
-                                            
-                                        new_item = Newsletter(
-                                            title=article['title'],
-                                            summary=article.get('summary', article['title']),
-                                            content=article['content'],
-                                            image_url=image_url,
-                                            source_url=source_url,  # Store source URL separately
-                                            date_published=datetime.combine(date_published, datetime.min.time()),
-                                            is_published=1 if is_published else 0
-                                        )
-                                        session.add(new_item)
-                                        session.commit()
-                                        st.success("Article extracted and saved successfully!")
-                                        st.rerun()
-                                    except Exception as e:
-                                        st.error(f"Error saving extracted article: {e}")
-                                        session.rollback()
+                        if url and newsletter_has_source(url):
+                            st.warning("This article is already in the newsletter")
+                        elif url:
+                            # Downloaded and saved by the background worker
+                            enqueue_article_import('article_job', [url], date_published, is_published)
                         else:
                             st.error("Please enter a valid URL")
+                show_article_import('article_job')
+            
+            with tab3:
+                with st.form(key='batch_import_form'):
+                    url_text = st.text_area("Article URLs", help="One URL per line", placeholder="https://example.com/article")
+                    url_file = st.file_uploader("...or a URL list / OPML file", type=['txt', 'opml', 'xml'])
+                    date_published = st.date_input("Publish Date", value=datetime.utcnow().date(), key='batch_date')
+                    is_published = st.checkbox("Publish immediately", value=True, key='batch_publish')
+                    
+                    if st.form_submit_button("Import Articles"):
+                        try:
+                            urls = parse_url_list(url_file.getvalue().decode('utf-8')) if url_file else []
+                            urls += [url for url in parse_url_list(url_text) if url not in urls]
+                        except Exception as e:
+                            st.error(f"Could not read the URL list: {e}")
+                            urls = []
+                        if urls:
+                            enqueue_article_import('article_batch_job', urls, date_published, is_published)
+                        else:
+                            st.error("Please enter at least one http(s) URL")
+                show_article_import('article_batch_job')
     
     # Display newsletter items
     st.subheader("Latest AI/ML News")
     
-    # Get all published newsletter items, sorted by date (newest first)
-    newsletter_items = session.query(Newsletter)
-    
-    # If not admin, only show published items
-    if not st.session_state.get('is_admin'):
-        newsletter_items = newsletter_items.filter(Newsletter.is_published == 1)
+    # Cursors of the pages visited so far; the last one is the page shown
+    if 'newsletter_cursors' not in st.session_state:
+        st.session_state.newsletter_cursors = [None]
+    cursors = st.session_state.newsletter_cursors
     
-    newsletter_items = newsletter_items.order_by(Newsletter.date_published.desc()).all()
+    # One page of items sorted by date (newest first); non-admins only see published ones
+    newsletter_items, next_cursor = get_newsletter_page(
+        published_only=not st.session_state.get('is_admin'), cursor=cursors[-1]
+    )
     
     if not newsletter_items:
+        if len(cursors) > 1:
+            # The page emptied since it was visited (items deleted); go back to the first one
+            st.session_state.newsletter_cursors = [None]
+            st.rerun()
         st.info("No newsletter items available yet. Check back later!")
         return
     
@@ -1060,9 +1156,13 @@ def show_newsletter():
                     st.markdown(f"### {item.title}")
                     st.caption(f"📅 {item.date_published.strftime('%B %d, %Y')}")
                     
-                    # Display just the title as a summary (since we only kept the title as content)
+                    # Key points; imported articles get an extractive summary (see summarizer.py)
                     st.markdown(f"🔹 {item.summary}")
                     
+                    # Full content is only fetched for expanded items
+                    if st.toggle("Read full article", key=f"expand_{item.id}"):
+                        st.markdown(get_newsletter_content(item.id) or "")
+                    
                     # Show source URL if available
                     if item.source_url:
                         st.markdown(f"[🔗 View Source]({item.source_url})", unsafe_allow_html=True)
@@ -1092,8 +1192,9 @@ def show_newsletter():
                         with col_del:
                             if st.button(f"🗑️ Delete", key=f"del_{item.id}"):
                                 try:
-                                    session.delete(item)
+                                    session.query(Newsletter).filter(Newsletter.id == item.id).delete()
                                     session.commit()
+                                    shared_cache.invalidate('newsletters')
                                     st.success("Item deleted successfully!")
                                     st.rerun()
                                 except Exception as e:
@@ -1102,6 +1203,19 @@ def show_newsletter():
             
             # Add a subtle divider between items
             st.markdown("---", unsafe_allow_html=True)
+    
+    # Page navigation
+    col_newer, col_page, col_older = st.columns([1, 2, 1])
+    with col_newer:
+        if st.button("← Newer", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+    with col_page:
+        st.caption(f"Page {len(cursors)}")
+    with col_older:
+        if st.button("Older →", disabled=next_cursor is None):
+            cursors.append(next_cursor)
+            st.rerun()
 
 def show_ai_culture():
     st.header("🤖 AI in Modern Culture")
@@ -1226,13 +1340,11 @@ def show_login():
         # Admin login
         if username == "admin" and password == "admin123":  # Change these credentials in production
             # Check if admin user exists, if not create it
-            admin = session.query(User).filter_by(username="admin").first()
-            if not admin:
-                admin = User(username="admin", score=0, last_quiz_date=datetime.utcnow())
-                session.add(admin)
-                session.commit()
+            admin_id = session.query(User.id).filter_by(username="admin").scalar()
+            if not admin_id:
+                admin_id = create_user("admin")
             
-            st.session_state.user_id = admin.id
+            st.session_state.user_id = admin_id
             st.session_state.is_admin = True
             st.session_state.username = "admin"
             st.sidebar.success("Logged in as Admin")
@@ -1240,13 +1352,11 @@ def show_login():
             
         elif username and password:  # Regular user
             # Check if user exists, if not create new user
-            user = session.query(User).filter_by(username=username).first()
-            if not user:
-                user = User(username=username, score=0, last_quiz_date=datetime.utcnow())
-                session.add(user)
-                session.commit()
+            user_id = session.query(User.id).filter_by(username=username).scalar()
+            if not user_id:
+                user_id = create_user(username)
             
-            st.session_state.user_id = user.id
+            st.session_state.user_id = user_id
             st.session_state.is_admin = False
             st.session_state.username = username
             st.sidebar.success(f"Welcome back, {username}!")
@@ -1279,11 +1389,11 @@ def main():
         return
     
     # Navigation menu - show all options to all users
-    user_menu = ["Home", "Quiz", "Leaderboard", "AI in Culture", "Newsletter"]
+    user_menu = ["Home", "Quiz", "Review", "Leaderboard", "AI in Culture", "Newsletter"]
     
     # Add admin-only options
     if st.session_state.is_admin:
-        user_menu.append("Create Quiz")
+        user_menu += ["Create Quiz", "Item Analysis"]
     
     # Show appropriate menu based on user role
     choice = st.sidebar.selectbox("Menu", user_menu)
@@ -1293,27 +1403,47 @@ def main():
         choice = "Quiz"
         st.session_state.show_quiz = False  # Reset the flag after using it
     
+    # Full-text search replaces the selected page while a query is entered
+    search_query = st.sidebar.text_input("🔍 Search", placeholder="Questions and newsletters")
+    
     # Show current user info
     st.sidebar.write("---")
     st.sidebar.write(f"{'Admin' if st.session_state.is_admin else 'User'} Mode")
+    
+    # Shared read cache effectiveness
+    if st.session_state.is_admin:
+        with st.sidebar.expander("Read Cache Stats"):
+            for namespace, counters in shared_cache.stats().items():
+                st.write(f"**{namespace}**: {counters['hits']} hits, {counters['misses']} misses, "
+                         f"{counters['entries']} cached")
     if st.sidebar.button("Logout"):
         st.session_state.user_id = None
         st.session_state.is_admin = False
         st.rerun()
     
     # Route to selected page
-    if choice == "Home":
+    if search_query.strip():
+        show_search_results(search_query)
+    elif choice == "Home":
         show_home()
     elif choice == "Quiz":
         show_quiz()
+    elif choice == "Review":
+        show_review()
     elif choice == "Leaderboard":
         show_leaderboard()
     elif choice == "Create Quiz" and st.session_state.is_admin:
         show_create_quiz()
+    elif choice == "Item Analysis" and st.session_state.is_admin:
+        show_item_analysis()
     elif choice == "AI in Culture":
         show_ai_culture()
     elif choice == "Newsletter":
         show_newsletter()
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        # Release this run's session and return its connection to the pool
+        Session.remove()
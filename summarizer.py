@@ -0,0 +1,252 @@
+"""Extractive summaries of newsletter articles with TF-IDF TextRank.
+
+A batch of articles is summarized together. Every sentence of the batch is
+vectorized with one TF-IDF model, so IDF weights come from the whole batch.
+Each article's cosine-similarity graph becomes a block of one
+block-diagonal matrix, and a single PageRank power iteration ranks the
+sentences of all articles at once. The best-ranked sentences of an article
+that are not near-copies of each other, in their original order, form its
+summary.
+
+Summaries are cached in article_summaries under a hash of the text and the
+summarizer settings, so re-imports and re-runs never redo the work. IDF
+weights depend on the rest of the batch, so the same text batched with
+other articles can rank its sentences slightly differently. The first
+summary computed for a text is the one cached and reused, which keeps
+the cache key a function of the text alone.
+"""
+import argparse
+import hashlib
+import random
+import re
+import time
+
+import numpy as np
+import scipy.sparse as sp
+from sqlalchemy import bindparam, select, update
+
+from bulk_ingest import dialect_insert
+from database import engine, ArticleSummary, Newsletter
+
+# Bump whenever the ranking changes so cached summaries are recomputed
+SUMMARIZER_VERSION = '1'
+# Sentences in a summary
+SUMMARY_SENTENCES = 3
+# Sentences outside this length range (in words) are never picked
+MIN_SENTENCE_WORDS = 6
+MAX_SENTENCE_WORDS = 60
+# Sentences considered per article; the rest of a long article rarely holds the key points
+MAX_ARTICLE_SENTENCES = 200
+# Cosine similarity above which a sentence repeats one already picked
+REDUNDANCY = 0.7
+# PageRank damping factor and convergence settings
+DAMPING = 0.85
+MAX_ITERATIONS = 100
+TOLERANCE = 1e-6
+
+# Sentence ends: ., ! or ?, optionally followed by a closing quote or bracket,
+# then whitespace and a capital letter (not a digit, as in "Fig. 3")
+_SENTENCE_END = re.compile(r'(?:(?<=[.!?])|(?<=[.!?]["\'”)\]]))\s+(?=["\'“(\[]?[A-Z])')
+
+_summaries = ArticleSummary.__table__
+
+
+def split_sentences(text):
+    """Sentences of text usable in a summary, whitespace-normalized, in order."""
+    sentences = []
+    for paragraph in (text or '').splitlines():
+        for sentence in _SENTENCE_END.split(paragraph.strip()):
+            words = sentence.split()
+            if MIN_SENTENCE_WORDS <= len(words) <= MAX_SENTENCE_WORDS:
+                sentences.append(' '.join(words))
+    return sentences[:MAX_ARTICLE_SENTENCES]
+
+
+def textrank(similarities, damping=DAMPING):
+    """PageRank scores of the nodes of several similarity graphs at once.
+
+    similarities is a list of square, symmetric similarity matrices, one per
+    graph; every graph is ranked independently, with teleport probability
+    spread over its own nodes. Returns one flat array of scores.
+    """
+    sizes = np.array([len(block) for block in similarities])
+    graph = sp.block_diag(similarities, format='csr')
+    degree = np.asarray(graph.sum(axis=1)).ravel()
+    # Row-stochastic transitions; isolated sentences only receive teleport mass
+    transitions = sp.diags(np.divide(1.0, degree, out=np.zeros_like(degree), where=degree > 0)) @ graph
+    teleport = np.repeat((1 - damping) / sizes, sizes)
+    scores = np.repeat(1.0 / sizes, sizes)
+    for _ in range(MAX_ITERATIONS):
+        updated = teleport + damping * (transitions.T @ scores)
+        if np.abs(updated - scores).max() < TOLERANCE:
+            return updated
+        scores = updated
+    return scores
+
+
+def _pick(scores, similarity, count):
+    """Indices of the best-scored sentences that are not near-copies of each other, in text order."""
+    picked = []
+    for i in np.argsort(-scores, kind='stable'):
+        if all(similarity[i, j] < REDUNDANCY for j in picked):
+            picked.append(i)
+            if len(picked) == count:
+                break
+    return sorted(picked)
+
+
+def rank_sentences(texts):
+    """(sentences, TextRank scores, sentence similarity matrix) of every text, in one batch."""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    split = [split_sentences(text) for text in texts]
+    flat = [sentence for article in split for sentence in article]
+    try:
+        # Rows are L2-normalized, so row products are cosine similarities
+        matrix = TfidfVectorizer(stop_words='english', sublinear_tf=True).fit_transform(flat)
+    except ValueError:
+        # No sentences, or nothing but stop words: rank sentences by position
+        return [(article, -np.arange(len(article), dtype=float), np.zeros((len(article), len(article))))
+                for article in split]
+
+    similarities = []
+    start = 0
+    for article in split:
+        block = matrix[start:start + len(article)]
+        similarity = (block @ block.T).toarray()
+        np.fill_diagonal(similarity, 0.0)
+        similarities.append(similarity)
+        start += len(article)
+
+    ranked = [similarity for similarity in similarities if len(similarity)]
+    scores = textrank(ranked) if ranked else np.zeros(0)
+    results = []
+    offset = 0
+    for article, similarity in zip(split, similarities):
+        results.append((article, scores[offset:offset + len(article)], similarity))
+        offset += len(article)
+    return results
+
+
+def summarize_batch(texts, sentences=SUMMARY_SENTENCES):
+    """Extractive summaries of texts (None for texts without usable sentences)."""
+    summaries = []
+    for article, scores, similarity in rank_sentences(texts):
+        if len(article) <= sentences:
+            summaries.append(' '.join(article) or None)
+        else:
+            summaries.append(' '.join(article[i] for i in _pick(scores, similarity, sentences)))
+    return summaries
+
+
+def summary_key(text, sentences=SUMMARY_SENTENCES):
+    """SHA-256 of the summarizer settings plus the text."""
+    digest = hashlib.sha256(f"summarizer-v{SUMMARIZER_VERSION}:{sentences}\0".encode())
+    digest.update((text or '').encode('utf-8'))
+    return digest.hexdigest()
+
+
+def summarize_texts(texts, sentences=SUMMARY_SENTENCES, bind=engine, chunk_size=500):
+    """Cached summaries of texts, computing the missing ones in one batch.
+
+    No transaction is open while summarizing: a read transaction held until
+    the insert would have to become a write one, which SQLite refuses
+    (SQLITE_BUSY_SNAPSHOT) once another writer has committed meanwhile.
+    """
+    keys = [summary_key(text, sentences) for text in texts]
+    missing = {}
+    for key, text in zip(keys, texts):
+        missing.setdefault(key, text)
+
+    found = {}
+    unique = list(missing)
+    with bind.connect() as conn:
+        for i in range(0, len(unique), chunk_size):
+            found.update(conn.execute(
+                select(_summaries.c.content_hash, _summaries.c.summary)
+                .where(_summaries.c.content_hash.in_(unique[i:i + chunk_size]))
+            ).all())
+    for key in found:
+        del missing[key]
+    if missing:
+        computed = dict(zip(missing, summarize_batch(list(missing.values()), sentences)))
+        with bind.begin() as conn:
+            # Another process may have summarized the same text meanwhile
+            conn.execute(dialect_insert(conn, _summaries).on_conflict_do_nothing(), [
+                {'content_hash': key, 'summary': summary} for key, summary in computed.items()
+            ])
+        found.update(computed)
+    return [found[key] for key in keys]
+
+
+def summarize_rows(rows, sentences=SUMMARY_SENTENCES):
+    """Fill the 'summary' of Newsletter row dicts from their 'content'; keeps it where no summary results."""
+    rows = list(rows)
+    for row, summary in zip(rows, summarize_texts([row['content'] for row in rows], sentences)):
+        if summary:
+            row['summary'] = summary
+    return rows
+
+
+def backfill(batch_size=200, everything=False):
+    """Summarize stored newsletter items whose summary is missing or just the title.
+
+    With everything, every item is summarized again. Returns the number of
+    items updated.
+    """
+    newsletters = Newsletter.__table__
+    updated = 0
+    last_id = 0
+    while True:
+        with engine.connect() as conn:
+            query = select(newsletters.c.id, newsletters.c.content).where(newsletters.c.id > last_id)
+            if not everything:
+                query = query.where(newsletters.c.summary.is_(None) | (newsletters.c.summary == newsletters.c.title)
+                                    | (newsletters.c.summary == ''))
+            rows = conn.execute(query.order_by(newsletters.c.id).limit(batch_size)).all()
+        if not rows:
+            return updated
+        last_id = rows[-1].id
+        changes = [
+            {'item_id': row.id, 'new_summary': summary}
+            for row, summary in zip(rows, summarize_texts([row.content for row in rows])) if summary
+        ]
+        if changes:
+            with engine.begin() as conn:
+                conn.execute(
+                    update(newsletters).where(newsletters.c.id == bindparam('item_id'))
+                    .values(summary=bindparam('new_summary')), changes
+                )
+            updated += len(changes)
+
+
+def _benchmark(article_count, paragraphs):
+    """Time batch summarization of synthetic articles."""
+    rng = random.Random(42)
+    vocabulary = [f'word{i}' for i in range(5000)] + ['model', 'data', 'training', 'neural', 'network', 'the', 'of']
+    def sentence():
+        return ' '.join(rng.choices(vocabulary, k=rng.randint(8, 25))).capitalize() + '.'
+    articles = ['\n'.join(' '.join(sentence() for _ in range(5)) for _ in range(paragraphs))
+                for _ in range(article_count)]
+    start = time.perf_counter()
+    summarize_batch(articles)
+    elapsed = time.perf_counter() - start
+    print(f"Summarized {article_count:,} articles of {paragraphs * 5} sentences in {elapsed:.2f}s "
+          f"({elapsed / article_count * 1000:.2f} ms per article)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Extractive summaries of newsletter articles")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = subcommands.add_parser('backfill', help="summarize stored items lacking a summary")
+    backfill_parser.add_argument('--all', action='store_true', help="re-summarize every item")
+    backfill_parser.add_argument('--batch-size', type=int, default=200)
+    benchmark_parser = subcommands.add_parser('benchmark', help="time summarization of synthetic articles")
+    benchmark_parser.add_argument('--articles', type=int, default=1000)
+    benchmark_parser.add_argument('--paragraphs', type=int, default=8)
+    args = parser.parse_args()
+
+    if args.command == 'backfill':
+        print(f"Summarized {backfill(args.batch_size, args.all)} newsletter items")
+    else:
+        _benchmark(args.articles, args.paragraphs)
@@ -0,0 +1,51 @@
+"""Shared test setup: every test runs against a throwaway SQLite database.
+
+DATABASE_URL must be set before database.py is first imported, since it
+creates the engine and tables at import time.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+_tmp = tempfile.mkdtemp(prefix='quiz-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ.setdefault('HTTP_CACHE_DIR', os.path.join(_tmp, 'http_cache'))
+os.environ.setdefault('JOB_DIR', os.path.join(_tmp, 'jobs'))
+os.environ['JOB_WORKER_AUTOSTART'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+@pytest.fixture
+def db():
+    """The test engine, with every table emptied and the shared read cache cleared."""
+    from database import Base, engine
+    from read_cache import shared_cache
+
+    with engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+    shared_cache.invalidate('quizzes', 'newsletters', 'leaderboard')
+    return engine
+
+
+@pytest.fixture
+def quizzes(db):
+    """Insert one question per answer key; returns their ids in order."""
+    from sqlalchemy import select
+
+    from bulk_ingest import bulk_insert
+    from database import Quiz
+
+    def insert(answers):
+        bulk_insert(db, Quiz.__table__, [
+            {'question': f'Question {i}?', 'option_a': 'a', 'option_b': 'b', 'option_c': 'c', 'option_d': 'd',
+             'correct_answer': answer}
+            for i, answer in enumerate(answers)
+        ])
+        with db.connect() as conn:
+            return conn.execute(select(Quiz.id).order_by(Quiz.id)).scalars().all()
+    return insert
@@ -0,0 +1,108 @@
+import os
+from datetime import datetime
+
+from sqlalchemy import select
+
+from conftest import FIXTURES
+import feed_crawler
+from database import Newsletter
+from news_ingest import IngestResult, RateLimiter
+
+RSS = os.path.join(FIXTURES, 'feed.rss')
+ATOM = os.path.join(FIXTURES, 'feed.atom')
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _article(url):
+    return {
+        'title': url.rsplit('/', 1)[-1].title(),
+        'summary': url,
+        'content': f"Machine learning article fetched from {url} for the crawler tests. "
+                   "It has a second sentence so the summarizer has something to rank.",
+        'image_url': None,
+        'source_url': url
+    }
+
+
+def test_parse_rss_fixture():
+    entries = feed_crawler.parse_feed(_read(RSS))
+    # The mailto: entry has no web link and is dropped
+    assert [entry.link for entry in entries] == [
+        'https://news.example.com/attention',
+        'https://news.example.com/boosting',
+        'https://news.example.com/clustering',
+    ]
+    assert entries[1].id == 'news-example-boosting'
+    assert entries[0].title == 'Attention is still all you need'
+    assert entries[0].published == datetime(2024, 1, 3, 9, 0)
+
+
+def test_parse_atom_fixture():
+    entries = feed_crawler.parse_feed(_read(ATOM))
+    assert [entry.link for entry in entries] == [
+        'https://blog.example.org/scaling-laws',
+        'https://blog.example.org/diffusion',
+    ]
+    assert entries[0].id == 'urn:uuid:2f6c1a52-0000-4000-8000-000000000002'
+    # Dates are converted to naive UTC; <updated> stands in for a missing <published>
+    assert entries[0].published == datetime(2024, 2, 2, 10, 0)
+    assert entries[1].published == datetime(2024, 2, 1, 8, 30)
+
+
+def test_new_entries_skips_seen_and_older_entries():
+    entries = feed_crawler.parse_feed(_read(RSS))
+    assert [entry.title for entry in feed_crawler.new_entries(entries, [], None, 10)] == [
+        'Attention is still all you need', 'Gradient boosting on tabular data', 'A primer on clustering'
+    ]
+    fresh = feed_crawler.new_entries(entries, ['https://news.example.com/attention'], datetime(2024, 1, 2, 9, 0), 10)
+    assert [entry.id for entry in fresh] == ['news-example-boosting']
+    assert len(feed_crawler.new_entries(entries, [], None, 2)) == 2
+
+
+def test_crawl_retries_failed_entries_then_finds_nothing_new(db, monkeypatch):
+    flaky = {'https://news.example.com/boosting'}
+    requested = []
+
+    def fake_ingest(urls, **kwargs):
+        requested.append(list(urls))
+        return [IngestResult(url, None, 'HTTP 503') if url in flaky else IngestResult(url, _article(url), None)
+                for url in urls]
+
+    monkeypatch.setattr(feed_crawler, 'ingest_urls', fake_ingest)
+    feed = {'name': 'Fixture', 'url': RSS}
+    limiter = RateLimiter(1000, 1000)
+
+    first = feed_crawler.crawl_feed(feed, limiter)
+    assert (first.new_entries, first.imported, first.error) == (3, 2, None)
+    assert first.failed == [('https://news.example.com/boosting', 'HTTP 503')]
+
+    flaky.clear()
+    second = feed_crawler.crawl_feed(feed, limiter)
+    assert requested[-1] == ['https://news.example.com/boosting']
+    assert (second.new_entries, second.imported, second.failed) == (1, 1, [])
+
+    third = feed_crawler.crawl_feed(feed, limiter)
+    assert (third.new_entries, third.imported) == (0, 0)
+
+    with db.connect() as conn:
+        rows = conn.execute(select(Newsletter.source_url, Newsletter.is_published)).all()
+    assert sorted(url for url, _ in rows) == [
+        'https://news.example.com/attention',
+        'https://news.example.com/boosting',
+        'https://news.example.com/clustering',
+    ]
+    # Crawled entries wait for review as drafts
+    assert {published for _, published in rows} == {0}
+
+
+def test_crawl_reports_unreadable_feed(db):
+    report = feed_crawler.crawl_feed({'name': 'Missing', 'url': os.path.join(FIXTURES, 'missing.xml')},
+                                     RateLimiter(1000, 1000))
+    assert report.error and report.imported == 0
+    with db.connect() as conn:
+        state = feed_crawler.load_state(conn, os.path.join(FIXTURES, 'missing.xml'))
+    assert state == ([], None)
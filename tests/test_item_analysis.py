@@ -0,0 +1,101 @@
+import math
+
+import numpy as np
+import pytest
+from sqlalchemy import select, update
+
+import item_analysis
+from database import delete_quizzes, ItemStats, Quiz, QuizEmbedding
+from scores import create_user, record_quiz_attempt
+
+# One row per attempt at the same three questions, all keyed 'A'. q1 is always
+# right, q2 is right in the attempts with the best rest scores, and q3 is
+# mostly answered 'B'.
+ATTEMPTS = ['AAA', 'AAB', 'ABB', 'ABB', 'AAB']
+
+
+def _record(user_id, quiz_ids, attempts):
+    for letters in attempts:
+        record_quiz_attempt(user_id, quiz_ids, dict(enumerate(letters)), 0)
+
+
+def _report(engine, min_attempts=1):
+    with engine.connect() as conn:
+        return item_analysis.item_report(conn, min_attempts).set_index('id')
+
+
+def test_report_values_and_flags(db, quizzes):
+    q1, q2, q3 = quizzes('AAA')
+    _record(create_user('ann'), [q1, q2, q3], ATTEMPTS)
+    assert item_analysis.refresh_item_stats() == 5
+    report = _report(db)
+
+    assert report['p_value'].tolist() == pytest.approx([1.0, 0.6, 0.2])
+    # q2: rest scores 1, .5, .5 when right and .5, .5 when wrong (mean .6, sd .2)
+    #     (2/3 - 1/2) * sqrt(.6 * .4) / .2 = sqrt(6) / 6
+    # q3: rest score 1 when right and 1, .5, .5, 1 when wrong (mean .8, sd sqrt(.06))
+    #     (1 - 3/4) * sqrt(.2 * .8) / sqrt(.06) = sqrt(6) / 6
+    assert report.loc[q2, 'discrimination'] == pytest.approx(math.sqrt(6) / 6)
+    assert report.loc[q3, 'discrimination'] == pytest.approx(math.sqrt(6) / 6)
+    # Point-biserial is the Pearson correlation of correctness with the rest score
+    rest = np.array([1, .5, .5, .5, .5])
+    assert report.loc[q2, 'discrimination'] == pytest.approx(np.corrcoef([1, 1, 0, 0, 1], rest)[0, 1])
+    # Undefined when everyone answered correctly
+    assert np.isnan(report.loc[q1, 'discrimination'])
+
+    assert (report.loc[q3, 'rate_a'], report.loc[q3, 'rate_b']) == pytest.approx((0.2, 0.8))
+    assert report['flag'].tolist() == ['Too easy', '', 'Check key']
+
+
+def test_refresh_folds_only_new_attempts(db, quizzes):
+    q1, q2, q3 = quizzes('AAA')
+    user = create_user('bo')
+    _record(user, [q1, q2, q3], ATTEMPTS)
+    assert item_analysis.refresh_item_stats(batch_size=2) == 5
+    assert item_analysis.refresh_item_stats() == 0
+
+    _record(user, [q2, q3], ['BA'])
+    assert item_analysis.refresh_item_stats() == 1
+    report = _report(db)
+    assert report['attempts'].tolist() == [5, 6, 6]
+    assert report.loc[q3, 'correct'] == 2
+
+    # A fixed answer key rebuilds every sum from the first attempt
+    with db.begin() as conn:
+        conn.execute(update(Quiz).where(Quiz.id == q3).values(correct_answer='B'))
+    assert item_analysis.refresh_item_stats() == 6
+    report = _report(db)
+    assert report.loc[q3, 'correct'] == 4
+    assert report.loc[q3, 'flag'] == ''
+
+
+def test_report_without_enough_attempts_is_empty(db, quizzes):
+    with db.connect() as conn:
+        assert item_analysis.item_report(conn, item_analysis.MIN_ATTEMPTS).empty
+
+    q1, q2, q3 = quizzes('AAA')
+    _record(create_user('cy'), [q1, q2, q3], ATTEMPTS[:2])
+    assert item_analysis.refresh_item_stats() == 2
+    with db.connect() as conn:
+        report = item_analysis.item_report(conn, item_analysis.MIN_ATTEMPTS)
+    assert report.empty and 'flag' in report
+    # Below MIN_ATTEMPTS questions are reported but never flagged
+    assert set(_report(db)['flag']) == {''}
+
+
+def test_deleted_questions_leave_no_stats_behind(db, quizzes):
+    q1, q2, q3 = quizzes('AAA')
+    _record(create_user('di'), [q1, q2, q3], ATTEMPTS)
+    item_analysis.refresh_item_stats()
+    with db.begin() as conn:
+        conn.execute(QuizEmbedding.__table__.insert(), [{'quiz_id': q3, 'model': 'test', 'vector': b''}])
+        assert delete_quizzes(conn, Quiz.id == q3) == 1
+        assert conn.execute(select(ItemStats.quiz_id)).scalars().all() == [q1, q2]
+        assert conn.execute(select(QuizEmbedding.quiz_id)).first() is None
+
+    # Rebuilding after a key fix skips the deleted question its attempts still list
+    with db.begin() as conn:
+        conn.execute(update(Quiz).where(Quiz.id == q2).values(correct_answer='B'))
+    assert item_analysis.refresh_item_stats() == 5
+    with db.connect() as conn:
+        assert conn.execute(select(ItemStats.quiz_id)).scalars().all() == [q1, q2]
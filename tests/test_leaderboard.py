@@ -0,0 +1,156 @@
+import random
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event, select
+
+import leaderboard
+from database import LeaderboardNode, LeaderboardTieNode, ScoreBucket, User
+from scores import apply_score_delta, create_user
+
+START = datetime(2024, 3, 1, 12, 0)
+
+
+def _expected_ranks(conn):
+    """{user id: rank} by score descending, then most recent quiz first (NULL dates last)."""
+    users = conn.execute(select(User.id, User.score, User.last_quiz_date)).all()
+    ranks = {}
+    for user in users:
+        ahead = sum(
+            1 for other in users
+            if other.score > user.score or (other.score == user.score and other.last_quiz_date is not None and (
+                user.last_quiz_date is None or other.last_quiz_date > user.last_quiz_date))
+        )
+        ranks[user.id] = ahead + 1
+    return ranks
+
+
+def _nodes(conn):
+    return dict(conn.execute(select(LeaderboardNode.node, LeaderboardNode.users).where(LeaderboardNode.users != 0)).all())
+
+
+def _tie_nodes(conn):
+    return {(score, node): users for score, node, users in conn.execute(
+        select(LeaderboardTieNode.score, LeaderboardTieNode.node, LeaderboardTieNode.users)
+        .where(LeaderboardTieNode.users != 0)
+    )}
+
+
+def _populate(engine, count=40, seed=7):
+    rng = random.Random(seed)
+    ids = [create_user(f'user{i}') for i in range(count)]
+    with engine.begin() as conn:
+        # Some users never took a quiz; the raw update bypasses the rank tables, so rebuild them
+        conn.execute(User.__table__.update().where(User.id.in_(ids[:5])).values(last_quiz_date=None))
+        leaderboard.rebuild(conn)
+        for step in range(200):
+            # Few distinct scores, so many users tie
+            apply_score_delta(conn, rng.choice(ids[5:]), rng.randint(0, 2), START + timedelta(minutes=step))
+    return ids
+
+
+def test_fenwick_paths_cover_every_score():
+    for score in (0, 1, 5, 6, 7, 8, 1000, 2 ** 20 + 3):
+        # A score is counted at exactly one node of every prefix query that includes it
+        for bound in (score - 1, score, score + 1, 2 ** 21):
+            hits = set(leaderboard._update_path(score)) & set(leaderboard._query_path(bound))
+            assert len(hits) == (1 if score <= bound else 0)
+
+
+def test_count_at_most_matches_scores(db):
+    _populate(db)
+    with db.connect() as conn:
+        scores = [score for score in conn.execute(select(User.score)).scalars()]
+        for bound in range(-1, max(scores) + 2):
+            assert leaderboard.count_at_most(conn, bound) == sum(1 for s in scores if s <= bound)
+        assert leaderboard.count_users(conn) == len(scores)
+
+
+def test_user_rank_matches_brute_force(db):
+    ids = _populate(db)
+    with db.connect() as conn:
+        expected = _expected_ranks(conn)
+        for user_id in ids:
+            rank = leaderboard.user_rank(conn, user_id)
+            assert rank.rank == expected[user_id]
+            assert rank.total == len(ids)
+        assert leaderboard.user_rank(conn, max(ids) + 1) is None
+
+
+def test_score_of_next_rank(db):
+    ids = _populate(db)
+    with db.connect() as conn:
+        expected = _expected_ranks(conn)
+        users = {row.id: row for row in conn.execute(select(User.id, User.score, User.last_quiz_date))}
+        for user_id in ids:
+            user = users[user_id]
+            ahead = [other for other, rank in expected.items() if rank < expected[user_id]]
+            next_score = leaderboard.score_of_next_rank(conn, user.score, user.last_quiz_date)
+            if not ahead:
+                assert next_score is None
+            else:
+                assert next_score == users[max(ahead, key=expected.get)].score
+
+
+def test_rebuild_reproduces_incremental_nodes(db):
+    _populate(db)
+    with db.begin() as conn:
+        # Scores and dates changed after the rebuild in _populate only move users incrementally
+        incremental = _nodes(conn), _tie_nodes(conn)
+        conn.execute(LeaderboardNode.__table__.delete())
+        leaderboard.ensure_consistent(conn)
+        assert (_nodes(conn), _tie_nodes(conn)) == incremental
+        conn.execute(LeaderboardTieNode.__table__.delete())
+        leaderboard.ensure_consistent(conn)
+        assert (_nodes(conn), _tie_nodes(conn)) == incremental
+
+
+def test_rank_among_many_ties_reads_few_nodes(db):
+    ids = [create_user(f'new{i}') for i in range(30)]
+    with db.begin() as conn:
+        apply_score_delta(conn, ids[10], 0, START)
+    with db.connect() as conn:
+        expected = _expected_ranks(conn)
+        assert [leaderboard.user_rank(conn, user_id).rank for user_id in ids] == [expected[i] for i in ids]
+        assert leaderboard.user_rank(conn, ids[10]).rank == 30
+        # Ranking reads tree nodes, never the tied users themselves
+        statements = []
+        event.listen(conn, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        leaderboard.user_rank(conn, ids[0])
+        assert not any('FROM users' in sql and 'count' in sql.lower() for sql in statements)
+
+
+def test_move_user_shifts_counts(db):
+    user = create_user('a')
+    with db.begin() as conn:
+        before = _nodes(conn), _tie_nodes(conn)
+        last_quiz_date = conn.execute(select(User.last_quiz_date).where(User.id == user)).scalar()
+        leaderboard.move_user(conn, 0, 0, last_quiz_date, last_quiz_date)
+        assert (_nodes(conn), _tie_nodes(conn)) == before
+        leaderboard.move_user(conn, 0, 6, last_quiz_date, START)
+        assert leaderboard.count_at_most(conn, 5) == 0
+        assert leaderboard.count_at_most(conn, 6) == 1
+        assert {score for score, _ in _tie_nodes(conn)} == {6}
+
+
+def test_windowed_ranks_and_compaction(db):
+    today = datetime.utcnow().date()
+    a, b, c = (create_user(name) for name in 'abc')
+    with db.begin() as conn:
+        leaderboard.record_points(conn, a, 5, today)
+        leaderboard.record_points(conn, b, 3, today)
+        leaderboard.record_points(conn, b, 4, today - timedelta(days=3))
+        leaderboard.record_points(conn, c, 9, today - timedelta(days=20))
+    with db.connect() as conn:
+        assert [row.id for row in leaderboard.top_users_in_window(conn, 1)] == [a, b]
+        assert [row.id for row in leaderboard.top_users_in_window(conn, 7)] == [b, a]
+        assert leaderboard.user_rank_in_window(conn, a, 7).rank == 2
+        assert leaderboard.user_rank_in_window(conn, c, 7) is None
+        assert leaderboard.score_of_next_rank_in_window(conn, 5, 7) == 7
+
+    with db.begin() as conn:
+        leaderboard.record_points(conn, a, 2, date(2020, 5, 3))
+        leaderboard.record_points(conn, a, 1, date(2020, 5, 20))
+        assert leaderboard.compact_buckets(conn, today) == (2, 1)
+        buckets = conn.execute(select(ScoreBucket.granularity, ScoreBucket.bucket_start, ScoreBucket.score)
+                               .where(ScoreBucket.user_id == a)).all()
+    assert ('year', date(2020, 1, 1), 3) in buckets
@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from sqlalchemy import select
+
+import http_cache
+import job_queue
+import news_ingest
+from bulk_ingest import bulk_insert
+from database import Newsletter
+
+PAGE = """<html><head><title>{path}</title><meta property="og:title" content="Article {path}"></head>
+<body><nav>Home | About</nav>
+<p>This stand-in article at {path} talks about gradient descent and how learning rates are tuned.</p>
+<p>A second paragraph keeps the summarizer busy with one more sentence about optimizers.</p>
+</body></html>"""
+ETAG = '"v1"'
+
+
+class StandInSite:
+    """Records what a local HTTP server was asked for, and how many requests overlapped per host."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.hits = Counter()
+        self.statuses = []
+        self.active = Counter()
+        self.peak = Counter()
+        self.lock = threading.Lock()
+        self.url = None
+
+
+@pytest.fixture
+def site():
+    state = StandInSite(delay=0.05)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            host = self.headers['Host']
+            with state.lock:
+                state.hits[self.path] += 1
+                state.active[host] += 1
+                state.peak[host] = max(state.peak[host], state.active[host])
+            try:
+                time.sleep(state.delay)
+                if self.headers.get('If-None-Match') == ETAG:
+                    status, body = 304, b''
+                else:
+                    status, body = 200, PAGE.format(path=self.path).encode('utf-8')
+                with state.lock:
+                    state.statuses.append(status)
+                self.send_response(status)
+                self.send_header('ETag', ETAG)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            finally:
+                with state.lock:
+                    state.active[host] -= 1
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    state.url = f'http://127.0.0.1:{server.server_address[1]}'
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def test_requests_per_host_stay_within_the_limit(site):
+    urls = [f'{site.url}/limit-{i}' for i in range(8)]
+    results = news_ingest.ingest_urls(urls, max_workers=8, per_host=2)
+    assert [result.url for result in results] == urls
+    assert all(result.article and not result.error for result in results)
+    # Eight workers were available, but the host never saw more than two requests at once
+    assert list(site.peak.values()) == [2]
+
+
+def test_page_is_downloaded_once_for_both_parsers(site, monkeypatch):
+    seen = {}
+    parse_with_bs4 = news_ingest._parse_with_bs4
+
+    def thin_newspaper(url, html):
+        seen['newspaper'] = html
+        raise ValueError("Insufficient content from newspaper3k")
+
+    def recording_bs4(url, html):
+        seen['bs4'] = html
+        return parse_with_bs4(url, html)
+
+    monkeypatch.setattr(news_ingest, '_parse_with_newspaper', thin_newspaper)
+    monkeypatch.setattr(news_ingest, '_parse_with_bs4', recording_bs4)
+    url = f'{site.url}/fallback'
+    result, = news_ingest.ingest_urls([url])
+
+    assert site.hits['/fallback'] == 1
+    assert seen['newspaper'] is seen['bs4']
+    assert result.article['title'] == 'Article /fallback'
+    assert 'Home | About' not in result.article['content']
+    assert result.article['source_url'] == url
+
+
+def test_import_skips_stored_urls_and_revalidates(db, site, monkeypatch):
+    # Every stored page is stale, so fetching it again sends its ETag
+    monkeypatch.setattr(http_cache.http_cache, 'fresh_seconds', 0)
+    stored, new = f'{site.url}/stored', f'{site.url}/new'
+    bulk_insert(db, Newsletter.__table__, [
+        {'title': 'Stored', 'summary': 'Stored', 'content': 'Stored', 'source_url': stored, 'is_published': 1}
+    ])
+
+    # The stored URL and the repeat of the new one with a tracking parameter are both skipped
+    urls = [stored + '/', new, new + '?utm_source=mail']
+    result = job_queue.import_articles({'urls': urls}, lambda *args: None)
+    assert (result['imported'], result['skipped'], result['failed']) == (1, 2, [])
+    assert '/stored' not in site.hits and site.statuses == [200]
+    with db.connect() as conn:
+        assert sorted(conn.execute(select(Newsletter.source_url)).scalars()) == [new, stored]
+
+    # A second run asks the server again and is answered with 304 from the cached page
+    again, = news_ingest.ingest_urls([new])
+    assert site.statuses == [200, 304]
+    assert again.article['title'] == 'Article /new'
@@ -0,0 +1,95 @@
+import random
+
+from sqlalchemy import select
+
+import question_generator as qg
+from bulk_ingest import bulk_insert
+from database import GeneratedQuestions, Newsletter, Quiz
+from summarizer import rank_sentences
+
+ARTICLES = {
+    'rl': "Reinforcement learning trains an agent to maximize cumulative reward through trial and error. "
+          "The agent observes a state, takes an action and receives a reward from the environment. "
+          "Q-learning estimates the value of each action in each state of the environment. "
+          "Agents discover good strategies by exploring the environment directly.",
+    'boosting': "Gradient boosting builds an ensemble of decision trees one tree at a time. "
+                "Each new tree fits the residual errors left by the previous trees in the ensemble. "
+                "Regularization and shrinkage keep boosted ensembles from overfitting the training data. "
+                "Gradient boosting often wins tabular data competitions on Kaggle.",
+    'clustering': "Clustering groups unlabeled data points by similarity without any supervision. "
+                  "K-means assigns every point to the nearest of k centroids and then updates the centroids. "
+                  "DBSCAN finds clusters as dense regions separated by sparse regions of the feature space. "
+                  "Hierarchical clustering builds a dendrogram by repeatedly merging the closest clusters.",
+}
+
+
+def _index():
+    return qg.TermIndex(list(ARTICLES), list(ARTICLES.values()))
+
+
+def _store(engine, articles, published=1):
+    bulk_insert(engine, Newsletter.__table__, [
+        {'title': name, 'summary': name, 'content': text, 'source_url': f'https://example.com/{name}',
+         'is_published': published}
+        for name, text in articles.items()
+    ])
+
+
+def test_key_terms_are_noun_like():
+    index = _index()
+    terms = {term for name in ARTICLES for term in index.key_terms(name)}
+    assert {'agent', 'environment', 'ensemble', 'dendrogram'} <= terms
+    # Adverbs, participles and adjectives seen only before their noun are never answers
+    assert not terms & {'directly', 'separated', 'cumulative', 'sparse', 'dense'}
+
+
+def test_distractors_match_the_answer_and_avoid_the_sentence():
+    index = _index()
+    assert len(index.distractors('agent', ['each', 'state', 'action'])) == 3
+    for term in ('agent', 'clusters'):
+        distractors = index.distractors(term, ['each', 'state', 'action'])
+        assert distractors
+        assert all(qg._is_plural(d) == qg._is_plural(term) for d in distractors)
+        roots = [qg._roots(d) for d in distractors] + [qg._roots(term), qg._roots('each state action')]
+        assert all(not a & b for i, a in enumerate(roots) for b in roots[i + 1:])
+
+
+def test_questions_from_article_blank_one_key_term():
+    index = _index()
+    sentences, scores, _ = rank_sentences([ARTICLES['rl']])[0]
+    questions = qg.questions_from_article(index, 'rl', sentences, scores, random.Random(1))
+    assert 1 <= len(questions) <= qg.QUESTIONS_PER_ARTICLE
+    for question in questions:
+        assert question['question'].startswith(qg.QUESTION_PREFIX)
+        assert question['question'].count(qg.BLANK) == 1
+        answer = question['options'][question['answer']]
+        filled = question['question'][len(qg.QUESTION_PREFIX):].replace(qg.BLANK, answer)
+        assert filled in sentences
+        assert len(set(question['options'].values())) == 4
+
+
+def test_empty_corpus_has_no_term_index(db):
+    _store(db, {'empty': '', 'stop-words': 'The and of it is to be'})
+    with db.connect() as conn:
+        assert qg.build_term_index(conn) is None
+    assert qg.generate_questions() == qg.GenerationResult(2, 0, 0)
+
+
+def test_generation_is_incremental_and_retries_empty_articles(db):
+    _store(db, {'short': "Transformers rely on attention layers throughout the whole network stack."})
+    _store(db, {'draft': ARTICLES['clustering']}, published=0)
+    assert qg.generate_questions().questions == 0
+    # Nothing new: the short article is not retried against the same corpus
+    assert qg.generate_questions().articles == 0
+
+    _store(db, {name: ARTICLES[name] for name in ('rl', 'boosting')})
+    result = qg.generate_questions()
+    assert result.articles == 3 and result.questions > 0
+    assert qg.generate_questions().articles == 0
+
+    with db.connect() as conn:
+        sources = set(conn.execute(select(Quiz.source)).scalars())
+        tracked = dict(conn.execute(select(GeneratedQuestions.newsletter_id, GeneratedQuestions.corpus_size)).all())
+    assert sources <= {'https://example.com/short', 'https://example.com/rl', 'https://example.com/boosting'}
+    # The draft is never used, and every tracked row saw the grown corpus
+    assert len(tracked) == 3 and set(tracked.values()) == {4}
@@ -0,0 +1,78 @@
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import select
+
+import leaderboard
+import scoring
+from database import Quiz, QuizAttempt, ScoreBucket, User
+from scores import create_user, record_quiz_attempt
+
+
+def _attempt(engine, user_id, quiz_ids, letters):
+    """Record an attempt scored against the current keys; returns its score."""
+    with engine.connect() as conn:
+        keys = dict(conn.execute(select(Quiz.id, Quiz.correct_answer).where(Quiz.id.in_(quiz_ids))).all())
+    score = scoring.score_attempt(
+        scoring.encode_key([keys[quiz_id] for quiz_id in quiz_ids]), scoring.encode_letters(letters)
+    ).score
+    record_quiz_attempt(user_id, quiz_ids, dict(enumerate(letters)), score)
+    return score
+
+
+def _user_score(engine, user_id):
+    with engine.connect() as conn:
+        return conn.execute(select(User.score).where(User.id == user_id)).scalar()
+
+
+def test_score_attempt_ignores_blanks_and_missing_keys():
+    key = scoring.encode_key(['A', 'b', None, ' ', 'D'])
+    result = scoring.score_attempt(key, scoring.encode_letters('ab--x'), ['x', 'x', 'y', 'y', 'y'])
+    assert result.score == 2
+    assert result.correct.tolist() == [True, True, False, False, False]
+    assert result.topics == {'x': (2, 2), 'y': (0, 3)}
+
+
+def test_score_batch_pads_short_attempts():
+    keys = scoring.pad_rows([scoring.encode_key('ABC'), scoring.encode_key('AB')], scoring.NOT_ANSWERED, np.uint8)
+    responses = scoring.pad_rows([scoring.encode_letters('ABD'), scoring.encode_letters('A-')],
+                                 scoring.NOT_ANSWERED, np.uint8)
+    assert scoring.score_batch(keys, responses).scores.tolist() == [2, 1]
+
+
+def test_fix_answer_keys_regrades_attempts_users_and_leaderboard(db, quizzes):
+    # q1 and q11 (ids such as 1 and 11) check that the JSON prefilter does not confuse them
+    ids = quizzes('A' * 12)
+    q1, q2, q11 = ids[0], ids[1], ids[10]
+    alice, bob = create_user('alice'), create_user('bob')
+    assert _attempt(db, alice, [q1, q2], 'AA') == 2   # loses q1 after the fix
+    assert _attempt(db, bob, [q1, q11], 'BA') == 1     # gains q1
+    assert _attempt(db, bob, [q11, q2], 'AC') == 1     # never asked q1: unchanged
+    assert _attempt(db, alice, [q1], '-') == 0         # unanswered: unchanged
+
+    result = scoring.fix_answer_keys({q1: 'b'})
+    assert result == scoring.RegradeResult(attempts=2, users=2, points=0)
+
+    with db.connect() as conn:
+        attempt_scores = conn.execute(select(QuizAttempt.score).order_by(QuizAttempt.id)).scalars().all()
+        assert attempt_scores == [1, 2, 1, 0]
+        assert conn.execute(select(Quiz.correct_answer).where(Quiz.id == q1)).scalar() == 'B'
+        # Today's buckets move with the totals
+        today = dict(conn.execute(
+            select(ScoreBucket.user_id, ScoreBucket.score)
+            .where(ScoreBucket.granularity == 'day', ScoreBucket.bucket_start == datetime.utcnow().date())
+        ).all())
+        assert today == {alice: 1, bob: 3}
+        assert leaderboard.user_rank(conn, bob).rank == 1
+        assert leaderboard.count_users(conn) == 2
+        assert leaderboard.count_at_most(conn, 1) == 1
+    assert (_user_score(db, alice), _user_score(db, bob)) == (1, 3)
+
+
+def test_fix_answer_keys_without_change_is_a_no_op(db, quizzes):
+    q1, = quizzes('C')
+    user = create_user('carol')
+    _attempt(db, user, [q1], 'C')
+    assert scoring.fix_answer_keys({q1: ' c '}) == scoring.RegradeResult(0, 0, 0)
+    assert scoring.fix_answer_keys({q1 + 100: 'A'}) == scoring.RegradeResult(0, 0, 0)
+    assert _user_score(db, user) == 1
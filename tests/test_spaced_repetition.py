@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+import scores
+import spaced_repetition as sr
+from database import delete_quizzes, Quiz, ReviewCard, User
+
+NOW = datetime(2024, 5, 1, 9, 0)
+
+
+def _cards(engine, user_id):
+    with engine.connect() as conn:
+        return {row.quiz_id: row for row in conn.execute(select(ReviewCard).where(ReviewCard.user_id == user_id))}
+
+
+def test_sm2_intervals_grow_after_right_answers():
+    card = sr.NEW_CARD
+    intervals = []
+    for _ in range(4):
+        card = sr.sm2(card, sr.QUALITY_RIGHT)
+        intervals.append(card.interval_days)
+    # Quality 4 leaves the ease unchanged: 1, 6, then interval * ease
+    assert card.ease == pytest.approx(sr.INITIAL_EASE)
+    assert intervals == pytest.approx([1.0, 6.0, 15.0, 37.5])
+    assert card.repetitions == 4 and card.lapses == 0
+
+
+def test_sm2_lapse_restarts_and_lowers_ease():
+    card = sr.sm2(sr.Schedule(2.5, 15.0, 3, 0), sr.QUALITY_WRONG)
+    assert card.interval_days == 1.0 and card.repetitions == 0 and card.lapses == 1
+    assert card.ease == pytest.approx(2.5 + 0.1 - 4 * (0.08 + 4 * 0.02))
+
+
+def test_sm2_ease_never_drops_below_minimum():
+    card = sr.NEW_CARD
+    for _ in range(20):
+        card = sr.sm2(card, 0)
+    assert card.ease == sr.MIN_EASE
+    assert card.lapses == 20
+
+
+def test_record_reviews_creates_cards_only_for_misses(db, quizzes):
+    q1, q2, q3 = quizzes('AAA')
+    user = scores.create_user('dana')
+    with db.begin() as conn:
+        assert sr.record_reviews(conn, user, [(q1, False), (q2, True), (q3, False)], NOW) == 2
+    cards = _cards(db, user)
+    assert set(cards) == {q1, q3}
+    assert cards[q1].due_at == NOW + timedelta(days=1)
+
+    with db.begin() as conn:
+        # A right answer now advances the existing card; unknown questions stay untracked
+        sr.record_reviews(conn, user, [(q1, True), (q2, True)], NOW + timedelta(days=1))
+        assert sr.record_reviews(conn, user, [(q2, False)], NOW, new_cards=False) == 0
+    cards = _cards(db, user)
+    assert set(cards) == {q1, q3}
+    assert cards[q1].repetitions == 1
+    assert cards[q1].due_at == NOW + timedelta(days=2)
+
+
+def test_due_cards_are_most_overdue_first(db, quizzes):
+    q1, q2, q3 = quizzes('AAA')
+    user = scores.create_user('eve')
+    with db.begin() as conn:
+        sr.record_reviews(conn, user, [(q2, False)], NOW - timedelta(days=5))
+        sr.record_reviews(conn, user, [(q1, False)], NOW - timedelta(days=2))
+        sr.record_reviews(conn, user, [(q3, False)], NOW)
+    with db.connect() as conn:
+        assert sr.due_cards(conn, user, now=NOW) == [q2, q1]
+        assert sr.due_count(conn, user, now=NOW) == 2
+        assert sr.next_due_at(conn, user) == NOW - timedelta(days=4)
+
+
+def test_quiz_attempt_schedules_cards_in_the_same_transaction(db, quizzes, monkeypatch):
+    q1, q2 = quizzes('AA')
+    user = scores.create_user('finn')
+    assert scores.record_quiz_attempt(user, [q1, q2], {0: 'A', 1: 'C'}, 1, correct=[True, False]) == 1
+    assert set(_cards(db, user)) == {q2}
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("scheduling failed")
+
+    monkeypatch.setattr(sr, 'record_reviews', fail)
+    with pytest.raises(RuntimeError):
+        scores.record_quiz_attempt(user, [q1, q2], {0: 'A', 1: 'A'}, 2, correct=[True, True])
+    # Nothing was credited, so retrying the submit cannot count the attempt twice
+    with db.connect() as conn:
+        assert conn.execute(select(User.score).where(User.id == user)).scalar() == 1
+
+
+def test_deleted_question_leaves_the_review_queue(db, quizzes):
+    q1, q2 = quizzes('AA')
+    user = scores.create_user('gus')
+    with db.begin() as conn:
+        sr.record_reviews(conn, user, [(q1, False), (q2, False)], NOW)
+        delete_quizzes(conn, Quiz.id == q1)
+    with db.connect() as conn:
+        assert sr.due_cards(conn, user, now=NOW + timedelta(days=1)) == [q2]